@@ -0,0 +1,43 @@
+import argparse
+
+from nlp_project.clients.fake_server import FakeLLMServer, FakeServerConfig, Latency
+
+parser = argparse.ArgumentParser(
+    description=(
+        "Serve fake OpenAI chat-completions and embeddings endpoints for "
+        "load-testing the experiment. Point base_url in llm_config.toml at "
+        "http://<host>:<port>/v1 to use it."
+    )
+)
+parser.add_argument("--host", default="127.0.0.1")
+parser.add_argument("--port", type=int, default=8000)
+parser.add_argument(
+    "--latency",
+    type=Latency.parse,
+    default=Latency.parse("lognormal:1,0.5"),
+    help="e.g. fixed:0.5, uniform:0.2,1.5, exponential:1 or lognormal:1,0.5",
+)
+parser.add_argument("--seconds-per-output-token", type=float, default=0.0)
+parser.add_argument("--error-rate", type=float, default=0.0)
+parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+parser.add_argument("--retry-after", type=float, default=1.0)
+parser.add_argument("--requests-per-minute", type=int, default=None)
+parser.add_argument("--tokens-per-minute", type=int, default=None)
+parser.add_argument("--seed", type=int, default=None)
+args = parser.parse_args()
+
+server = FakeLLMServer(
+    (args.host, args.port),
+    FakeServerConfig(
+        latency=args.latency,
+        seconds_per_output_token=args.seconds_per_output_token,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        retry_after=args.retry_after,
+        requests_per_minute=args.requests_per_minute,
+        tokens_per_minute=args.tokens_per_minute,
+        seed=args.seed,
+    ),
+)
+print(f"Fake LLM server listening on {server.base_url}")
+server.serve_forever()
@@ -0,0 +1,70 @@
+import math
+import threading
+from statistics import NormalDist
+
+from pydantic import BaseModel, Field, model_validator
+
+
+class AdaptiveSampling(BaseModel):
+    """
+    Settings for sampling each (solver, problem) pair until its score estimate
+    has settled, instead of a fixed number of times.
+
+    Scores are treated as Bernoulli outcomes. A pair has settled once the
+    Wilson score interval of its mean score, at the given confidence, is at
+    most `tolerance` wide on either side.
+    """
+
+    min_samples: int = Field(2, ge=1)
+    max_samples: int = Field(6, ge=1)
+    confidence: float = Field(0.9, gt=0, lt=1)
+    tolerance: float = Field(0.3, gt=0)
+
+    @model_validator(mode="after")
+    def check_sample_bounds(self) -> "AdaptiveSampling":
+        if self.max_samples < self.min_samples:
+            raise ValueError("max_samples must be at least min_samples")
+        return self
+
+    def half_width(self, scores: list[float]) -> float:
+        """
+        Half-width of the Wilson score interval of the mean of `scores`.
+        """
+        if not scores:
+            return math.inf
+        n = len(scores)
+        p = min(1.0, max(0.0, sum(scores) / n))
+        z = NormalDist().inv_cdf((1 + self.confidence) / 2)
+        return z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / (1 + z * z / n)
+
+    def is_settled(self, scores: list[float]) -> bool:
+        if len(scores) < self.min_samples:
+            return False
+        return len(scores) >= self.max_samples or (
+            self.half_width(scores) <= self.tolerance
+        )
+
+
+class SampleBudget:
+    """
+    Pool of samples beyond each pair's minimum, shared by all pairs of an
+    experiment. Samples saved by pairs that settle early remain in the pool
+    for the pairs that are still uncertain.
+    """
+
+    def __init__(self, samples: int):
+        self.remaining = max(0, samples)
+        self.__lock = threading.Lock()
+
+    def take(self) -> bool:
+        """
+        Take one sample from the pool.
+
+        Returns:
+            Whether a sample was available
+        """
+        with self.__lock:
+            if self.remaining <= 0:
+                return False
+            self.remaining -= 1
+            return True
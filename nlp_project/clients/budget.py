@@ -0,0 +1,120 @@
+import threading
+from typing import Optional
+
+from pydantic import BaseModel
+
+
+class BudgetConfig(BaseModel):
+    """
+    The `[budget]` section of `llm_config.toml`.
+
+    Attributes:
+        input_price_per_million: Price of a million prompt tokens
+        output_price_per_million: Price of a million completion tokens
+        max_tokens: Tokens a process may spend on solver requests, or None
+        max_cost: Cost a process may spend on solver requests, or None
+    """
+
+    input_price_per_million: float = 0.0
+    output_price_per_million: float = 0.0
+    max_tokens: Optional[int] = None
+    max_cost: Optional[float] = None
+
+    def cost(self, input_tokens: float, output_tokens: float) -> float:
+        return (
+            input_tokens * self.input_price_per_million
+            + output_tokens * self.output_price_per_million
+        ) / 1_000_000
+
+
+class BudgetExceeded(Exception):
+    """
+    A request would take the spending past the configured budget.
+    """
+
+
+class TokenBudget:
+    """
+    Hard limit on the tokens and cost of the requests of a process.
+
+    Requests reserve their estimated tokens before they are sent and settle
+    the reservation with their actual usage, so requests in flight cannot
+    overshoot the limit together.
+    """
+
+    def __init__(self, config: BudgetConfig):
+        self.config = config
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.exhausted = False
+        self.__reserved_input = 0
+        self.__reserved_output = 0
+        self.__lock = threading.Lock()
+
+    @property
+    def cost(self) -> float:
+        return self.config.cost(self.input_tokens, self.output_tokens)
+
+    def reserve(self, input_tokens: int, output_tokens: int) -> None:
+        """
+        Reserve the estimated tokens of a request.
+
+        Raises:
+            BudgetExceeded: If the request could take the spending past the
+                budget. The budget is exhausted from then on.
+        """
+        with self.__lock:
+            if not self.exhausted:
+                total_input = self.input_tokens + self.__reserved_input + input_tokens
+                total_output = (
+                    self.output_tokens + self.__reserved_output + output_tokens
+                )
+                self.exhausted = (
+                    self.config.max_tokens is not None
+                    and total_input + total_output > self.config.max_tokens
+                ) or (
+                    self.config.max_cost is not None
+                    and self.config.cost(total_input, total_output)
+                    > self.config.max_cost
+                )
+            if self.exhausted:
+                raise BudgetExceeded(
+                    f"Budget reached after {self.input_tokens + self.output_tokens} "
+                    f"tokens ({self.cost:.2f})"
+                )
+            self.__reserved_input += input_tokens
+            self.__reserved_output += output_tokens
+
+    def settle(
+        self,
+        reserved_input: int,
+        reserved_output: int,
+        input_tokens: int,
+        output_tokens: int,
+    ) -> None:
+        """
+        Replace a reservation with the tokens the request actually used.
+        """
+        with self.__lock:
+            self.__reserved_input -= reserved_input
+            self.__reserved_output -= reserved_output
+            self.input_tokens += input_tokens
+            self.output_tokens += output_tokens
+
+
+_budgets: dict[str, TokenBudget] = {}
+_budgets_lock = threading.Lock()
+
+
+def get_token_budget(config: BudgetConfig) -> Optional[TokenBudget]:
+    """
+    Return the process-wide budget of the given configuration, or None if it
+    sets no limit.
+    """
+    if config.max_tokens is None and config.max_cost is None:
+        return None
+    key = config.model_dump_json()
+    with _budgets_lock:
+        if key not in _budgets:
+            _budgets[key] = TokenBudget(config)
+        return _budgets[key]
@@ -0,0 +1,96 @@
+import asyncio
+import time
+from contextvars import ContextVar
+from typing import Awaitable, Optional, TypeVar
+
+from pydantic import BaseModel
+
+T = TypeVar("T")
+
+# Monotonic time by which the current task must be done, if any
+task_deadline: ContextVar[Optional[float]] = ContextVar("task_deadline", default=None)
+
+
+class DeadlineConfig(BaseModel):
+    """
+    The `[deadlines]` section of `llm_config.toml`.
+
+    Attributes:
+        straggler_quantile: Latency quantile of a provider that a call's
+            deadline is based on
+        straggler_multiplier: A call is a straggler once it has run this many
+            times the quantile
+        min_call_seconds: Shortest deadline given to a call
+        call_seconds: Deadline of calls to providers without enough latency
+            history yet, or None to let them run
+        max_straggler_retries: How many times a straggling call is cancelled and
+            sent again. The last attempt has no call deadline.
+        task_seconds: Deadline of the whole solve of one iteration, or None
+    """
+
+    straggler_quantile: float = 0.99
+    straggler_multiplier: float = 3.0
+    min_call_seconds: float = 10.0
+    call_seconds: Optional[float] = None
+    max_straggler_retries: int = 2
+    task_seconds: Optional[float] = None
+
+    def call_deadline(self, quantile: Optional[float]) -> Optional[float]:
+        """
+        The deadline of a call, in seconds, given its provider's latency at
+        `straggler_quantile` (None if unknown).
+        """
+        if quantile is None:
+            return self.call_seconds
+        return max(self.min_call_seconds, self.straggler_multiplier * quantile)
+
+
+class DeadlineExceeded(Exception):
+    """
+    A task ran past its deadline.
+    """
+
+
+class Straggler(Exception):
+    """
+    A call ran past its deadline and was cancelled.
+    """
+
+    def __init__(self, provider_name: str, seconds: float):
+        super().__init__(f"Call to {provider_name} cancelled after {seconds:.1f}s")
+        self.provider_name = provider_name
+        self.seconds = seconds
+
+
+def remaining_seconds() -> Optional[float]:
+    """
+    The time left before the current task's deadline, or None without one.
+    """
+    deadline = task_deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+async def with_deadline(seconds: Optional[float], awaitable: Awaitable[T]) -> T:
+    """
+    Await `awaitable`, cancelling it after `seconds` (or by an earlier deadline
+    of the current task). The calls it makes see the deadline and do not wait
+    past it.
+
+    Raises:
+        DeadlineExceeded: If the deadline passed first
+    """
+    if seconds is None:
+        return await awaitable
+    deadline = time.monotonic() + seconds
+    outer = task_deadline.get()
+    if outer is not None:
+        deadline = min(deadline, outer)
+    token = task_deadline.set(deadline)
+    try:
+        return await asyncio.wait_for(awaitable, deadline - time.monotonic())
+    except asyncio.TimeoutError as e:
+        raise DeadlineExceeded(f"Task ran past its {seconds:.0f}s deadline") from e
+    finally:
+        task_deadline.reset(token)
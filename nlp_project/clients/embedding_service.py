@@ -0,0 +1,267 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Callable, Optional, Union
+
+import numpy as np
+
+from nlp_project.clients.response_cache import CacheConfig
+
+DEFAULT_BATCH_WINDOW_SECONDS = 0.05
+# The most inputs the embeddings endpoint accepts in one request
+MAX_BATCH_SIZE = 2048
+# SQLite's default limit on the parameters of a statement is 999
+LOOKUP_CHUNK_SIZE = 500
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def cosine_similarities(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """
+    The cosine similarity of every row of `a` with every row of `b`. A zero
+    vector has a similarity of 0 with everything.
+
+    Returns:
+        A `len(a)` by `len(b)` matrix
+    """
+    a = np.atleast_2d(np.asarray(a, dtype=np.float32))
+    b = np.atleast_2d(np.asarray(b, dtype=np.float32))
+    a_norms = np.linalg.norm(a, axis=1, keepdims=True)
+    b_norms = np.linalg.norm(b, axis=1, keepdims=True)
+    a = np.divide(a, a_norms, out=np.zeros_like(a), where=a_norms > 0)
+    b = np.divide(b, b_norms, out=np.zeros_like(b), where=b_norms > 0)
+    return a @ b.T
+
+
+class VectorCache:
+    """
+    On-disk cache of embedding vectors, keyed by the model and the embedded
+    text, shared by any process using the same file. Embeddings only depend
+    on their input, so vectors are kept until they reach the cache's maximum
+    age.
+    """
+
+    def __init__(self, path: Union[str, Path], max_age_days: float = 30):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_age_seconds = max_age_days * 24 * 60 * 60
+        self.hits = 0
+        self.misses = 0
+        self.__lock = threading.Lock()
+        self.__connection = sqlite3.connect(
+            self.path, timeout=60, isolation_level=None, check_same_thread=False
+        )
+        with self.__lock:
+            self.__connection.execute("PRAGMA journal_mode=WAL")
+            self.__connection.execute("""
+                CREATE TABLE IF NOT EXISTS vectors (
+                    model TEXT NOT NULL,
+                    text_hash TEXT NOT NULL,
+                    vector BLOB NOT NULL,
+                    created_at REAL NOT NULL,
+                    PRIMARY KEY (model, text_hash)
+                )
+                """)
+            self.__connection.execute(
+                "DELETE FROM vectors WHERE created_at < ?",
+                (time.time() - self.max_age_seconds,),
+            )
+
+    def get_many(self, model: str, texts: list[str]) -> dict[str, np.ndarray]:
+        """
+        Look up the cached vectors of some texts.
+
+        Returns:
+            The vector of each text found in the cache
+        """
+        hashes = {text_hash(text): text for text in texts}
+        found = {}
+        keys = list(hashes)
+        with self.__lock:
+            for start in range(0, len(keys), LOOKUP_CHUNK_SIZE):
+                chunk = keys[start : start + LOOKUP_CHUNK_SIZE]
+                rows = self.__connection.execute(
+                    "SELECT text_hash, vector FROM vectors WHERE model = ? "
+                    f"AND created_at >= ? AND text_hash IN ({','.join('?' * len(chunk))})",
+                    (model, time.time() - self.max_age_seconds, *chunk),
+                )
+                for key, vector in rows:
+                    found[hashes[key]] = np.frombuffer(vector, dtype=np.float32)
+            self.hits += len(found)
+            self.misses += len(hashes) - len(found)
+        return found
+
+    def put_many(self, model: str, vectors: dict[str, np.ndarray]) -> None:
+        now = time.time()
+        rows = [
+            (
+                model,
+                text_hash(text),
+                np.asarray(vector, dtype=np.float32).tobytes(),
+                now,
+            )
+            for text, vector in vectors.items()
+        ]
+        with self.__lock:
+            self.__connection.execute("BEGIN IMMEDIATE")
+            self.__connection.executemany(
+                "INSERT OR REPLACE INTO vectors "
+                "(model, text_hash, vector, created_at) VALUES (?, ?, ?, ?)",
+                rows,
+            )
+            self.__connection.execute("COMMIT")
+
+    def close(self) -> None:
+        with self.__lock:
+            self.__connection.close()
+
+
+_vector_caches: dict[str, VectorCache] = {}
+_vector_caches_lock = threading.Lock()
+
+
+def get_vector_cache(config: Optional[CacheConfig]) -> Optional[VectorCache]:
+    """
+    Return the process-wide vector cache of the given configuration, kept in
+    the response cache's file, or None if caching is not configured.
+    """
+    if config is None:
+        return None
+    with _vector_caches_lock:
+        if config.path not in _vector_caches:
+            _vector_caches[config.path] = VectorCache(
+                config.path, max_age_days=config.max_age_days
+            )
+        return _vector_caches[config.path]
+
+
+class EmbeddingService:
+    """
+    Embeds texts for the scorers, sending as few embeddings requests as
+    possible.
+
+    Vectors are kept in memory for the lifetime of the service and in the
+    vector cache across runs, so a text is embedded once. Texts requested by
+    concurrent callers within `batch_window_seconds` of each other are sent
+    together in one request: the first caller to find texts missing waits
+    for the window, then sends every text requested meanwhile, and the other
+    callers wait for its response.
+    """
+
+    def __init__(
+        self,
+        embed_fn: Callable[[list[str]], list[list[float]]],
+        model: str,
+        cache: Optional[VectorCache] = None,
+        batch_window_seconds: float = DEFAULT_BATCH_WINDOW_SECONDS,
+        max_batch_size: int = MAX_BATCH_SIZE,
+    ):
+        """
+        Args:
+            embed_fn: Sends one embeddings request and returns the vector of
+                each input, in order
+            model: The embeddings model, as part of the cache key
+            cache: The persistent vector cache, if any
+        """
+        self.embed_fn = embed_fn
+        self.model = model
+        self.cache = cache
+        self.batch_window_seconds = batch_window_seconds
+        self.max_batch_size = max_batch_size
+        self.requests = 0
+        self.__vectors: dict[str, np.ndarray] = {}
+        self.__pending: dict[str, Future] = {}
+        self.__in_flight: dict[str, Future] = {}
+        self.__sending = False
+        self.__lock = threading.Lock()
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        """
+        Embed texts, from memory, the vector cache or a batched request.
+
+        Returns:
+            A matrix with the vector of each text as a row
+
+        Raises:
+            Exception: Whatever `embed_fn` raised for the batch of these texts
+        """
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        with self.__lock:
+            missing = [
+                text
+                for text in dict.fromkeys(texts)
+                if text not in self.__vectors
+                and text not in self.__pending
+                and text not in self.__in_flight
+            ]
+        if missing and self.cache is not None:
+            cached = self.cache.get_many(self.model, missing)
+        else:
+            cached = {}
+        with self.__lock:
+            self.__vectors.update(cached)
+            futures = {}
+            for text in dict.fromkeys(texts):
+                if text in self.__vectors:
+                    continue
+                future = self.__pending.get(text) or self.__in_flight.get(text)
+                if future is None:
+                    future = self.__pending[text] = Future()
+                futures[text] = future
+            send = bool(self.__pending) and not self.__sending
+            self.__sending = self.__sending or send
+        if send:
+            self.__send_pending()
+        for future in futures.values():
+            future.result()
+        with self.__lock:
+            return np.stack([self.__vectors[text] for text in texts])
+
+    def __send_pending(self) -> None:
+        time.sleep(self.batch_window_seconds)
+        with self.__lock:
+            batch = self.__pending
+            self.__pending = {}
+            self.__in_flight.update(batch)
+            self.__sending = False
+        texts = list(batch)
+        try:
+            vectors = {}
+            for start in range(0, len(texts), self.max_batch_size):
+                chunk = texts[start : start + self.max_batch_size]
+                with self.__lock:
+                    self.requests += 1
+                for text, vector in zip(chunk, self.embed_fn(chunk)):
+                    vectors[text] = np.asarray(vector, dtype=np.float32)
+            if self.cache is not None:
+                self.cache.put_many(self.model, vectors)
+        except Exception as e:
+            with self.__lock:
+                for text in texts:
+                    del self.__in_flight[text]
+            for future in batch.values():
+                future.set_exception(e)
+            return
+        with self.__lock:
+            self.__vectors.update(vectors)
+            for text in texts:
+                del self.__in_flight[text]
+        for future in batch.values():
+            future.set_result(None)
+
+    def similarities(self, texts: list[str], targets: list[str]) -> np.ndarray:
+        """
+        The cosine similarity of every text with every target, embedding
+        both in one batch.
+
+        Returns:
+            A `len(texts)` by `len(targets)` matrix
+        """
+        vectors = self.embed(texts + targets)
+        return cosine_similarities(vectors[: len(texts)], vectors[len(texts) :])
@@ -0,0 +1,520 @@
+import base64
+import hashlib
+import json
+import math
+import random
+import re
+import struct
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Literal, Optional
+
+from pydantic import BaseModel
+
+from nlp_project.clients.openai_client import (
+    CHARS_PER_TOKEN,
+    DEFAULT_ESTIMATED_OUTPUT_TOKENS,
+    TokenBucket,
+    estimate_tokens,
+)
+
+WORDS = [
+    "apple",
+    "art",
+    "banana",
+    "dance",
+    "hello",
+    "line",
+    "number",
+    "River",
+    "test",
+    "World",
+    "x7",
+    "42",
+]
+
+
+class Latency(BaseModel):
+    """
+    Distribution of the time the fake server takes to answer a request.
+
+    - `fixed`: always `a` seconds
+    - `uniform`: between `a` and `b` seconds
+    - `exponential`: `a` seconds on average
+    - `lognormal`: `a` seconds median, with log-standard deviation `b`
+    """
+
+    distribution: Literal["fixed", "uniform", "exponential", "lognormal"] = "fixed"
+    a: float = 0.0
+    b: float = 0.0
+
+    @classmethod
+    def parse(cls, spec: str) -> "Latency":
+        """
+        Parse a latency specification such as `fixed:0.5`, `uniform:0.2,1.5`,
+        `exponential:1` or `lognormal:1,0.5`.
+        """
+        distribution, _, params = spec.partition(":")
+        values = [float(value) for value in params.split(",") if value]
+        return cls(distribution=distribution, **dict(zip(("a", "b"), values)))
+
+    def sample(self, rng: random.Random) -> float:
+        if self.distribution == "uniform":
+            return rng.uniform(self.a, self.b)
+        if self.distribution == "exponential":
+            return rng.expovariate(1 / self.a) if self.a > 0 else 0.0
+        if self.distribution == "lognormal":
+            return self.a * math.exp(rng.gauss(0, self.b))
+        return self.a
+
+
+class FakeServerConfig(BaseModel):
+    """
+    Behaviour of the fake LLM server.
+
+    Attributes:
+        latency: Time to answer a request, before streaming the output
+        seconds_per_output_token: Extra time per generated token
+        error_rate: Probability of answering with a 500 error
+        rate_limit_rate: Probability of answering with a 429 error
+        retry_after: `Retry-After` seconds of injected 429 errors
+        requests_per_minute: Request limit enforced with 429 errors, if any
+        tokens_per_minute: Token limit enforced with 429 errors, if any
+        embedding_dimensions: Length of the returned embedding vectors
+        seed: Seed of the latency, error and payload randomness
+    """
+
+    latency: Latency = Latency()
+    seconds_per_output_token: float = 0.0
+    error_rate: float = 0.0
+    rate_limit_rate: float = 0.0
+    retry_after: float = 1.0
+    requests_per_minute: Optional[int] = None
+    tokens_per_minute: Optional[int] = None
+    embedding_dimensions: int = 1536
+    seed: Optional[int] = None
+
+
+class RejectedRequest(Exception):
+    def __init__(
+        self, status: int, message: str, headers: Optional[dict[str, str]] = None
+    ):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+
+
+class FakeLLMServer(ThreadingHTTPServer):
+    """
+    Local stand-in for the OpenAI chat-completions and embeddings endpoints,
+    for load-testing the experiment harness without API traffic.
+
+    Structured-output requests are answered with random instances of the
+    requested JSON schema, so every `response_format` model of the solvers
+    parses. Select the server by pointing `base_url` in `llm_config.toml` at
+    `http://<host>:<port>/v1`.
+    """
+
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(
+        self, address: tuple[str, int], config: Optional[FakeServerConfig] = None
+    ):
+        super().__init__(address, FakeLLMHandler)
+        self.config = config or FakeServerConfig()
+        self.__rng = random.Random(self.config.seed)
+        self.__lock = threading.Lock()
+        now = time.monotonic()
+        self.__buckets = {
+            kind: TokenBucket(limit, now)
+            for kind, limit in (
+                ("requests", self.config.requests_per_minute),
+                ("tokens", self.config.tokens_per_minute),
+            )
+            if limit
+        }
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def request_random(self) -> random.Random:
+        """
+        Return a generator seeded from the server's, for use by one request.
+        """
+        with self.__lock:
+            return random.Random(self.__rng.getrandbits(64))
+
+    def admit(self, tokens: int, rng: random.Random) -> dict[str, str]:
+        """
+        Apply error injection and the configured rate limits to a request.
+
+        Returns:
+            The rate-limit headers of the response
+
+        Raises:
+            RejectedRequest: If the request is rejected
+        """
+        if rng.random() < self.config.error_rate:
+            raise RejectedRequest(500, "Injected server error")
+        if rng.random() < self.config.rate_limit_rate:
+            raise RejectedRequest(
+                429,
+                "Injected rate limit error",
+                {"retry-after": f"{self.config.retry_after:g}"},
+            )
+
+        headers = {}
+        with self.__lock:
+            now = time.monotonic()
+            amounts = {"requests": 1, "tokens": tokens}
+            for kind, bucket in self.__buckets.items():
+                bucket.refill(now)
+                if bucket.level < amounts[kind]:
+                    retry_after = (amounts[kind] - bucket.level) / bucket.rate
+                    raise RejectedRequest(
+                        429,
+                        f"Rate limit reached for {kind} per minute",
+                        {"retry-after": f"{retry_after:.3f}"},
+                    )
+            for kind, bucket in self.__buckets.items():
+                bucket.level -= amounts[kind]
+                headers[f"x-ratelimit-limit-{kind}"] = str(int(bucket.capacity))
+                headers[f"x-ratelimit-remaining-{kind}"] = str(int(bucket.level))
+        return headers
+
+
+class FakeLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: FakeLLMServer
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    def do_GET(self) -> None:
+        if self.path.endswith("/models"):
+            self.__send(
+                200,
+                {"object": "list", "data": [{"id": "fake", "object": "model"}]},
+                {},
+            )
+        else:
+            self.__send(
+                404,
+                {"error": {"message": f"Unknown endpoint {self.path}"}},
+                {},
+            )
+
+    def do_POST(self) -> None:
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        rng = self.server.request_random()
+        try:
+            if self.path.endswith("/chat/completions") and body.get("stream"):
+                self.__stream_chat_completion(body, rng)
+                return
+            if self.path.endswith("/chat/completions"):
+                payload, headers = self.__chat_completion(body, rng)
+            elif self.path.endswith("/embeddings"):
+                payload, headers = self.__embeddings(body, rng)
+            else:
+                raise RejectedRequest(404, f"Unknown endpoint {self.path}")
+        except RejectedRequest as e:
+            self.__send(
+                e.status,
+                {"error": {"message": str(e), "type": "fake_server_error"}},
+                e.headers,
+            )
+            return
+        self.__send(200, payload, headers)
+
+    def __send(self, status: int, payload: dict, headers: dict[str, str]) -> None:
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def __chat_contents(
+        self, body: dict, rng: random.Random
+    ) -> tuple[list[str], dict[str, str]]:
+        """
+        Admit a chat completion request and generate the content of its
+        choices.
+        """
+        messages = body.get("messages", [])
+        n = body.get("n") or 1
+        max_tokens = body.get("max_completion_tokens") or body.get("max_tokens")
+        headers = self.server.admit(
+            estimate_tokens(messages, max_tokens or DEFAULT_ESTIMATED_OUTPUT_TOKENS),
+            rng,
+        )
+
+        response_format = body.get("response_format") or {}
+        schema = response_format.get("json_schema", {}).get("schema")
+        statement = "\n".join(
+            message["content"]
+            for message in messages
+            if message.get("role") == "user" and isinstance(message.get("content"), str)
+        )
+        contents = [
+            (
+                json.dumps(fake_instance(schema, rng, statement))
+                if schema
+                else " ".join(rng.choices(WORDS, k=rng.randint(5, 40)))
+            )
+            for _ in range(n)
+        ]
+        return contents, headers
+
+    def __chat_completion(
+        self, body: dict, rng: random.Random
+    ) -> tuple[dict, dict[str, str]]:
+        config = self.server.config
+        messages = body.get("messages", [])
+        n = body.get("n") or 1
+        contents, headers = self.__chat_contents(body, rng)
+        completion_tokens = sum(
+            len(content) // CHARS_PER_TOKEN + 1 for content in contents
+        )
+        time.sleep(
+            config.latency.sample(rng)
+            + completion_tokens / n * config.seconds_per_output_token
+        )
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "fake"),
+            "choices": [
+                {
+                    "index": index,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop",
+                    "logprobs": None,
+                }
+                for index, content in enumerate(contents)
+            ],
+            "usage": {
+                "prompt_tokens": estimate_tokens(messages, output_tokens=0),
+                "completion_tokens": completion_tokens,
+                "total_tokens": estimate_tokens(messages, output_tokens=0)
+                + completion_tokens,
+            },
+        }, headers
+
+    def __stream_chat_completion(self, body: dict, rng: random.Random) -> None:
+        """
+        Answer a chat completion as server-sent events, one token (of
+        `CHARS_PER_TOKEN` characters) per chunk, paced by
+        `seconds_per_output_token` after the sampled latency.
+        """
+        config = self.server.config
+        messages = body.get("messages", [])
+        contents, headers = self.__chat_contents(body, rng)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+
+        def chunk(choices: list[dict], usage: Optional[dict] = None) -> dict:
+            return {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": body.get("model", "fake"),
+                "choices": choices,
+                **({"usage": usage} if usage else {}),
+            }
+
+        time.sleep(config.latency.sample(rng))
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+
+        completion_tokens = 0
+        try:
+            for index, content in enumerate(contents):
+                for start in range(0, len(content), CHARS_PER_TOKEN):
+                    delta = {"content": content[start : start + CHARS_PER_TOKEN]}
+                    if start == 0:
+                        delta["role"] = "assistant"
+                    self.__write_event(
+                        chunk([{"index": index, "delta": delta, "finish_reason": None}])
+                    )
+                    completion_tokens += 1
+                    time.sleep(config.seconds_per_output_token)
+                self.__write_event(
+                    chunk([{"index": index, "delta": {}, "finish_reason": "stop"}])
+                )
+            if (body.get("stream_options") or {}).get("include_usage"):
+                prompt_tokens = estimate_tokens(messages, output_tokens=0)
+                self.__write_event(
+                    chunk(
+                        [],
+                        {
+                            "prompt_tokens": prompt_tokens,
+                            "completion_tokens": completion_tokens,
+                            "total_tokens": prompt_tokens + completion_tokens,
+                        },
+                    )
+                )
+            self.__write_chunk(b"data: [DONE]\n\n")
+            self.__write_chunk(b"")
+        except (BrokenPipeError, ConnectionResetError):
+            # The client stopped reading, e.g. once it had its answer
+            self.close_connection = True
+
+    def __write_event(self, payload: dict) -> None:
+        self.__write_chunk(f"data: {json.dumps(payload)}\n\n".encode())
+
+    def __write_chunk(self, data: bytes) -> None:
+        self.wfile.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def __embeddings(
+        self, body: dict, rng: random.Random
+    ) -> tuple[dict, dict[str, str]]:
+        config = self.server.config
+        inputs = body.get("input", [])
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        headers = self.server.admit(estimate_tokens(inputs, output_tokens=0), rng)
+        time.sleep(config.latency.sample(rng))
+
+        data = []
+        for index, text in enumerate(inputs):
+            vector = fake_embedding(str(text), config.embedding_dimensions)
+            if body.get("encoding_format") == "base64":
+                embedding = base64.b64encode(
+                    struct.pack(f"<{len(vector)}f", *vector)
+                ).decode()
+            else:
+                embedding = vector
+            data.append({"object": "embedding", "index": index, "embedding": embedding})
+        prompt_tokens = estimate_tokens(inputs, output_tokens=0)
+        return {
+            "object": "list",
+            "data": data,
+            "model": body.get("model", "fake"),
+            "usage": {"prompt_tokens": prompt_tokens, "total_tokens": prompt_tokens},
+        }, headers
+
+
+def fake_embedding(text: str, dimensions: int) -> list[float]:
+    """
+    Deterministic unit vector for `text`, so equal texts are identical.
+    """
+    seed = int.from_bytes(hashlib.sha256(text.encode()).digest()[:8], "big")
+    rng = random.Random(seed)
+    vector = [rng.gauss(0, 1) for _ in range(dimensions)]
+    norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+    return [value / norm for value in vector]
+
+
+def fake_regex(statement: str, rng: random.Random) -> str:
+    """
+    A plausible regex for a problem statement, built around its first quoted
+    term if it has one.
+    """
+    quoted = re.search(r"'([^']+)'", statement)
+    term = re.escape(quoted.group(1)) if quoted else rng.choice(WORDS)
+    return rng.choice(
+        [
+            rf"^.*\b{term}\b.*$",
+            rf"(?i)^.*{term}.*$",
+            rf"^.*{term}.*$",
+            r"^\w+$",
+            r"^.*$",
+        ]
+    )
+
+
+def fake_instance(
+    schema: dict,
+    rng: random.Random,
+    statement: str = "",
+    root: Optional[dict] = None,
+    name: str = "",
+) -> Any:
+    """
+    Generate a random instance of a JSON schema, as produced by OpenAI's
+    structured outputs for a pydantic model.
+
+    Args:
+        schema: The (sub)schema to instantiate
+        rng: The source of randomness
+        statement: The problem statement, to make `regex` fields plausible
+        root: The root schema, holding the `$defs` that `$ref`s point to
+        name: The name of the property being generated
+
+    Returns:
+        The generated instance
+    """
+    root = root or schema
+    if "$ref" in schema:
+        definition = schema["$ref"].rsplit("/", 1)[-1]
+        return fake_instance(
+            root.get("$defs", {})[definition], rng, statement, root, name
+        )
+    if "enum" in schema:
+        return rng.choice(schema["enum"])
+    if "anyOf" in schema:
+        options = [option for option in schema["anyOf"] if option.get("type") != "null"]
+        return fake_instance(
+            rng.choice(options or schema["anyOf"]), rng, statement, root, name
+        )
+
+    kind = schema.get("type")
+    if kind == "object":
+        return {
+            property_name: fake_instance(
+                property_schema, rng, statement, root, property_name
+            )
+            for property_name, property_schema in schema.get("properties", {}).items()
+        }
+    if kind == "array":
+        return [
+            fake_instance(schema.get("items", {}), rng, statement, root, name)
+            for _ in range(rng.randint(0, 4))
+        ]
+    if kind == "boolean":
+        return rng.random() < 0.5
+    if kind == "integer":
+        return rng.randint(0, 100)
+    if kind == "number":
+        return rng.uniform(0, 100)
+    if kind == "null":
+        return None
+    if name == "regex":
+        return fake_regex(statement, rng)
+    return " ".join(rng.choices(WORDS, k=rng.randint(1, 8)))
+
+
+def serve_fake_llm(
+    host: str = "127.0.0.1",
+    port: int = 0,
+    config: Optional[FakeServerConfig] = None,
+) -> FakeLLMServer:
+    """
+    Start a fake LLM server on a background thread.
+
+    Args:
+        host: The interface to listen on
+        port: The port to listen on, or 0 for any free port
+        config: The server's behaviour
+
+    Returns:
+        The running server. Call `shutdown()` to stop it.
+    """
+    server = FakeLLMServer((host, port), config)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
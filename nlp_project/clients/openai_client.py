@@ -1,18 +1,71 @@
+import asyncio
+import functools
+import importlib
+import json
 import os
+import ssl
+import threading
+import time
+import weakref
 from pathlib import Path
+from typing import Any, Callable, Literal, Mapping, Optional
 
 import toml
-from openai import OpenAI
-from pydantic import BaseModel
+from openai import (
+    DEFAULT_CONNECTION_LIMITS,
+    AsyncOpenAI,
+    DefaultAsyncHttpxClient,
+    DefaultHttpxClient,
+    OpenAI,
+)
+from pydantic import BaseModel, model_validator
+
+from nlp_project.clients.budget import BudgetConfig
+from nlp_project.clients.deadlines import DeadlineConfig
+from nlp_project.clients.resilience import CircuitBreaker, RetryPolicy
+from nlp_project.clients.response_cache import CacheConfig
 
 WORKING_DIR = Path(__file__).parent.parent
 
+CHARS_PER_TOKEN = 4
+DEFAULT_ESTIMATED_OUTPUT_TOKENS = 512
 
-def get_openai_client(config: "LLMConfig") -> OpenAI:
-    return OpenAI(
-        api_key=config.api_key,
-        base_url=config.base_url,
-    )
+DEFAULT_MAX_CONNECTIONS = 100
+DEFAULT_KEEPALIVE_EXPIRY = 60.0
+WARM_UP_CONNECTIONS = 8
+
+# The connection limits class of the HTTP library the OpenAI SDK is built on
+Limits = type(DEFAULT_CONNECTION_LIMITS)
+_http_library = importlib.import_module(Limits.__module__)
+
+
+class ProviderConfig(BaseModel):
+    """
+    A `[[providers]]` entry of `llm_config.toml`: one backend the solvers'
+    requests are balanced across.
+
+    Attributes:
+        name: Name of the provider in logs
+        type: `openai` for any OpenAI-compatible endpoint, or `gemini`
+        model: The model to request
+        base_url: Endpoint of an OpenAI-compatible provider; defaults to the
+            top-level `base_url`
+        api_key: Defaults to the top-level `api_key` (or, for Gemini, to the
+            `GOOGLE_API_KEY` environment variable). Gemini providers must all
+            have the same key.
+        weight: Relative share of the requests sent to the provider
+        requests_per_minute: Rate limit of the provider
+        tokens_per_minute: Token rate limit of the provider
+    """
+
+    name: str
+    type: Literal["openai", "gemini"] = "openai"
+    model: str
+    base_url: Optional[str] = None
+    api_key: Optional[str] = None
+    weight: float = 1.0
+    requests_per_minute: Optional[int] = None
+    tokens_per_minute: Optional[int] = None
 
 
 class LLMConfig(BaseModel):
@@ -20,13 +73,398 @@ class LLMConfig(BaseModel):
     embeddings_model: str
     base_url: str
     api_key: str
+    requests_per_minute: Optional[int] = None
+    tokens_per_minute: Optional[int] = None
+    cache: Optional[CacheConfig] = None
+    max_connections: Optional[int] = None
+    keepalive_expiry: float = DEFAULT_KEEPALIVE_EXPIRY
+    providers: list[ProviderConfig] = []
+    hedge_quantile: Optional[float] = None
+    deadlines: DeadlineConfig = DeadlineConfig()
+    retries: RetryPolicy = RetryPolicy()
+    budget: BudgetConfig = BudgetConfig()
+
+    @model_validator(mode="after")
+    def check_gemini_keys(self) -> "LLMConfig":
+        # The Gemini SDK configures its API key for the whole process
+        api_keys = {
+            provider.api_key or os.getenv("GOOGLE_API_KEY")
+            for provider in self.providers
+            if provider.type == "gemini"
+        }
+        if len(api_keys) > 1:
+            raise ValueError("Gemini providers must all use the same api_key")
+        return self
 
     @classmethod
     def from_config_toml(cls) -> "LLMConfig":
-        config = toml.load(WORKING_DIR / "clients/llm_config.toml")
-        return cls(
-            model=config.get("model", "gpt-4o"),
-            embeddings_model=config.get("embeddings_model", "text-embedding-ada-002"),
-            base_url=config.get("base_url", "https://api.openai.com/v1"),
-            api_key=config["api_key"],
-        )
+        """
+        Load `llm_config.toml`. The file is read once per process; later calls
+        return the same configuration.
+        """
+        global _llm_config
+        with _llm_config_lock:
+            if _llm_config is None:
+                config = toml.load(WORKING_DIR / "clients/llm_config.toml")
+                _llm_config = cls(
+                    model=config.get("model", "gpt-4o"),
+                    embeddings_model=config.get(
+                        "embeddings_model", "text-embedding-ada-002"
+                    ),
+                    base_url=config.get("base_url", "https://api.openai.com/v1"),
+                    api_key=config["api_key"],
+                    requests_per_minute=config.get("requests_per_minute"),
+                    tokens_per_minute=config.get("tokens_per_minute"),
+                    cache=config.get("cache"),
+                    max_connections=config.get("max_connections"),
+                    keepalive_expiry=config.get(
+                        "keepalive_expiry", DEFAULT_KEEPALIVE_EXPIRY
+                    ),
+                    providers=config.get("providers", []),
+                    hedge_quantile=config.get("hedge_quantile"),
+                    deadlines=config.get("deadlines", {}),
+                    retries=config.get("retries", {}),
+                    budget=config.get("budget", {}),
+                )
+            return _llm_config
+
+
+_llm_config: Optional[LLMConfig] = None
+_llm_config_lock = threading.Lock()
+
+_pool_size: Optional[int] = None
+_clients: dict[tuple[str, str], OpenAI] = {}
+# Event loop -> {(base_url, api_key): client}
+_async_clients: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+# The async clients created outside an event loop
+_unbound_async_clients: dict[tuple[str, str], AsyncOpenAI] = {}
+_clients_lock = threading.Lock()
+
+
+def size_connection_pools(max_connections: int) -> None:
+    """
+    Size the connection pools of the clients created from now on, e.g. to the
+    number of requests an experiment keeps in flight. `max_connections` in
+    `llm_config.toml` takes precedence.
+    """
+    global _pool_size
+    _pool_size = max_connections
+
+
+def connection_limits(config: LLMConfig) -> Limits:
+    """
+    Connection pool limits of the clients of the given configuration. Every
+    connection of the pool is kept alive, so bursts of requests reuse open
+    connections instead of repeating TLS handshakes.
+    """
+    max_connections = config.max_connections or _pool_size or DEFAULT_MAX_CONNECTIONS
+    return Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=max_connections,
+        keepalive_expiry=config.keepalive_expiry,
+    )
+
+
+@functools.cache
+def shared_ssl_context() -> ssl.SSLContext:
+    """
+    The TLS context of every client. Loading the trusted certificates takes
+    tens of milliseconds, so it is done once per process rather than per client.
+    """
+    return _http_library.create_ssl_context()
+
+
+def get_openai_client(config: LLMConfig) -> OpenAI:
+    """
+    Return the process-wide client of the configured endpoint and API key.
+    """
+    key = (config.base_url, config.api_key)
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = OpenAI(
+                api_key=config.api_key,
+                base_url=config.base_url,
+                http_client=DefaultHttpxClient(
+                    limits=connection_limits(config), verify=shared_ssl_context()
+                ),
+                # Retries are handled by the callers' retry policy
+                max_retries=0,
+            )
+        return _clients[key]
+
+
+def get_async_openai_client(config: LLMConfig) -> AsyncOpenAI:
+    """
+    Return the async client of the configured endpoint and API key. Async
+    connections are bound to an event loop, so there is one client per loop.
+    Outside a loop there is one more client, shared by every caller outside a
+    loop and used by the loop they start.
+    """
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        loop = None
+
+    key = (config.base_url, config.api_key)
+    with _clients_lock:
+        if loop is None:
+            clients = _unbound_async_clients
+        else:
+            clients = _async_clients.setdefault(loop, {})
+        if key not in clients:
+            clients[key] = AsyncOpenAI(
+                api_key=config.api_key,
+                base_url=config.base_url,
+                http_client=DefaultAsyncHttpxClient(
+                    limits=connection_limits(config), verify=shared_ssl_context()
+                ),
+                max_retries=0,
+            )
+        return clients[key]
+
+
+def structured_completions(client: Any) -> Any:
+    """
+    The completions resource with `parse` for structured outputs, of a sync or
+    async client. Recent SDKs have it on `chat.completions` and only load the
+    `beta` resources, hundreds of models taking most of a second to import,
+    when they are first used. Older SDKs only have it on `beta`.
+    """
+    completions = client.chat.completions
+    if hasattr(completions, "parse"):
+        return completions
+    return client.beta.chat.completions
+
+
+async def warm_up(client: AsyncOpenAI, connections: int = WARM_UP_CONNECTIONS) -> None:
+    """
+    Open `connections` pooled connections to the client's endpoint ahead of the
+    first requests, by listing the available models concurrently. Failures are
+    ignored: any response means the connection is open.
+    """
+
+    async def open_connection():
+        try:
+            await client.models.list()
+        except Exception:
+            pass
+
+    await asyncio.gather(*(open_connection() for _ in range(connections)))
+
+
+def estimate_tokens(
+    messages: Any, output_tokens: int = DEFAULT_ESTIMATED_OUTPUT_TOKENS
+) -> int:
+    """
+    Roughly estimate the tokens a request will consume, before sending it.
+
+    Args:
+        messages: The chat messages (or embedding inputs) of the request
+        output_tokens: The number of completion tokens to budget for
+
+    Returns:
+        The estimated total number of tokens
+    """
+    return len(json.dumps(messages)) // CHARS_PER_TOKEN + output_tokens
+
+
+class TokenBucket:
+    """
+    A bucket holding up to `capacity` units that refills at `capacity` units
+    per minute. Reservations may overdraw the bucket; the caller then waits
+    until the debt has been refilled.
+    """
+
+    def __init__(self, capacity: float, now: float):
+        self.capacity = capacity
+        self.level = capacity
+        self.__updated_at = now
+
+    @property
+    def rate(self) -> float:
+        return self.capacity / 60
+
+    def refill(self, now: float) -> None:
+        elapsed = max(0.0, now - self.__updated_at)
+        self.level = min(self.capacity, self.level + elapsed * self.rate)
+        self.__updated_at = now
+
+    def reserve(self, amount: float, now: float) -> float:
+        """
+        Take `amount` units from the bucket.
+
+        Returns:
+            The number of seconds to wait before the reservation is covered
+        """
+        self.refill(now)
+        self.level -= amount
+        return 0.0 if self.level >= 0 else -self.level / self.rate
+
+
+class RateLimiter:
+    """
+    Shared limiter for the requests-per-minute and tokens-per-minute limits of
+    an LLM provider.
+
+    Callers reserve capacity before each request and wait until it is
+    available. The limiter adjusts itself to the provider's rate-limit headers
+    and pauses every caller when a response carries `Retry-After`.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: Optional[int] = None,
+        tokens_per_minute: Optional[int] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.__clock = clock
+        self.__lock = threading.Lock()
+        now = clock()
+        self.__buckets = {
+            kind: TokenBucket(limit, now)
+            for kind, limit in (
+                ("requests", requests_per_minute),
+                ("tokens", tokens_per_minute),
+            )
+            if limit
+        }
+        self.__paused_until = now
+
+    def reserve(self, tokens: int) -> float:
+        """
+        Reserve one request and `tokens` estimated tokens.
+
+        Returns:
+            The number of seconds to wait before sending the request
+        """
+        with self.__lock:
+            now = self.__clock()
+            wait = max(0.0, self.__paused_until - now)
+            for kind, amount in (("requests", 1), ("tokens", tokens)):
+                if kind in self.__buckets:
+                    wait = max(wait, self.__buckets[kind].reserve(amount, now))
+            return wait
+
+    def acquire(self, tokens: int) -> None:
+        wait = self.reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def aacquire(self, tokens: int) -> None:
+        wait = self.reserve(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def settle(self, estimated_tokens: int, actual_tokens: int) -> None:
+        """
+        Correct a reservation once the actual token usage is known.
+        """
+        with self.__lock:
+            bucket = self.__buckets.get("tokens")
+            if bucket is None:
+                return
+            bucket.refill(self.__clock())
+            bucket.level = min(
+                bucket.capacity, bucket.level + estimated_tokens - actual_tokens
+            )
+
+    def pause(self, seconds: float) -> None:
+        """
+        Hold back every caller for the given number of seconds.
+        """
+        with self.__lock:
+            self.__paused_until = max(self.__paused_until, self.__clock() + seconds)
+
+    def update_from_headers(self, headers: Mapping[str, str]) -> None:
+        """
+        Adjust the limiter to the rate-limit headers of a provider response.
+
+        `x-ratelimit-limit-*` headers replace the configured limits, and
+        `x-ratelimit-remaining-*` headers lower the available capacity when the
+        provider has seen more usage than the limiter (e.g. from other
+        processes sharing the same key). `Retry-After` pauses all callers.
+        """
+        with self.__lock:
+            now = self.__clock()
+            for kind in ("requests", "tokens"):
+                limit = headers.get(f"x-ratelimit-limit-{kind}")
+                remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+                if limit and limit.isdigit():
+                    if kind not in self.__buckets:
+                        self.__buckets[kind] = TokenBucket(int(limit), now)
+                    self.__buckets[kind].capacity = int(limit)
+                if kind in self.__buckets and remaining and remaining.isdigit():
+                    bucket = self.__buckets[kind]
+                    bucket.refill(now)
+                    bucket.level = min(bucket.level, int(remaining))
+
+        retry_after = retry_after_seconds(headers)
+        if retry_after:
+            self.pause(retry_after)
+
+
+def retry_after_seconds(headers: Mapping[str, str]) -> Optional[float]:
+    """
+    Read the `retry-after-ms` or `retry-after` header of a response, in seconds.
+    """
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        pass
+    return None
+
+
+_rate_limiters: dict[tuple[str, str], RateLimiter] = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(config: LLMConfig) -> RateLimiter:
+    """
+    Return the process-wide rate limiter of the configured endpoint and model.
+    """
+    key = (config.base_url, config.model)
+    with _rate_limiters_lock:
+        if key not in _rate_limiters:
+            _rate_limiters[key] = RateLimiter(
+                requests_per_minute=config.requests_per_minute,
+                tokens_per_minute=config.tokens_per_minute,
+            )
+        return _rate_limiters[key]
+
+
+_circuit_breakers: dict[tuple[str, str], CircuitBreaker] = {}
+
+
+def get_circuit_breaker(config: LLMConfig) -> CircuitBreaker:
+    """
+    Return the process-wide circuit breaker of the configured endpoint and
+    model, shared by the solvers and scorers that call it.
+    """
+    key = (config.base_url, config.model)
+    with _rate_limiters_lock:
+        if key not in _circuit_breakers:
+            _circuit_breakers[key] = CircuitBreaker(
+                failure_threshold=config.retries.failure_threshold,
+                cooldown_seconds=config.retries.cooldown_seconds,
+            )
+        return _circuit_breakers[key]
+
+
+def rate_limit_handler(
+    rate_limiter: RateLimiter,
+) -> Callable[[Mapping[str, str], float], None]:
+    """
+    Pace the retries of rate-limited requests through the limiter: it adopts
+    the rejection's headers, and pauses for the retry's backoff when they do
+    not carry `Retry-After`.
+    """
+
+    def on_rate_limited(headers: Mapping[str, str], backoff: float) -> None:
+        rate_limiter.update_from_headers(headers)
+        if retry_after_seconds(headers) is None:
+            rate_limiter.pause(backoff)
+
+    return on_rate_limited
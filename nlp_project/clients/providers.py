@@ -0,0 +1,825 @@
+import asyncio
+import json
+import os
+import random
+import time
+import weakref
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+from openai import RateLimitError
+from openai.types.chat import ChatCompletion, ParsedChatCompletion
+from pydantic import BaseModel
+
+from nlp_project.clients.budget import TokenBudget, get_token_budget
+from nlp_project.clients.deadlines import (
+    DeadlineConfig,
+    DeadlineExceeded,
+    Straggler,
+    remaining_seconds,
+)
+from nlp_project.clients.openai_client import (
+    CHARS_PER_TOKEN,
+    DEFAULT_ESTIMATED_OUTPUT_TOKENS,
+    LLMConfig,
+    ProviderConfig,
+    RateLimiter,
+    estimate_tokens,
+    get_async_openai_client,
+    get_circuit_breaker,
+    get_rate_limiter,
+    rate_limit_handler,
+    structured_completions,
+    warm_up,
+)
+from nlp_project.clients.resilience import (
+    CircuitBreaker,
+    RateLimited,
+    RetryPolicy,
+    aretry_call,
+)
+from nlp_project.clients.scheduler import RequestScheduler
+from nlp_project.clients.streaming import (
+    StreamTiming,
+    answer_complete,
+    parse_partial_json,
+    partial_answer,
+)
+
+LATENCY_WINDOW = 200
+MIN_LATENCY_SAMPLES = 20
+
+UNSUPPORTED_GEMINI_SCHEMA_KEYS = {"title", "default", "additionalProperties", "$defs"}
+
+
+class Provider(ABC):
+    """
+    A backend that answers chat completions in the OpenAI response format.
+    """
+
+    def __init__(
+        self,
+        config: ProviderConfig,
+        rate_limiter: RateLimiter,
+        circuit_breaker: CircuitBreaker,
+    ):
+        self.name = config.name
+        self.model = config.model
+        self.weight = config.weight
+        self.rate_limiter = rate_limiter
+        self.circuit_breaker = circuit_breaker
+        self.latencies: deque[float] = deque(maxlen=LATENCY_WINDOW)
+
+    @abstractmethod
+    async def send(
+        self,
+        messages: List[Dict[str, Any]],
+        response_format: Any,
+        params: Dict[str, Any],
+    ) -> Tuple[Any, Mapping[str, str]]:
+        """
+        Send one chat completion.
+
+        Args:
+            messages: The conversation to send
+            response_format: A pydantic model to parse the response into, or `str`
+            params: Sampling parameters, e.g. `n`
+
+        Returns:
+            The response, as a (parsed) OpenAI chat completion, and the
+            response headers
+
+        Raises:
+            RateLimited: If the provider rejected the request for its rate limits
+        """
+
+    async def stream(
+        self,
+        messages: List[Dict[str, Any]],
+        response_format: Any,
+        params: Dict[str, Any],
+        answer_fields: Optional[List[str]] = None,
+    ) -> Tuple[Any, Mapping[str, str], StreamTiming]:
+        """
+        Stream one chat completion, closing the stream as soon as the answer
+        fields are complete.
+
+        Providers that do not stream send the whole completion instead.
+
+        Args:
+            answer_fields: The fields of `response_format` that are needed, or
+                None to stream the whole completion
+
+        Returns:
+            The response (with only the answer fields if the stream was
+            stopped early), the response headers, and the stream's timing
+        """
+        start_time = time.time()
+        response, headers = await self.send(messages, response_format, params)
+        return response, headers, StreamTiming(time_to_answer=time.time() - start_time)
+
+    async def warm_up(self, connections: int) -> None:
+        """
+        Open connections to the provider ahead of the first requests, if it
+        keeps a connection pool.
+        """
+
+    def latency_quantile(self, quantile: float) -> Optional[float]:
+        """
+        The given quantile of the provider's recent latencies, or None until
+        enough requests have completed.
+        """
+        if len(self.latencies) < MIN_LATENCY_SAMPLES:
+            return None
+        latencies = sorted(self.latencies)
+        return latencies[min(len(latencies) - 1, int(quantile * len(latencies)))]
+
+
+class OpenAIProvider(Provider):
+    """
+    Any endpoint compatible with the OpenAI chat-completions API.
+    """
+
+    def __init__(self, config: ProviderConfig, llm_config: LLMConfig):
+        endpoint = llm_config.model_copy(
+            update={
+                "model": config.model,
+                "base_url": config.base_url or llm_config.base_url,
+                "api_key": config.api_key or llm_config.api_key,
+                "requests_per_minute": config.requests_per_minute,
+                "tokens_per_minute": config.tokens_per_minute,
+            }
+        )
+        super().__init__(
+            config, get_rate_limiter(endpoint), get_circuit_breaker(endpoint)
+        )
+        self.client = get_async_openai_client(endpoint)
+
+    async def warm_up(self, connections: int) -> None:
+        await warm_up(self.client, connections)
+
+    async def send(
+        self,
+        messages: List[Dict[str, Any]],
+        response_format: Any,
+        params: Dict[str, Any],
+    ) -> Tuple[Any, Mapping[str, str]]:
+        try:
+            if is_model(response_format):
+                completions = structured_completions(self.client)
+                raw_response = await completions.with_raw_response.parse(
+                    model=self.model,
+                    messages=messages,
+                    response_format=response_format,
+                    **params,
+                )
+            else:
+                raw_response = (
+                    await self.client.chat.completions.with_raw_response.create(
+                        model=self.model,
+                        messages=messages,
+                        **params,
+                    )
+                )
+        except RateLimitError as e:
+            raise RateLimited(e.response.headers) from e
+        return raw_response.parse(), raw_response.headers
+
+    async def stream(
+        self,
+        messages: List[Dict[str, Any]],
+        response_format: Any,
+        params: Dict[str, Any],
+        answer_fields: Optional[List[str]] = None,
+    ) -> Tuple[Any, Mapping[str, str], StreamTiming]:
+        # The SDK's stream helpers build several models per chunk, which costs
+        # more CPU than the stream saves at high concurrency, so the events are
+        # read as plain JSON
+        timing = StreamTiming()
+        start_time = time.time()
+        contents: Dict[int, str] = {}
+        usage = None
+        answer = None
+        try:
+            async with self.client.chat.completions.with_streaming_response.create(
+                model=self.model,
+                messages=messages,
+                stream=True,
+                stream_options={"include_usage": True},
+                **(
+                    {"response_format": json_schema_response_format(response_format)}
+                    if is_model(response_format)
+                    else {}
+                ),
+                **params,
+            ) as raw_response:
+                headers = raw_response.headers
+                async for line in raw_response.iter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[len("data:") :].strip()
+                    if data == "[DONE]":
+                        break
+                    chunk = json.loads(data)
+                    usage = chunk.get("usage") or usage
+                    for choice in chunk.get("choices") or []:
+                        delta = (choice.get("delta") or {}).get("content")
+                        if not delta:
+                            continue
+                        if timing.time_to_first_token is None:
+                            timing.time_to_first_token = time.time() - start_time
+                        index = choice.get("index", 0)
+                        contents[index] = contents.get(index, "") + delta
+                        # Fields only complete when a quote closes a string or
+                        # starts the next key
+                        if answer_fields and index == 0 and '"' in delta:
+                            partial = parse_partial_json(contents[0])
+                            if answer_complete(partial, answer_fields):
+                                answer = partial
+                                break
+                    if answer is not None:
+                        break
+        except RateLimitError as e:
+            raise RateLimited(e.response.headers) from e
+        timing.time_to_answer = time.time() - start_time
+
+        texts = [contents.get(index, "") for index in range(params.get("n", 1))]
+        completion_tokens = sum(len(text) for text in texts) // CHARS_PER_TOKEN + 1
+        if answer is not None:
+            # Only what was generated before the stream was closed is billed
+            timing.stopped_early = True
+            texts = [partial_answer(response_format, answer).model_dump_json()]
+        elif usage:
+            completion_tokens = usage["completion_tokens"]
+        response = chat_completion(
+            self.model,
+            texts,
+            response_format,
+            (
+                usage["prompt_tokens"]
+                if usage
+                else estimate_tokens(messages, output_tokens=0)
+            ),
+            completion_tokens,
+        )
+        return response, headers, timing
+
+
+class GeminiProvider(Provider):
+    """
+    Google's Gemini models, through the `google-generativeai` SDK. The API key
+    defaults to the `GOOGLE_API_KEY` environment variable. The SDK keeps one
+    key per process, so Gemini providers cannot have different keys.
+    """
+
+    def __init__(self, config: ProviderConfig, llm_config: LLMConfig):
+        import google.generativeai as genai
+        from google.api_core.exceptions import ResourceExhausted
+
+        super().__init__(
+            config,
+            RateLimiter(
+                requests_per_minute=config.requests_per_minute,
+                tokens_per_minute=config.tokens_per_minute,
+            ),
+            CircuitBreaker(
+                failure_threshold=llm_config.retries.failure_threshold,
+                cooldown_seconds=llm_config.retries.cooldown_seconds,
+            ),
+        )
+        genai.configure(api_key=config.api_key or os.getenv("GOOGLE_API_KEY"))
+        self.__genai = genai
+        self.__rate_limit_error = ResourceExhausted
+
+    async def send(
+        self,
+        messages: List[Dict[str, Any]],
+        response_format: Any,
+        params: Dict[str, Any],
+    ) -> Tuple[Any, Mapping[str, str]]:
+        system_instruction, contents = gemini_contents(messages)
+        generation_config = {"candidate_count": params.get("n", 1)}
+        if is_model(response_format):
+            generation_config["response_mime_type"] = "application/json"
+            generation_config["response_schema"] = gemini_schema(
+                response_format.model_json_schema()
+            )
+        model = self.__genai.GenerativeModel(
+            self.model, system_instruction=system_instruction
+        )
+        try:
+            response = await model.generate_content_async(
+                contents,
+                generation_config=self.__genai.GenerationConfig(**generation_config),
+            )
+        except self.__rate_limit_error as e:
+            raise RateLimited({}) from e
+
+        texts = [
+            "".join(part.text for part in candidate.content.parts)
+            for candidate in response.candidates
+        ]
+        usage = response.usage_metadata
+        return (
+            chat_completion(
+                self.model,
+                texts,
+                response_format,
+                usage.prompt_token_count,
+                usage.candidates_token_count,
+            ),
+            {},
+        )
+
+
+def is_model(response_format: Any) -> bool:
+    return isinstance(response_format, type) and issubclass(response_format, BaseModel)
+
+
+def chat_completion(
+    model: str,
+    texts: List[str],
+    response_format: Any,
+    prompt_tokens: int,
+    completion_tokens: int,
+) -> Any:
+    """
+    Wrap the texts of a provider's choices in an OpenAI chat completion,
+    parsed into `response_format` if it is a pydantic model.
+    """
+    data = {
+        "id": f"{model}-{time.time_ns()}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [
+            {
+                "index": index,
+                "finish_reason": "stop",
+                "message": {
+                    "role": "assistant",
+                    "content": text,
+                    **(
+                        {"parsed": response_format.model_validate_json(text)}
+                        if is_model(response_format)
+                        else {}
+                    ),
+                },
+            }
+            for index, text in enumerate(texts)
+        ],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    }
+    if is_model(response_format):
+        return ParsedChatCompletion[response_format].model_validate(data)
+    return ChatCompletion.model_validate(data)
+
+
+def gemini_contents(
+    messages: List[Dict[str, Any]],
+) -> Tuple[Optional[str], List[Dict[str, Any]]]:
+    """
+    Convert OpenAI chat messages into a Gemini system instruction and contents,
+    merging consecutive messages of the same role.
+    """
+    system = [m["content"] for m in messages if m["role"] == "system"]
+    contents = []
+    for message in messages:
+        if message["role"] == "system":
+            continue
+        role = "model" if message["role"] == "assistant" else "user"
+        if contents and contents[-1]["role"] == role:
+            contents[-1]["parts"].append(message["content"])
+        else:
+            contents.append({"role": role, "parts": [message["content"]]})
+    return ("\n\n".join(system) or None), contents
+
+
+def json_schema_response_format(model: type[BaseModel]) -> Dict[str, Any]:
+    """
+    The `response_format` parameter requesting structured outputs in the
+    shape of a pydantic model, as the SDK's `parse` sends it.
+    """
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "schema": strict_schema(model.model_json_schema()),
+            "name": model.__name__,
+            "strict": True,
+        },
+    }
+
+
+def strict_schema(schema: Any) -> Any:
+    """
+    Convert a pydantic JSON schema into the subset accepted by strict
+    structured outputs: objects require all of their properties and allow no
+    others.
+    """
+    if isinstance(schema, list):
+        return [strict_schema(item) for item in schema]
+    if not isinstance(schema, dict):
+        return schema
+    strict = {
+        key: (
+            {name: strict_schema(value) for name, value in value.items()}
+            if key in ("properties", "$defs")
+            else strict_schema(value)
+        )
+        for key, value in schema.items()
+        if not (key == "default" and value is None)
+    }
+    if strict.get("type") == "object":
+        strict["required"] = list(strict.get("properties", {}))
+        strict["additionalProperties"] = False
+    return strict
+
+
+def gemini_schema(schema: Dict[str, Any], defs: Optional[Dict] = None) -> Any:
+    """
+    Convert a pydantic JSON schema into the OpenAPI subset accepted by Gemini:
+    references are inlined and unsupported keywords dropped.
+    """
+    if defs is None:
+        defs = schema.get("$defs", {})
+    if isinstance(schema, list):
+        return [gemini_schema(item, defs) for item in schema]
+    if not isinstance(schema, dict):
+        return schema
+    if "$ref" in schema:
+        return gemini_schema(defs[schema["$ref"].rsplit("/", 1)[-1]], defs)
+    return {
+        key: (
+            {name: gemini_schema(value, defs) for name, value in value.items()}
+            if key == "properties"
+            else gemini_schema(value, defs)
+        )
+        for key, value in schema.items()
+        if key not in UNSUPPORTED_GEMINI_SCHEMA_KEYS
+    }
+
+
+class ProviderPool:
+    """
+    Routes the completions of the solvers to a weighted choice of providers.
+
+    With `hedge_quantile`, a request still running past that quantile of its
+    provider's recent latencies is duplicated on another provider, and
+    whichever answer arrives first is used.
+
+    Attributes:
+        hedged: Number of requests duplicated on a second provider
+        hedges_won: Number of hedged requests answered first by the duplicate
+        stragglers: Number of attempts cancelled for running past their
+            deadline
+        stopped_early: Number of streams closed once their answer was complete
+        token_budget: The spending limit requests are charged to, if any
+    """
+
+    def __init__(
+        self,
+        providers: List[Provider],
+        hedge_quantile: Optional[float] = None,
+        deadlines: Optional[DeadlineConfig] = None,
+        retries: Optional[RetryPolicy] = None,
+        token_budget: Optional[TokenBudget] = None,
+        rng: Optional[random.Random] = None,
+    ):
+        if not providers:
+            raise ValueError("At least one provider is required")
+        self.providers = providers
+        self.hedge_quantile = hedge_quantile
+        self.deadlines = deadlines or DeadlineConfig()
+        self.retries = retries or RetryPolicy()
+        self.token_budget = token_budget
+        self.hedged = 0
+        self.hedges_won = 0
+        self.stragglers = 0
+        self.stopped_early = 0
+        self.__rng = rng or random.Random()
+
+    @property
+    def model_key(self) -> str:
+        """
+        Identifies the mix of models answering the pool's requests, e.g. to key
+        cached responses.
+        """
+        return "+".join(sorted(provider.model for provider in self.providers))
+
+    def choose(self, exclude: Optional[Provider] = None) -> Optional[Provider]:
+        """
+        Pick a provider at random in proportion to the weights, skipping
+        providers whose circuit is open unless all of them are. Providers with
+        a weight of 0 only receive hedged duplicates, when no other provider
+        is left to pick.
+
+        Args:
+            exclude: A provider not to pick, e.g. the one a request is hedging
+
+        Returns:
+            The provider, or None if `exclude` was the only one
+        """
+        candidates = [p for p in self.providers if p is not exclude]
+        if not candidates:
+            return None
+        # Route around failing providers while others are healthy
+        closed = [p for p in candidates if not p.circuit_breaker.is_open]
+        candidates = closed or candidates
+        weights = [p.weight for p in candidates]
+        return self.__rng.choices(
+            candidates, weights=weights if any(weights) else None
+        )[0]
+
+    async def complete(
+        self,
+        messages: List[Dict[str, Any]],
+        response_format: Any,
+        params: Dict[str, Any],
+        scheduler: RequestScheduler,
+        stream: bool = False,
+        answer_fields: Optional[List[str]] = None,
+    ) -> Tuple[Any, Provider, float, int, Optional[StreamTiming]]:
+        """
+        Send a chat completion to a provider of the pool, hedging it on a
+        second provider if it runs late.
+
+        A call still running past its deadline (see `DeadlineConfig`) is a
+        straggler: it is cancelled and sent again, to another provider when
+        there is one. Calls never run past the deadline of their task.
+
+        Args:
+            stream: Stream the completion, to time its first token and answer
+            answer_fields: With `stream`, the fields of `response_format` that
+                make up the answer; the stream is closed once they are complete
+
+        Returns:
+            The response, the provider that answered, its latency, the number
+            of straggling attempts cancelled before it, and the stream's timing
+            if it was streamed
+
+        Raises:
+            Straggler: If the last attempt also ran past its deadline
+            DeadlineExceeded: If the task's deadline passed
+            BudgetExceeded: If the request could take the spending past the
+                token budget
+        """
+        stragglers = 0
+        straggler = None
+        retries = self.deadlines.max_straggler_retries
+        for attempt in range(retries + 1):
+            primary = self.choose(exclude=straggler) or straggler
+            try:
+                response, provider, latency, timing = await self.__attempt(
+                    primary,
+                    messages,
+                    response_format,
+                    params,
+                    scheduler,
+                    last=attempt == retries,
+                    stream=stream,
+                    answer_fields=answer_fields,
+                )
+                return response, provider, latency, stragglers, timing
+            except Straggler:
+                stragglers += 1
+                self.stragglers += 1
+                straggler = primary
+                if attempt == retries:
+                    raise
+
+    async def __attempt(
+        self,
+        primary: Provider,
+        messages: List[Dict[str, Any]],
+        response_format: Any,
+        params: Dict[str, Any],
+        scheduler: RequestScheduler,
+        last: bool,
+        stream: bool,
+        answer_fields: Optional[List[str]],
+    ) -> Tuple[Any, Provider, float, Optional[StreamTiming]]:
+        delay = (
+            primary.latency_quantile(self.hedge_quantile)
+            if self.hedge_quantile
+            else None
+        )
+        backup = self.choose(exclude=primary) if delay is not None else None
+        primary_task = asyncio.ensure_future(
+            self.__send(
+                primary,
+                messages,
+                response_format,
+                params,
+                scheduler,
+                last,
+                stream,
+                answer_fields,
+            )
+        )
+        if backup is None:
+            return await primary_task
+
+        pending = {primary_task}
+        try:
+            done, _ = await asyncio.wait(pending, timeout=delay)
+            if done:
+                return primary_task.result()
+
+            self.hedged += 1
+            backup_task = asyncio.ensure_future(
+                self.__send(
+                    backup,
+                    messages,
+                    response_format,
+                    params,
+                    scheduler,
+                    last,
+                    stream,
+                    answer_fields,
+                )
+            )
+            pending = {primary_task, backup_task}
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        if task is backup_task:
+                            self.hedges_won += 1
+                        return task.result()
+            # Both failed: report the primary's error
+            return primary_task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+            # Wait for the losers to unwind, so that their scheduler slots and
+            # connections are released before the winner is used
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    async def __send(
+        self,
+        provider: Provider,
+        messages: List[Dict[str, Any]],
+        response_format: Any,
+        params: Dict[str, Any],
+        scheduler: RequestScheduler,
+        last: bool,
+        stream: bool,
+        answer_fields: Optional[List[str]],
+    ) -> Tuple[Any, Provider, float, Optional[StreamTiming]]:
+        """
+        Send a request to one provider through its rate limiter and the
+        scheduler, retrying rate-limited and transient failures (see
+        `aretry_call`). Rate-limited requests are sent again once the limiter's
+        pause (from `Retry-After`, or the backoff) has passed.
+
+        Every attempt reserves its estimated tokens in the token budget once
+        it holds a scheduler slot, so only requests in flight hold
+        reservations.
+
+        Args:
+            last: Whether this is the last attempt at the call, which only
+                stops at the task's deadline
+            stream: Whether to stream the completion
+            answer_fields: The fields to stop streaming after
+        """
+        estimated_output = params.get("n", 1) * DEFAULT_ESTIMATED_OUTPUT_TOKENS
+        estimated_input = estimate_tokens(messages, output_tokens=0)
+        estimated_tokens = estimated_input + estimated_output
+        rate_limiter = provider.rate_limiter
+        token_budget = self.token_budget
+
+        async def send_once():
+            await rate_limiter.aacquire(estimated_tokens)
+            reserved = False
+            try:
+                async with scheduler.slot():
+                    if token_budget:
+                        token_budget.reserve(estimated_input, estimated_output)
+                        reserved = True
+                    call_deadline = (
+                        None
+                        if last
+                        else self.deadlines.call_deadline(
+                            provider.latency_quantile(self.deadlines.straggler_quantile)
+                        )
+                    )
+                    task_remaining = remaining_seconds()
+                    start_time = time.time()
+                    if stream:
+                        request = provider.stream(
+                            messages, response_format, params, answer_fields
+                        )
+                    else:
+                        request = provider.send(messages, response_format, params)
+                    try:
+                        result = await asyncio.wait_for(
+                            request, min_deadline(call_deadline, task_remaining)
+                        )
+                    except asyncio.TimeoutError:
+                        latency = time.time() - start_time
+                        if call_deadline is None or (
+                            task_remaining is not None
+                            and task_remaining <= call_deadline
+                        ):
+                            raise DeadlineExceeded(
+                                f"Call to {provider.name} ran past its task's deadline"
+                            )
+                        raise Straggler(provider.name, latency)
+                    return result, time.time() - start_time
+            except BaseException:
+                rate_limiter.settle(estimated_tokens, 0)
+                if reserved:
+                    token_budget.settle(estimated_input, estimated_output, 0, 0)
+                raise
+
+        result, latency = await aretry_call(
+            send_once,
+            self.retries,
+            provider.circuit_breaker,
+            rate_limit_handler(rate_limiter),
+        )
+        response, headers = result[:2]
+        timing = result[2] if stream else None
+        rate_limiter.update_from_headers(headers)
+        rate_limiter.settle(estimated_tokens, response.usage.total_tokens)
+        if token_budget:
+            token_budget.settle(
+                estimated_input,
+                estimated_output,
+                response.usage.prompt_tokens,
+                response.usage.completion_tokens,
+            )
+        # Streams closed early are shorter than full completions, and would pull
+        # the hedging and straggler deadlines down
+        if timing and timing.stopped_early:
+            self.stopped_early += 1
+        else:
+            provider.latencies.append(latency)
+        return response, provider, latency, timing
+
+
+def min_deadline(*deadlines: Optional[float]) -> Optional[float]:
+    """
+    The earliest of the given deadlines, ignoring missing ones.
+    """
+    known = [deadline for deadline in deadlines if deadline is not None]
+    return max(0.0, min(known)) if known else None
+
+
+def build_provider(config: ProviderConfig, llm_config: LLMConfig) -> Provider:
+    if config.type == "gemini":
+        return GeminiProvider(config, llm_config)
+    return OpenAIProvider(config, llm_config)
+
+
+_provider_pools: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+# The pools created outside an event loop, by configuration
+_unbound_provider_pools: dict[str, ProviderPool] = {}
+
+
+def get_provider_pool(config: LLMConfig) -> ProviderPool:
+    """
+    Return the provider pool of the configuration: the configured
+    `[[providers]]`, or the top-level endpoint and model otherwise. Pools are
+    shared per event loop, like the async clients they use, and outside a loop
+    by the callers with the same configuration.
+    """
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        loop = None
+    if loop is not None and loop in _provider_pools:
+        return _provider_pools[loop]
+    unbound_key = config.model_dump_json()
+    if loop is None and unbound_key in _unbound_provider_pools:
+        return _unbound_provider_pools[unbound_key]
+
+    provider_configs = config.providers or [
+        ProviderConfig(
+            name="default",
+            model=config.model,
+            base_url=config.base_url,
+            api_key=config.api_key,
+            requests_per_minute=config.requests_per_minute,
+            tokens_per_minute=config.tokens_per_minute,
+        )
+    ]
+    pool = ProviderPool(
+        [build_provider(provider, config) for provider in provider_configs],
+        hedge_quantile=config.hedge_quantile,
+        deadlines=config.deadlines,
+        retries=config.retries,
+        token_budget=get_token_budget(config.budget),
+    )
+    if loop is None:
+        _unbound_provider_pools[unbound_key] = pool
+    else:
+        _provider_pools[loop] = pool
+    return pool
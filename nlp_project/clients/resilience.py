@@ -0,0 +1,268 @@
+import asyncio
+import random
+import threading
+import time
+from typing import Awaitable, Callable, Mapping, Optional, TypeVar
+
+import openai
+from pydantic import BaseModel
+
+T = TypeVar("T")
+
+RATE_LIMITED = "rate_limited"
+TRANSIENT = "transient"
+FATAL = "fatal"
+
+# Status codes worth sending again: timeouts, conflicts and server errors
+TRANSIENT_STATUS_CODES = {408, 409, 425, 500, 502, 503, 504}
+
+# While a half-open circuit's probe is in flight, others check back this often
+HALF_OPEN_POLL_SECONDS = 1.0
+
+
+class RateLimited(Exception):
+    """
+    A provider rejected a request because of its rate limits.
+    """
+
+    def __init__(self, headers: Mapping[str, str]):
+        super().__init__("Rate limit reached")
+        self.headers = headers
+
+
+class RetryPolicy(BaseModel):
+    """
+    The `[retries]` section of `llm_config.toml`.
+
+    Attributes:
+        max_attempts: Attempts at a request before its error is raised
+        base_seconds: Backoff before the first retry, doubled for every later
+            one (with full jitter)
+        max_seconds: Longest backoff
+        failure_threshold: Consecutive transient failures of an endpoint after
+            which its circuit opens
+        cooldown_seconds: How long an open circuit holds back new requests
+            before letting a probe through
+    """
+
+    max_attempts: int = 5
+    base_seconds: float = 1.0
+    max_seconds: float = 30.0
+    failure_threshold: int = 5
+    cooldown_seconds: float = 30.0
+
+    def backoff(self, attempt: int, rng: Optional[random.Random] = None) -> float:
+        """
+        A random backoff before retrying after the given (0-based) attempt.
+        """
+        ceiling = min(self.max_seconds, self.base_seconds * 2**attempt)
+        return (rng or random).uniform(0, ceiling)
+
+
+def classify_error(error: BaseException) -> str:
+    """
+    Classify a request error as `RATE_LIMITED`, `TRANSIENT` (worth sending
+    again after a backoff) or `FATAL` (e.g. an invalid request or API key).
+    """
+    if isinstance(error, (RateLimited, openai.RateLimitError)):
+        return RATE_LIMITED
+    if isinstance(error, (openai.APIConnectionError, openai.APITimeoutError)):
+        return TRANSIENT
+    if isinstance(error, openai.APIStatusError):
+        if error.status_code in TRANSIENT_STATUS_CODES or error.status_code >= 500:
+            return TRANSIENT
+        return FATAL
+    # Gemini's SDK reports overload and outages through google.api_core
+    if type(error).__name__ in {
+        "ServiceUnavailable",
+        "InternalServerError",
+        "DeadlineExceeded",
+    } and type(error).__module__.startswith("google.api_core"):
+        return TRANSIENT
+    return FATAL
+
+
+def error_headers(error: BaseException) -> Mapping[str, str]:
+    """
+    The response headers of a request error, if it has any.
+    """
+    if isinstance(error, RateLimited):
+        return error.headers
+    if isinstance(error, openai.APIStatusError):
+        return error.response.headers
+    return {}
+
+
+class CircuitBreaker:
+    """
+    Holds back new requests to an endpoint that keeps failing.
+
+    After `failure_threshold` consecutive transient failures the circuit
+    opens: requests wait `cooldown_seconds`, then a single probe is let
+    through. A successful probe closes the circuit again, a failing one
+    reopens it.
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int = 5,
+        cooldown_seconds: float = 30.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.failures = 0
+        self.opened = 0
+        self.__clock = clock
+        self.__lock = threading.Lock()
+        self.__open_until: Optional[float] = None
+        self.__probing = False
+
+    @property
+    def is_open(self) -> bool:
+        with self.__lock:
+            return self.__open_until is not None
+
+    def check(self) -> float:
+        """
+        Ask to send a request.
+
+        Returns:
+            0 if the request may be sent, or the number of seconds to wait
+            before asking again
+        """
+        with self.__lock:
+            if self.__open_until is None:
+                return 0.0
+            now = self.__clock()
+            if now < self.__open_until:
+                return self.__open_until - now
+            if self.__probing:
+                return HALF_OPEN_POLL_SECONDS
+            self.__probing = True
+            return 0.0
+
+    def record_success(self) -> None:
+        with self.__lock:
+            self.failures = 0
+            self.__open_until = None
+            self.__probing = False
+
+    def record_failure(self) -> None:
+        with self.__lock:
+            self.failures += 1
+            if self.__probing or self.failures >= self.failure_threshold:
+                if self.__open_until is None:
+                    self.opened += 1
+                self.__open_until = self.__clock() + self.cooldown_seconds
+                self.__probing = False
+
+    def record_neutral(self) -> None:
+        """
+        Record a request that says nothing about the endpoint's health, e.g.
+        a rejected or cancelled one, releasing a probe.
+        """
+        with self.__lock:
+            self.__probing = False
+
+    async def await_closed(self) -> None:
+        while (wait := self.check()) > 0:
+            await asyncio.sleep(wait)
+
+    def wait_closed(self) -> None:
+        while (wait := self.check()) > 0:
+            time.sleep(wait)
+
+
+def _retry_delay(
+    error: BaseException,
+    attempt: int,
+    policy: RetryPolicy,
+    breaker: CircuitBreaker,
+    on_rate_limited: Optional[Callable[[Mapping[str, str], float], None]],
+) -> Optional[float]:
+    """
+    Record a failed attempt and decide whether to send the request again.
+
+    Returns:
+        The seconds to wait before the next attempt, or None to raise the error
+    """
+    kind = classify_error(error)
+    if kind == TRANSIENT:
+        breaker.record_failure()
+    else:
+        breaker.record_neutral()
+    backoff = policy.backoff(attempt)
+    if kind == RATE_LIMITED and on_rate_limited:
+        on_rate_limited(error_headers(error), backoff)
+    if kind == FATAL or attempt == policy.max_attempts - 1:
+        return None
+    if kind == RATE_LIMITED and on_rate_limited:
+        # The rate limiter paces the next attempt
+        return 0.0
+    return backoff
+
+
+async def aretry_call(
+    send: Callable[[], Awaitable[T]],
+    policy: RetryPolicy,
+    breaker: CircuitBreaker,
+    on_rate_limited: Optional[Callable[[Mapping[str, str], float], None]] = None,
+) -> T:
+    """
+    Send a request, retrying rate-limited and transient failures with jittered
+    exponential backoff while the endpoint's circuit lets requests through.
+
+    Args:
+        send: Sends the request once
+        policy: How often and how long to retry
+        breaker: The circuit breaker of the endpoint
+        on_rate_limited: Called with the error's headers and a suggested
+            backoff when the request was rate-limited; the caller then paces
+            the next attempt itself (e.g. through its rate limiter)
+
+    Returns:
+        The response
+
+    Raises:
+        The last error, once it is fatal or the attempts are used up
+    """
+    for attempt in range(policy.max_attempts):
+        await breaker.await_closed()
+        try:
+            response = await send()
+        except asyncio.CancelledError:
+            breaker.record_neutral()
+            raise
+        except Exception as e:
+            delay = _retry_delay(e, attempt, policy, breaker, on_rate_limited)
+            if delay is None:
+                raise
+            await asyncio.sleep(delay)
+            continue
+        breaker.record_success()
+        return response
+
+
+def retry_call(
+    send: Callable[[], T],
+    policy: RetryPolicy,
+    breaker: CircuitBreaker,
+    on_rate_limited: Optional[Callable[[Mapping[str, str], float], None]] = None,
+) -> T:
+    """
+    Blocking version of `aretry_call`, for the scorers and generators that use the
+    synchronous client.
+    """
+    for attempt in range(policy.max_attempts):
+        breaker.wait_closed()
+        try:
+            response = send()
+        except Exception as e:
+            delay = _retry_delay(e, attempt, policy, breaker, on_rate_limited)
+            if delay is None:
+                raise
+            time.sleep(delay)
+            continue
+        breaker.record_success()
+        return response
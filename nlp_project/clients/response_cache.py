@@ -0,0 +1,287 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Optional, Union
+
+from openai.types import CreateEmbeddingResponse
+from openai.types.chat import ChatCompletion, ParsedChatCompletion
+from pydantic import BaseModel
+
+EVICTION_INTERVAL = 100
+
+cache_sample: ContextVar[int] = ContextVar("cache_sample", default=0)
+
+
+class CacheConfig(BaseModel):
+    """
+    The `[cache]` section of `llm_config.toml`.
+
+    Attributes:
+        path: SQLite file of the cache
+        max_size_mb: Size above which the least recently used responses are
+            evicted
+        max_age_days: Age after which responses are evicted
+        nondeterministic: Also cache requests sampled at a nonzero
+            temperature. Their key includes the sample index of the request
+            (e.g. the iteration), so replaying a run returns the same samples.
+    """
+
+    path: str = "cache/llm_responses.sqlite3"
+    max_size_mb: float = 1024
+    max_age_days: float = 30
+    nondeterministic: bool = False
+
+
+def schema_hash(response_format: Any) -> str:
+    """
+    Hash the JSON schema of a response format, or name the plain-text format.
+    """
+    if isinstance(response_format, type) and issubclass(response_format, BaseModel):
+        schema = json.dumps(response_format.model_json_schema(), sort_keys=True)
+        return hashlib.sha256(schema.encode()).hexdigest()
+    return "text"
+
+
+def request_key(
+    model: str,
+    payload: Any,
+    response_format: Any,
+    params: dict[str, Any],
+    sample: Optional[int],
+) -> str:
+    """
+    Hash everything that determines the response of a request: the model, the
+    messages (or embedding inputs), the response-format schema, the sampling
+    parameters and, for sampled requests, the sample index.
+    """
+    content = json.dumps(
+        {
+            "model": model,
+            "payload": payload,
+            "schema": schema_hash(response_format),
+            "params": params,
+            "sample": sample,
+        },
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def is_deterministic(params: dict[str, Any]) -> bool:
+    return params.get("temperature") == 0
+
+
+def load_response(data: dict, response_format: Any) -> BaseModel:
+    """
+    Restore a cached chat completion, parsing its choices into
+    `response_format` if it is a pydantic model.
+    """
+    if not (
+        isinstance(response_format, type) and issubclass(response_format, BaseModel)
+    ):
+        return ChatCompletion.model_validate(data)
+    response = ParsedChatCompletion[response_format].model_validate(data)
+    for choice in response.choices:
+        if choice.message.parsed is None and choice.message.content:
+            choice.message.parsed = response_format.model_validate_json(
+                choice.message.content
+            )
+    return response
+
+
+def load_embeddings(data: dict) -> CreateEmbeddingResponse:
+    return CreateEmbeddingResponse.model_validate(data)
+
+
+class ResponseCache:
+    """
+    Content-addressed, on-disk cache of LLM responses, shared by every solver
+    and scorer of a process and by any process using the same file.
+
+    Responses are keyed by a hash of the model, the request payload, the
+    response-format schema and the sampling parameters. Requests sampled at a
+    nonzero temperature are only cached with `nondeterministic`, and then
+    per sample index (see `cache_sample`).
+    """
+
+    def __init__(
+        self,
+        path: Union[str, Path],
+        max_size_mb: float = 1024,
+        max_age_days: float = 30,
+        nondeterministic: bool = False,
+    ):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = int(max_size_mb * 1024 * 1024)
+        self.max_age_seconds = max_age_days * 24 * 60 * 60
+        self.nondeterministic = nondeterministic
+        self.hits = 0
+        self.misses = 0
+        self.__puts = 0
+        self.__lock = threading.Lock()
+        self.__connection = sqlite3.connect(
+            self.path, timeout=60, isolation_level=None, check_same_thread=False
+        )
+        with self.__lock:
+            self.__connection.execute("PRAGMA journal_mode=WAL")
+            self.__connection.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    response TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    used_at REAL NOT NULL
+                )
+                """)
+            self.__connection.execute(
+                "CREATE INDEX IF NOT EXISTS responses_used_at ON responses (used_at)"
+            )
+        self.evict()
+
+    def key(
+        self,
+        model: str,
+        payload: Any,
+        response_format: Any = str,
+        params: Optional[dict[str, Any]] = None,
+        deterministic: Optional[bool] = None,
+    ) -> Optional[str]:
+        """
+        Compute the cache key of a request.
+
+        Args:
+            model: The model the request is sent to
+            payload: The messages (or embedding inputs) of the request
+            response_format: The pydantic model of the response, or `str`
+            params: The sampling parameters of the request (e.g. `n`,
+                `temperature`)
+            deterministic: Whether the response only depends on the request,
+                e.g. for embeddings. Derived from `params` if None.
+
+        Returns:
+            The key, or None if the request must not be cached
+        """
+        params = params or {}
+        if deterministic is None:
+            deterministic = is_deterministic(params)
+        if not deterministic and not self.nondeterministic:
+            return None
+        return request_key(
+            model,
+            payload,
+            response_format,
+            params,
+            None if deterministic else cache_sample.get(),
+        )
+
+    def get(self, key: Optional[str]) -> Optional[dict]:
+        """
+        Look up a cached response.
+
+        Returns:
+            The response as stored by `put`, or None on a miss
+        """
+        if key is None:
+            return None
+        now = time.time()
+        with self.__lock:
+            row = self.__connection.execute(
+                "SELECT response FROM responses WHERE key = ? AND created_at >= ?",
+                (key, now - self.max_age_seconds),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.__connection.execute(
+                "UPDATE responses SET used_at = ? WHERE key = ?", (now, key)
+            )
+        return json.loads(row[0])
+
+    def put(self, key: Optional[str], response: BaseModel) -> None:
+        if key is None:
+            return
+        data = json.dumps(response.model_dump(mode="json"), ensure_ascii=False)
+        now = time.time()
+        with self.__lock:
+            self.__connection.execute(
+                "INSERT OR REPLACE INTO responses "
+                "(key, response, size, created_at, used_at) VALUES (?, ?, ?, ?, ?)",
+                (key, data, len(data), now, now),
+            )
+            self.__puts += 1
+            evict = self.__puts % EVICTION_INTERVAL == 0
+        if evict:
+            self.evict()
+
+    def delete(self, key: Optional[str]) -> None:
+        """
+        Drop a cached response, e.g. one that turned out to be unusable.
+        """
+        if key is None:
+            return
+        with self.__lock:
+            self.__connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+
+    def evict(self) -> int:
+        """
+        Drop expired responses, then the least recently used ones until the
+        cache fits in its size limit.
+
+        Returns:
+            The number of evicted responses
+        """
+        with self.__lock:
+            evicted = self.__connection.execute(
+                "DELETE FROM responses WHERE created_at < ?",
+                (time.time() - self.max_age_seconds,),
+            ).rowcount
+            total = self.__connection.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()[0]
+            if total <= self.max_bytes:
+                return evicted
+            keys = []
+            for key, size in self.__connection.execute(
+                "SELECT key, size FROM responses ORDER BY used_at"
+            ):
+                if total <= self.max_bytes:
+                    break
+                keys.append((key,))
+                total -= size
+            self.__connection.execute("BEGIN IMMEDIATE")
+            self.__connection.executemany("DELETE FROM responses WHERE key = ?", keys)
+            self.__connection.execute("COMMIT")
+        return evicted + len(keys)
+
+    def close(self) -> None:
+        with self.__lock:
+            self.__connection.close()
+
+
+_response_caches: dict[str, ResponseCache] = {}
+_response_caches_lock = threading.Lock()
+
+
+def get_response_cache(config: Optional[CacheConfig]) -> Optional[ResponseCache]:
+    """
+    Return the process-wide response cache of the given configuration, or None
+    if caching is not configured.
+    """
+    if config is None:
+        return None
+    with _response_caches_lock:
+        if config.path not in _response_caches:
+            _response_caches[config.path] = ResponseCache(
+                config.path,
+                max_size_mb=config.max_size_mb,
+                max_age_days=config.max_age_days,
+                nondeterministic=config.nondeterministic,
+            )
+        return _response_caches[config.path]
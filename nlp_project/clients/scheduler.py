@@ -0,0 +1,107 @@
+import asyncio
+import contextvars
+import functools
+import heapq
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Awaitable, Callable, Optional, TypeVar
+
+DEFAULT_MAX_IN_FLIGHT = 32
+
+T = TypeVar("T")
+
+task_priority: ContextVar[float] = ContextVar("task_priority", default=0.0)
+
+
+async def with_priority(priority: float, awaitable: Awaitable[T]) -> T:
+    """
+    Await `awaitable` with every request it sends, including those of the
+    tasks it spawns, waiting for a slot at the given priority.
+    """
+    task_priority.set(priority)
+    return await awaitable
+
+
+class RequestScheduler:
+    """
+    Enforces one in-flight request limit shared by every solver, problem and
+    iteration of an experiment.
+
+    When every slot is taken, freed slots go to the waiting request with the
+    highest priority, and to the longest-waiting one among equal priorities.
+
+    Blocking work of the experiment (scoring, cache and queue I/O) runs on the
+    scheduler's thread pool with `run_blocking`, which lives as long as the
+    scheduler and has one thread per request slot.
+    """
+
+    def __init__(self, max_in_flight: int = DEFAULT_MAX_IN_FLIGHT):
+        if max_in_flight < 1:
+            raise ValueError("max_in_flight must be at least 1")
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self.__waiters: list[tuple[float, int, asyncio.Future]] = []
+        self.__order = itertools.count()
+        # Threads are started on demand, so an unused pool costs nothing
+        self.__executor = ThreadPoolExecutor(
+            max_workers=max_in_flight, thread_name_prefix="experiment"
+        )
+
+    async def run_blocking(self, func: Callable[..., T], *args) -> T:
+        """
+        Call `func(*args)` on the scheduler's thread pool. As with
+        `asyncio.to_thread`, the call sees the caller's context variables.
+        """
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(
+            self.__executor, functools.partial(context.run, func, *args)
+        )
+
+    def shutdown(self) -> None:
+        """
+        Wait for the blocking work in progress and stop the thread pool.
+        """
+        self.__executor.shutdown(wait=True)
+
+    @asynccontextmanager
+    async def slot(self, priority: Optional[float] = None):
+        """
+        Hold one of the scheduler's request slots for the duration of the block.
+
+        Args:
+            priority: Priority of the request. Defaults to the priority set by
+                `with_priority` for the current task, or 0.
+        """
+        if priority is None:
+            priority = task_priority.get()
+        await self.__acquire(priority)
+        try:
+            yield
+        finally:
+            self.__release()
+
+    async def __acquire(self, priority: float) -> None:
+        if self.in_flight < self.max_in_flight and not self.__waiters:
+            self.in_flight += 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.__waiters, (-priority, next(self.__order), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was handed over just before the cancellation
+                self.__release()
+            raise
+
+    def __release(self) -> None:
+        while self.__waiters:
+            _, _, future = heapq.heappop(self.__waiters)
+            if not future.done():
+                # Hand the slot over without freeing it
+                future.set_result(None)
+                return
+        self.in_flight -= 1
@@ -0,0 +1,107 @@
+import asyncio
+from contextvars import ContextVar
+from typing import Awaitable, Callable, Hashable, TypeVar
+
+T = TypeVar("T")
+
+# The scope of the shared completions requested by the current task, such as
+# the problem it solves
+completion_scope: ContextVar[Hashable] = ContextVar("completion_scope", default=None)
+
+
+class SharedCompletions:
+    """
+    Completions shared by the solvers of an experiment that send identical
+    requests, such as the first turn of a problem's iteration.
+
+    The first solver to ask for a request sends it; the others wait for and
+    reuse its response. Responses are kept with the scope they were requested
+    in (see `completion_scope`) until every holder of the scope has released
+    it, so solvers reaching a request later still reuse it. Responses of a
+    scope that nobody holds are only shared while they are in flight.
+    """
+
+    def __init__(self):
+        self.sent = 0
+        self.reused = 0
+        self.__entries: dict[Hashable, dict[str, asyncio.Future]] = {}
+        self.__holders: dict[Hashable, int] = {}
+
+    def hold(self, scope: Hashable, holders: int = 1) -> None:
+        """
+        Keep the responses of a scope until `holders` more calls to `release`.
+        """
+        self.__holders[scope] = self.__holders.get(scope, 0) + holders
+
+    def release(self, scope: Hashable) -> None:
+        """
+        Release one hold of a scope, dropping its responses once nobody holds
+        it.
+        """
+        self.__holders[scope] -= 1
+        if self.__holders[scope] <= 0:
+            del self.__holders[scope]
+            self.__entries.pop(scope, None)
+
+    async def scoped(self, scope: Hashable, awaitable: Awaitable[T]) -> T:
+        """
+        Await `awaitable` with the completions it shares kept in `scope`, then
+        release one hold of the scope, whether or not it succeeded.
+        """
+        token = completion_scope.set(scope)
+        try:
+            return await awaitable
+        finally:
+            completion_scope.reset(token)
+            self.release(scope)
+
+    async def get(self, key: str, send: Callable[[], Awaitable[T]]) -> tuple[T, bool]:
+        """
+        Return the shared response of a request, sending it if no other solver
+        has.
+
+        If the solver that sent the request fails, the solvers waiting for it
+        send the request themselves.
+
+        Args:
+            key: The key of the request
+            send: Sends the request and returns its response
+
+        Returns:
+            The response, and whether it was sent by another solver
+        """
+        scope = completion_scope.get()
+        entries = self.__entries.setdefault(scope, {})
+        if key in entries:
+            future = entries[key]
+            try:
+                response = await asyncio.shield(future)
+            except BaseException:
+                if not future.done():
+                    # This solver was cancelled while waiting
+                    raise
+                return await send(), False
+            self.reused += 1
+            return response, True
+
+        future = entries[key] = asyncio.get_running_loop().create_future()
+        try:
+            response = await send()
+        except BaseException as e:
+            self.__drop(scope, key)
+            future.set_exception(e)
+            # Mark the exception as retrieved when nobody is waiting
+            future.exception()
+            raise
+        self.sent += 1
+        future.set_result(response)
+        if scope not in self.__holders:
+            # The waiters already have the future
+            self.__drop(scope, key)
+        return response, False
+
+    def __drop(self, scope: Hashable, key: str) -> None:
+        entries = self.__entries.get(scope, {})
+        entries.pop(key, None)
+        if not entries:
+            self.__entries.pop(scope, None)
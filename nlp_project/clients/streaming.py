@@ -0,0 +1,71 @@
+from typing import Any, Iterable, Optional
+
+import jiter
+from pydantic import BaseModel
+
+# Placeholders for required fields a stream ended before, by annotation
+EMPTY_VALUES = {str: str, list: list, dict: dict}
+
+
+class StreamTiming(BaseModel):
+    """
+    Timing of a streamed completion, in seconds since the request was sent.
+
+    Attributes:
+        time_to_first_token: When the first content arrived
+        time_to_answer: When the answer fields were complete, or the stream
+            ended
+        stopped_early: Whether the stream was closed once the answer fields
+            were complete, before the rest of the output was generated
+    """
+
+    time_to_first_token: Optional[float] = None
+    time_to_answer: Optional[float] = None
+    stopped_early: bool = False
+
+
+def parse_partial_json(text: str) -> Any:
+    """
+    Parse the JSON a stream has generated so far, leaving out the string it
+    is in the middle of. Returns None if the text is not valid JSON so far.
+    """
+    try:
+        return jiter.from_json(text.encode(), partial_mode=True)
+    except ValueError:
+        return None
+
+
+def answer_complete(partial: Any, answer_fields: Iterable[str]) -> bool:
+    """
+    Whether the answer fields of a partially parsed JSON object are complete.
+
+    Partial parsing only yields strings once they are closed, but a trailing
+    number or container may still grow, so a non-string field only counts as
+    complete once a later field has started.
+    """
+    if not isinstance(partial, dict):
+        return False
+    keys = list(partial)
+    for field in answer_fields:
+        if field not in partial:
+            return False
+        if not isinstance(partial[field], str) and keys[-1] == field:
+            return False
+    return True
+
+
+def partial_answer(response_format: type[BaseModel], partial: dict) -> BaseModel:
+    """
+    Build the response format from the fields a stream completed. Required
+    fields that were never generated are left empty.
+    """
+    values = {}
+    for name, field in response_format.model_fields.items():
+        if name in partial:
+            values[name] = partial[name]
+        elif not field.is_required():
+            values[name] = field.get_default(call_default_factory=True)
+        else:
+            empty = EMPTY_VALUES.get(field.annotation)
+            values[name] = empty() if empty else None
+    return response_format.model_construct(**values)
@@ -0,0 +1,29 @@
+import pytest
+
+from nlp_project.clients.budget import BudgetConfig, BudgetExceeded, TokenBudget
+
+
+def test_reservations_in_flight_count_against_the_budget():
+    budget = TokenBudget(BudgetConfig(max_tokens=1000))
+
+    budget.reserve(300, 200)
+    budget.reserve(300, 200)
+    with pytest.raises(BudgetExceeded):
+        budget.reserve(1, 0)
+    assert budget.exhausted
+
+
+def test_settled_requests_free_their_unused_reservation():
+    budget = TokenBudget(
+        BudgetConfig(
+            input_price_per_million=2.0, output_price_per_million=8.0, max_cost=0.01
+        )
+    )
+
+    for _ in range(3):
+        budget.reserve(500, 500)
+        budget.settle(500, 500, 500, 100)
+
+    assert (budget.input_tokens, budget.output_tokens) == (1500, 300)
+    assert budget.cost == pytest.approx(0.0054)
+    assert not budget.exhausted
@@ -0,0 +1,56 @@
+import asyncio
+
+from nlp_project.clients import openai_client
+from nlp_project.clients.openai_client import (
+    LLMConfig,
+    connection_limits,
+    get_async_openai_client,
+    get_openai_client,
+)
+
+
+def config(**overrides):
+    return LLMConfig(
+        **{
+            "model": "gpt-4o",
+            "embeddings_model": "text-embedding-ada-002",
+            "base_url": "http://127.0.0.1:1/v1",
+            "api_key": "key",
+            **overrides,
+        }
+    )
+
+
+def test_one_client_per_endpoint_and_key():
+    assert get_openai_client(config()) is get_openai_client(config())
+    assert get_openai_client(config()) is not get_openai_client(config(api_key="other"))
+
+
+def test_one_async_client_per_event_loop():
+    async def get_clients():
+        return get_async_openai_client(config()), get_async_openai_client(config())
+
+    first, second = asyncio.run(get_clients())
+    other_loop, _ = asyncio.run(get_clients())
+
+    assert first is second
+    assert other_loop is not first
+
+
+def test_one_async_client_outside_event_loops():
+    async def get_client():
+        return get_async_openai_client(config())
+
+    outside = get_async_openai_client(config())
+
+    assert get_async_openai_client(config()) is outside
+    assert get_async_openai_client(config(api_key="other")) is not outside
+    assert asyncio.run(get_client()) is not outside
+
+
+def test_pool_is_sized_to_the_experiment_unless_configured(monkeypatch):
+    monkeypatch.setattr(openai_client, "_pool_size", 256)
+
+    assert connection_limits(config()).max_connections == 256
+    assert connection_limits(config()).max_keepalive_connections == 256
+    assert connection_limits(config(max_connections=64)).max_connections == 64
@@ -0,0 +1,37 @@
+import asyncio
+
+import pytest
+
+from nlp_project.clients.deadlines import (
+    DeadlineConfig,
+    DeadlineExceeded,
+    remaining_seconds,
+    with_deadline,
+)
+
+
+def test_call_deadline_follows_latency():
+    config = DeadlineConfig(straggler_multiplier=3, min_call_seconds=10)
+
+    assert config.call_deadline(None) is None
+    assert config.call_deadline(1.0) == 10
+    assert config.call_deadline(5.0) == 15
+    assert DeadlineConfig(call_seconds=60).call_deadline(None) == 60
+
+
+def test_with_deadline_cancels_late_tasks():
+    async def run():
+        remaining = remaining_seconds()
+        await asyncio.sleep(1)
+        return remaining
+
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(with_deadline(0.05, run()))
+    assert asyncio.run(with_deadline(None, asyncio.sleep(0, "done"))) == "done"
+
+
+def test_nested_deadlines_keep_the_earliest():
+    async def run():
+        return await with_deadline(60, asyncio.sleep(0, remaining_seconds()))
+
+    assert asyncio.run(with_deadline(1, run())) <= 1
@@ -0,0 +1,98 @@
+import threading
+
+import numpy as np
+import pytest
+
+from nlp_project.clients.embedding_service import (
+    EmbeddingService,
+    VectorCache,
+    cosine_similarities,
+)
+
+
+class FakeEmbeddings:
+    def __init__(self, fail: bool = False):
+        self.requests: list[list[str]] = []
+        self.fail = fail
+
+    def __call__(self, texts: list[str]) -> list[list[float]]:
+        self.requests.append(texts)
+        if self.fail:
+            raise ConnectionError("embeddings endpoint unavailable")
+        return [[len(text), text.count("a"), 1.0] for text in texts]
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = VectorCache(tmp_path / "cache.sqlite3")
+    yield cache
+    cache.close()
+
+
+def test_cosine_similarities_of_every_pair():
+    a = np.array([[1.0, 0.0], [1.0, 1.0], [0.0, 0.0]])
+    b = np.array([[2.0, 0.0], [0.0, 3.0]])
+
+    similarities = cosine_similarities(a, b)
+
+    assert similarities.shape == (3, 2)
+    np.testing.assert_allclose(
+        similarities, [[1, 0], [2**-0.5, 2**-0.5], [0, 0]], atol=1e-6
+    )
+
+
+def test_concurrent_callers_share_one_request():
+    embed = FakeEmbeddings()
+    service = EmbeddingService(embed, "model", batch_window_seconds=0.2)
+    barrier = threading.Barrier(8)
+    results = {}
+
+    def score(i):
+        barrier.wait()
+        results[i] = service.similarities([f"answer {i}"], ["target"])[0, 0]
+
+    threads = [threading.Thread(target=score, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(embed.requests) == 1
+    assert sorted(embed.requests[0]) == sorted(
+        [f"answer {i}" for i in range(8)] + ["target"]
+    )
+    assert len(results) == 8
+
+
+def test_texts_are_embedded_once(cache):
+    embed = FakeEmbeddings()
+    service = EmbeddingService(embed, "model", cache, batch_window_seconds=0)
+
+    first = service.embed(["alpha", "beta", "alpha"])
+    service.embed(["beta", "gamma"])
+    restarted = EmbeddingService(embed, "model", cache, batch_window_seconds=0)
+    again = restarted.embed(["alpha", "beta"])
+
+    assert embed.requests == [["alpha", "beta"], ["gamma"]]
+    np.testing.assert_array_equal(first[:2], again)
+    assert first.shape == (3, 3)
+
+
+def test_cache_is_keyed_by_model(cache):
+    cache.put_many("model-a", {"text": np.ones(3)})
+
+    assert list(cache.get_many("model-a", ["text", "other"])) == ["text"]
+    assert cache.get_many("model-b", ["text"]) == {}
+
+
+def test_failed_request_raises_for_its_callers_and_is_retried():
+    embed = FakeEmbeddings(fail=True)
+    service = EmbeddingService(embed, "model", batch_window_seconds=0)
+
+    with pytest.raises(ConnectionError):
+        service.embed(["alpha"])
+    embed.fail = False
+    vectors = service.embed(["alpha"])
+
+    assert len(embed.requests) == 2
+    np.testing.assert_array_equal(vectors, [[5, 2, 1]])
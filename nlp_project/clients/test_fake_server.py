@@ -0,0 +1,101 @@
+import openai
+import pytest
+
+from nlp_project.clients.fake_server import (
+    FakeServerConfig,
+    Latency,
+    fake_instance,
+    serve_fake_llm,
+)
+from nlp_project.dataset.regex_models import RegexResponse
+from nlp_project.solvers.dyfs import EdgeCases
+from nlp_project.solvers.self_refine import Feedback
+
+
+@pytest.fixture
+def serve():
+    servers = []
+
+    def start(**config):
+        server = serve_fake_llm(config=FakeServerConfig(seed=0, **config))
+        servers.append(server)
+        return server, openai.OpenAI(
+            api_key="fake", base_url=server.base_url, max_retries=0
+        )
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.mark.parametrize("response_format", [RegexResponse, EdgeCases, Feedback])
+def test_structured_outputs_parse(serve, response_format):
+    _, client = serve()
+
+    response = client.beta.chat.completions.parse(
+        model="fake",
+        messages=[{"role": "user", "content": "lines containing the word 'art'"}],
+        response_format=response_format,
+        n=2,
+    )
+
+    assert len(response.choices) == 2
+    assert all(
+        isinstance(choice.message.parsed, response_format)
+        for choice in response.choices
+    )
+    assert response.usage.completion_tokens > 0
+
+
+def test_embeddings_are_deterministic(serve):
+    _, client = serve(embedding_dimensions=8)
+
+    response = client.embeddings.create(model="fake", input=["a", "b", "a"])
+
+    vectors = [item.embedding for item in response.data]
+    assert len(vectors[0]) == 8
+    assert vectors[0] == pytest.approx(vectors[2])
+    assert vectors[0] != pytest.approx(vectors[1])
+
+
+def test_injected_rate_limit_carries_retry_after(serve):
+    _, client = serve(rate_limit_rate=1.0, retry_after=3)
+
+    with pytest.raises(openai.RateLimitError) as error:
+        client.chat.completions.create(
+            model="fake", messages=[{"role": "user", "content": "hi"}]
+        )
+
+    assert error.value.response.headers["retry-after"] == "3"
+
+
+def test_request_limit_is_enforced_with_headers(serve):
+    _, client = serve(requests_per_minute=2)
+    messages = [{"role": "user", "content": "hi"}]
+
+    raw = client.chat.completions.with_raw_response.create(
+        model="fake", messages=messages
+    )
+    assert raw.headers["x-ratelimit-remaining-requests"] == "1"
+    client.chat.completions.create(model="fake", messages=messages)
+    with pytest.raises(openai.RateLimitError):
+        client.chat.completions.create(model="fake", messages=messages)
+
+
+def test_fake_regex_uses_the_quoted_term():
+    import random
+
+    schema = RegexResponse.model_json_schema()
+    instances = [
+        fake_instance(schema, random.Random(seed), "the word 'dance'")
+        for seed in range(20)
+    ]
+
+    assert any("dance" in instance["regex"] for instance in instances)
+
+
+def test_latency_parse():
+    assert Latency.parse("uniform:0.2,1.5") == Latency(
+        distribution="uniform", a=0.2, b=1.5
+    )
@@ -0,0 +1,273 @@
+import asyncio
+import random
+from collections import Counter
+
+import pytest
+
+from nlp_project.clients.deadlines import (
+    DeadlineConfig,
+    DeadlineExceeded,
+    with_deadline,
+)
+from nlp_project.clients.fake_server import FakeServerConfig, Latency, serve_fake_llm
+from nlp_project.clients.openai_client import LLMConfig, ProviderConfig
+from nlp_project.clients.providers import (
+    OpenAIProvider,
+    ProviderPool,
+    chat_completion,
+    gemini_contents,
+    gemini_schema,
+    get_provider_pool,
+    json_schema_response_format,
+)
+from nlp_project.clients.scheduler import RequestScheduler
+from nlp_project.dataset.regex_models import RegexResponse
+from nlp_project.solvers.dyfs import EdgeCases
+
+MESSAGES = [{"role": "user", "content": "lines containing the word 'art'"}]
+DEADLINES = DeadlineConfig(min_call_seconds=0.1, max_straggler_retries=1)
+
+
+@pytest.fixture
+def serve():
+    servers = []
+
+    def start(seconds: float):
+        server = serve_fake_llm(
+            config=FakeServerConfig(seed=0, latency=Latency(a=seconds))
+        )
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def provider(server, name: str, weight: float = 1.0) -> OpenAIProvider:
+    llm_config = LLMConfig(
+        model="fake",
+        embeddings_model="fake",
+        base_url=server.base_url,
+        api_key="fake",
+    )
+    return OpenAIProvider(
+        ProviderConfig(name=name, model=name, base_url=server.base_url, weight=weight),
+        llm_config,
+    )
+
+
+def test_choose_follows_weights(serve):
+    server = serve(0.0)
+
+    async def choices():
+        pool = ProviderPool(
+            [provider(server, "a", weight=3), provider(server, "b", weight=1)],
+            rng=random.Random(0),
+        )
+        return Counter(pool.choose().name for _ in range(4000))
+
+    counts = asyncio.run(choices())
+
+    assert counts["a"] / 4000 == pytest.approx(0.75, abs=0.03)
+
+
+def test_zero_weight_provider_only_backs_up(serve):
+    server = serve(0.0)
+
+    async def choices():
+        main, backup = provider(server, "main"), provider(server, "backup", weight=0)
+        pool = ProviderPool([main, backup], rng=random.Random(0))
+        return {pool.choose().name for _ in range(100)}, pool.choose(exclude=main)
+
+    primaries, hedge = asyncio.run(choices())
+
+    assert primaries == {"main"}
+    assert hedge.name == "backup"
+
+
+def test_late_request_is_hedged_on_another_provider(serve):
+    slow_server, fast_server = serve(1.0), serve(0.0)
+
+    async def complete():
+        slow = provider(slow_server, "slow")
+        fast = provider(fast_server, "fast", weight=0)
+        # Earlier answers put the p95 well under the slow server's second
+        slow.latencies.extend([0.05] * 20)
+        pool = ProviderPool([slow, fast], hedge_quantile=0.95)
+        result = await pool.complete(MESSAGES, RegexResponse, {}, RequestScheduler())
+        return pool, result, asyncio.all_tasks() - {asyncio.current_task()}
+
+    pool, (response, answered_by, latency, _, _), losers = asyncio.run(complete())
+
+    # The slow request was cancelled, and done cancelling, before returning
+    assert not losers
+    assert answered_by.name == "fast"
+    assert latency < 1.0
+    assert isinstance(response.choices[0].message.parsed, RegexResponse)
+    assert (pool.hedged, pool.hedges_won) == (1, 1)
+
+
+def test_no_hedging_without_latency_history(serve):
+    slow_server, fast_server = serve(0.2), serve(0.0)
+
+    async def complete():
+        slow = provider(slow_server, "slow")
+        pool = ProviderPool(
+            [slow, provider(fast_server, "fast", weight=0)], hedge_quantile=0.95
+        )
+        result = await pool.complete(MESSAGES, str, {}, RequestScheduler())
+        return pool, result
+
+    pool, (_, answered_by, _, _, _) = asyncio.run(complete())
+
+    assert answered_by.name == "slow"
+    assert pool.hedged == 0
+
+
+def test_straggler_is_sent_again_elsewhere(serve):
+    slow_server, fast_server = serve(1.0), serve(0.0)
+
+    async def complete():
+        slow = provider(slow_server, "slow")
+        slow.latencies.extend([0.01] * 20)
+        pool = ProviderPool(
+            [slow, provider(fast_server, "fast", weight=0)], deadlines=DEADLINES
+        )
+        result = await pool.complete(MESSAGES, str, {}, RequestScheduler())
+        return pool, result
+
+    pool, (_, answered_by, latency, stragglers, _) = asyncio.run(complete())
+
+    assert answered_by.name == "fast"
+    assert latency < 1.0
+    assert stragglers == pool.stragglers == 1
+
+
+def test_last_attempt_has_no_call_deadline(serve):
+    server = serve(0.3)
+
+    async def complete():
+        slow = provider(server, "slow")
+        slow.latencies.extend([0.01] * 20)
+        pool = ProviderPool([slow], deadlines=DEADLINES)
+        return await pool.complete(MESSAGES, str, {}, RequestScheduler())
+
+    _, answered_by, latency, stragglers, _ = asyncio.run(complete())
+
+    assert answered_by.name == "slow"
+    assert latency >= 0.3
+    assert stragglers == 1
+
+
+def test_calls_stop_at_task_deadline(serve):
+    server = serve(1.0)
+
+    async def complete():
+        pool = ProviderPool([provider(server, "slow")], deadlines=DEADLINES)
+        return await pool.complete(MESSAGES, str, {}, RequestScheduler())
+
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(with_deadline(0.2, complete()))
+
+
+def test_pools_outside_event_loops_are_shared_per_configuration():
+    def config(model: str) -> LLMConfig:
+        return LLMConfig(
+            model=model,
+            embeddings_model="fake",
+            base_url="http://localhost",
+            api_key="fake",
+        )
+
+    pool = get_provider_pool(config("fake"))
+
+    assert get_provider_pool(config("fake")) is pool
+    assert get_provider_pool(config("other")) is not pool
+
+
+def test_json_schema_response_format_is_strict():
+    response_format = json_schema_response_format(EdgeCases)
+    schema = response_format["json_schema"]["schema"]
+    edge_case = schema["$defs"]["EdgeCase"]
+
+    assert response_format["json_schema"]["name"] == "EdgeCases"
+    assert response_format["json_schema"]["strict"]
+    assert schema["required"] == ["edge_cases"]
+    assert schema["properties"]["edge_cases"]["items"] == {"$ref": "#/$defs/EdgeCase"}
+    assert edge_case["required"] == ["input", "is_match", "explanation", "suggestion"]
+    assert schema["additionalProperties"] is edge_case["additionalProperties"] is False
+
+
+def test_gemini_contents_merge_roles():
+    system, contents = gemini_contents(
+        [
+            {"role": "system", "content": "Be terse."},
+            {"role": "user", "content": "Solve this."},
+            {"role": "assistant", "content": "a+"},
+            {"role": "user", "content": "Feedback."},
+            {"role": "user", "content": "Try again."},
+        ]
+    )
+
+    assert system == "Be terse."
+    assert contents == [
+        {"role": "user", "parts": ["Solve this."]},
+        {"role": "model", "parts": ["a+"]},
+        {"role": "user", "parts": ["Feedback.", "Try again."]},
+    ]
+
+
+def test_gemini_providers_must_share_their_key(monkeypatch):
+    def config(*api_keys):
+        return LLMConfig(
+            model="fake",
+            embeddings_model="fake",
+            base_url="http://localhost",
+            api_key="fake",
+            providers=[
+                ProviderConfig(
+                    name=f"gemini-{i}", type="gemini", model="gemini", api_key=key
+                )
+                for i, key in enumerate(api_keys)
+            ],
+        )
+
+    assert len(config("key", "key").providers) == 2
+    with pytest.raises(ValueError):
+        config("key", "other key")
+    monkeypatch.setenv("GOOGLE_API_KEY", "other key")
+    with pytest.raises(ValueError):
+        config("key", None)
+    monkeypatch.setenv("GOOGLE_API_KEY", "key")
+    assert len(config("key", None).providers) == 2
+
+
+def test_gemini_schema_inlines_references():
+    schema = gemini_schema(
+        {
+            "$defs": {"Item": {"title": "Item", "type": "string"}},
+            "title": "List",
+            "type": "object",
+            "properties": {
+                "items": {"type": "array", "items": {"$ref": "#/$defs/Item"}}
+            },
+            "required": ["items"],
+        }
+    )
+
+    assert schema == {
+        "type": "object",
+        "properties": {"items": {"type": "array", "items": {"type": "string"}}},
+        "required": ["items"],
+    }
+
+
+def test_chat_completion_parses_choices():
+    response = chat_completion(
+        "gemini", ['{"reasoning": "r", "regex": "a+"}'], RegexResponse, 10, 5
+    )
+
+    assert response.choices[0].message.parsed.regex == "a+"
+    assert response.usage.total_tokens == 15
@@ -0,0 +1,80 @@
+import pytest
+
+from nlp_project.clients.openai_client import RateLimiter, retry_after_seconds
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+def test_requests_within_limit_do_not_wait(clock):
+    limiter = RateLimiter(requests_per_minute=60, clock=clock)
+
+    assert [limiter.reserve(0) for _ in range(60)] == [0.0] * 60
+
+
+def test_requests_over_limit_wait_for_refill(clock):
+    limiter = RateLimiter(requests_per_minute=60, clock=clock)
+    for _ in range(60):
+        limiter.reserve(0)
+
+    assert limiter.reserve(0) == pytest.approx(1.0)
+    assert limiter.reserve(0) == pytest.approx(2.0)
+
+    clock.now = 2.0
+    assert limiter.reserve(0) == pytest.approx(1.0)
+
+
+def test_tokens_over_limit_wait_for_refill(clock):
+    limiter = RateLimiter(tokens_per_minute=6000, clock=clock)
+
+    assert limiter.reserve(6000) == 0.0
+    assert limiter.reserve(100) == pytest.approx(1.0)
+
+
+def test_settle_refunds_overestimated_tokens(clock):
+    limiter = RateLimiter(tokens_per_minute=6000, clock=clock)
+    limiter.reserve(6000)
+    limiter.settle(estimated_tokens=6000, actual_tokens=1000)
+
+    assert limiter.reserve(5000) == 0.0
+
+
+def test_headers_update_limits_and_remaining(clock):
+    limiter = RateLimiter(clock=clock)
+    limiter.update_from_headers(
+        {"x-ratelimit-limit-requests": "60", "x-ratelimit-remaining-requests": "0"}
+    )
+
+    assert limiter.reserve(0) == pytest.approx(1.0)
+
+
+def test_retry_after_pauses_all_callers(clock):
+    limiter = RateLimiter(requests_per_minute=600, clock=clock)
+    limiter.update_from_headers({"retry-after": "5"})
+
+    assert limiter.reserve(0) == pytest.approx(5.0)
+    clock.now = 5.0
+    assert limiter.reserve(0) == 0.0
+
+
+@pytest.mark.parametrize(
+    "headers, expected",
+    [
+        ({"retry-after": "2"}, 2.0),
+        ({"retry-after-ms": "1500", "retry-after": "2"}, 1.5),
+        ({"retry-after": "Wed, 21 Oct 2015 07:28:00 GMT"}, None),
+        ({}, None),
+    ],
+)
+def test_retry_after_seconds(headers, expected):
+    assert retry_after_seconds(headers) == expected
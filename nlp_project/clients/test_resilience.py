@@ -0,0 +1,144 @@
+import asyncio
+
+import openai
+import pytest
+
+from nlp_project.clients.fake_server import FakeServerConfig, serve_fake_llm
+from nlp_project.clients.resilience import (
+    FATAL,
+    RATE_LIMITED,
+    TRANSIENT,
+    CircuitBreaker,
+    RateLimited,
+    RetryPolicy,
+    aretry_call,
+    classify_error,
+    retry_call,
+)
+
+POLICY = RetryPolicy(max_attempts=3, base_seconds=0)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture(scope="module")
+def server_error():
+    """
+    A real 500 error of the OpenAI client.
+    """
+    server = serve_fake_llm(config=FakeServerConfig(error_rate=1.0))
+    client = openai.OpenAI(api_key="fake", base_url=server.base_url, max_retries=0)
+    try:
+        client.chat.completions.create(
+            model="fake", messages=[{"role": "user", "content": "hi"}]
+        )
+    except openai.InternalServerError as e:
+        return e
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def failing(errors, response="ok"):
+    """
+    A request that raises the given errors, then returns `response`.
+    """
+    errors = list(errors)
+    calls = []
+
+    def send():
+        calls.append(None)
+        if errors:
+            raise errors.pop(0)
+        return response
+
+    return send, calls
+
+
+def test_classify_error(server_error):
+    assert classify_error(server_error) == TRANSIENT
+    assert classify_error(RateLimited({})) == RATE_LIMITED
+    assert classify_error(ValueError("bad output")) == FATAL
+
+
+def test_backoff_is_jittered_and_capped():
+    policy = RetryPolicy(base_seconds=1, max_seconds=4)
+
+    delays = [policy.backoff(attempt) for attempt in range(10) for _ in range(20)]
+
+    assert all(0 <= delay <= 4 for delay in delays)
+    assert len(set(delays)) > 1
+
+
+def test_transient_errors_are_retried(server_error):
+    send, calls = failing([server_error, server_error])
+
+    assert retry_call(send, POLICY, CircuitBreaker()) == "ok"
+    assert len(calls) == 3
+
+
+def test_persistent_errors_are_raised(server_error):
+    send, calls = failing([server_error] * 3)
+
+    with pytest.raises(openai.InternalServerError):
+        retry_call(send, POLICY, CircuitBreaker())
+    assert len(calls) == 3
+
+
+def test_fatal_errors_are_not_retried():
+    send, calls = failing([ValueError("bad request")])
+
+    with pytest.raises(ValueError):
+        retry_call(send, POLICY, CircuitBreaker())
+    assert len(calls) == 1
+
+
+def test_rate_limits_are_paced_by_the_caller():
+    headers = {"retry-after": "1"}
+    send, _ = failing([RateLimited(headers)])
+    paced = []
+
+    async def run():
+        async def asend():
+            return send()
+
+        return await aretry_call(
+            asend,
+            POLICY,
+            CircuitBreaker(),
+            lambda headers, backoff: paced.append(headers),
+        )
+
+    assert asyncio.run(run()) == "ok"
+    assert paced == [headers]
+
+
+def test_circuit_opens_after_consecutive_failures():
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=2, cooldown_seconds=10, clock=clock)
+
+    breaker.record_failure()
+    assert breaker.check() == 0
+    breaker.record_failure()
+    assert breaker.is_open
+    assert breaker.check() == 10
+
+    clock.now = 10
+    # One probe is let through, the others wait for its outcome
+    assert breaker.check() == 0
+    assert breaker.check() > 0
+    breaker.record_failure()
+    assert breaker.check() == 10
+
+    clock.now = 20
+    assert breaker.check() == 0
+    breaker.record_success()
+    assert not breaker.is_open
+    assert breaker.check() == 0
+    assert breaker.opened == 1
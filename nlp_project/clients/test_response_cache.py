@@ -0,0 +1,101 @@
+import time
+
+import pytest
+from openai.types.chat import ChatCompletion
+
+from nlp_project.clients.response_cache import (
+    ResponseCache,
+    cache_sample,
+    load_response,
+)
+from nlp_project.dataset.regex_models import RegexResponse
+
+MESSAGES = [{"role": "user", "content": "lines containing 'art'"}]
+
+
+def completion(content: str) -> ChatCompletion:
+    return ChatCompletion.model_validate(
+        {
+            "id": "chatcmpl-1",
+            "object": "chat.completion",
+            "created": 0,
+            "model": "gpt-4o",
+            "choices": [
+                {
+                    "index": 0,
+                    "finish_reason": "stop",
+                    "message": {"role": "assistant", "content": content},
+                }
+            ],
+            "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15},
+        }
+    )
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = ResponseCache(tmp_path / "cache.sqlite3", nondeterministic=True)
+    yield cache
+    cache.close()
+
+
+def test_nondeterministic_requests_need_opt_in(tmp_path):
+    cache = ResponseCache(tmp_path / "cache.sqlite3")
+
+    assert cache.key("gpt-4o", MESSAGES) is None
+    assert cache.key("gpt-4o", MESSAGES, params={"temperature": 0}) is not None
+    assert cache.key("gpt-4o", MESSAGES, deterministic=True) is not None
+
+
+def test_key_covers_model_schema_params_and_sample(cache):
+    key = cache.key("gpt-4o", MESSAGES, RegexResponse)
+
+    assert key == cache.key("gpt-4o", MESSAGES, RegexResponse)
+    assert key != cache.key("gpt-4o-mini", MESSAGES, RegexResponse)
+    assert key != cache.key("gpt-4o", MESSAGES, str)
+    assert key != cache.key("gpt-4o", MESSAGES, RegexResponse, {"n": 3})
+    token = cache_sample.set(2)
+    try:
+        assert key != cache.key("gpt-4o", MESSAGES, RegexResponse)
+    finally:
+        cache_sample.reset(token)
+
+
+def test_round_trip_restores_parsed_output(cache):
+    key = cache.key("gpt-4o", MESSAGES, RegexResponse)
+    content = RegexResponse(regex="^.*art.*$", reasoning="r").model_dump_json()
+    cache.put(key, completion(content))
+
+    response = load_response(cache.get(key), RegexResponse)
+
+    assert response.choices[0].message.parsed == RegexResponse(
+        regex="^.*art.*$", reasoning="r"
+    )
+    assert cache.hits == 1
+
+
+def test_expired_responses_are_misses(cache):
+    key = cache.key("gpt-4o", MESSAGES)
+    cache.put(key, completion("hi"))
+    cache.max_age_seconds = 0
+    time.sleep(0.01)
+
+    assert cache.get(key) is None
+    assert cache.evict() == 1
+
+
+def test_size_limit_evicts_least_recently_used(cache):
+    keys = []
+    for i in range(3):
+        token = cache_sample.set(i)
+        keys.append(cache.key("gpt-4o", MESSAGES))
+        cache_sample.reset(token)
+        cache.put(keys[-1], completion("x" * 1000))
+        time.sleep(0.01)
+    cache.get(keys[0])
+    cache.max_bytes = 2 * len(completion("x" * 1000).model_dump_json()) + 100
+
+    assert cache.evict() == 1
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) is not None
+    assert cache.get(keys[2]) is not None
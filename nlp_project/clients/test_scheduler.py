@@ -0,0 +1,78 @@
+import asyncio
+import threading
+
+from nlp_project.clients.scheduler import RequestScheduler, task_priority, with_priority
+
+
+def run_requests(scheduler, priorities):
+    started = []
+
+    async def request(name):
+        async with scheduler.slot():
+            started.append(name)
+            await asyncio.sleep(0)
+
+    async def main():
+        async with scheduler.slot():
+            # Queue every request while the only slot is taken
+            tasks = [
+                asyncio.create_task(with_priority(priority, request(name)))
+                for name, priority in priorities
+            ]
+            await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+
+    asyncio.run(main())
+    return started
+
+
+def test_waiting_requests_start_by_priority():
+    scheduler = RequestScheduler(max_in_flight=1)
+
+    started = run_requests(scheduler, [("short", 1.0), ("long", 9.0), ("mid", 5.0)])
+
+    assert started == ["long", "mid", "short"]
+    assert scheduler.in_flight == 0
+
+
+def test_equal_priorities_start_in_arrival_order():
+    scheduler = RequestScheduler(max_in_flight=1)
+
+    started = run_requests(scheduler, [("a", 0.0), ("b", 0.0), ("c", 0.0)])
+
+    assert started == ["a", "b", "c"]
+
+
+def test_cancelled_waiter_does_not_leak_its_slot():
+    scheduler = RequestScheduler(max_in_flight=1)
+
+    async def main():
+        async with scheduler.slot():
+            waiter = asyncio.create_task(scheduler.slot().__aenter__())
+            await asyncio.sleep(0)
+            waiter.cancel()
+            await asyncio.sleep(0)
+        async with scheduler.slot():
+            assert scheduler.in_flight == 1
+
+    asyncio.run(main())
+    assert scheduler.in_flight == 0
+
+
+def test_blocking_work_shares_one_pool_across_loops():
+    scheduler = RequestScheduler(max_in_flight=2)
+
+    def work():
+        return threading.current_thread().name, task_priority.get()
+
+    async def main():
+        return await asyncio.gather(
+            *(with_priority(3.0, scheduler.run_blocking(work)) for _ in range(8))
+        )
+
+    results = asyncio.run(main()) + asyncio.run(main())
+    scheduler.shutdown()
+
+    assert len({name for name, _ in results}) <= 2
+    assert all(name.startswith("experiment") for name, _ in results)
+    assert all(priority == 3.0 for _, priority in results)
@@ -0,0 +1,102 @@
+import asyncio
+
+import pytest
+
+from nlp_project.clients.shared_completions import SharedCompletions
+
+
+def test_identical_requests_are_sent_once():
+    shared = SharedCompletions()
+    sent = []
+
+    async def send():
+        sent.append(1)
+        await asyncio.sleep(0.01)
+        return "answer"
+
+    async def main():
+        return await asyncio.gather(*(shared.get("key", send) for _ in range(3)))
+
+    results = asyncio.run(main())
+
+    assert len(sent) == 1
+    assert results == [("answer", False), ("answer", True), ("answer", True)]
+    assert (shared.sent, shared.reused) == (1, 2)
+
+
+def test_responses_are_kept_until_their_scope_is_released():
+    shared = SharedCompletions()
+    sent = []
+
+    async def send():
+        sent.append(1)
+        return len(sent)
+
+    async def solve():
+        return await shared.get("key", send)
+
+    async def main():
+        shared.hold("problem", 2)
+        first = await shared.scoped("problem", solve())
+        second = await shared.scoped("problem", solve())
+        return [first, second, await solve()]
+
+    assert asyncio.run(main()) == [(1, False), (1, True), (2, False)]
+
+
+def test_responses_are_dropped_when_their_holders_fail():
+    shared = SharedCompletions()
+    sent = []
+
+    async def send():
+        sent.append(1)
+        return len(sent)
+
+    async def fail():
+        await shared.get("key", send)
+        raise RuntimeError("boom")
+
+    async def main():
+        shared.hold("problem", 2)
+        for _ in range(2):
+            with pytest.raises(RuntimeError):
+                await shared.scoped("problem", fail())
+        shared.hold("problem")
+        return await shared.scoped("problem", shared.get("key", send))
+
+    assert asyncio.run(main()) == (2, False)
+
+
+def test_unheld_responses_are_only_shared_in_flight():
+    shared = SharedCompletions()
+    sent = []
+
+    async def send():
+        sent.append(1)
+        return len(sent)
+
+    async def main():
+        return [await shared.get("key", send) for _ in range(2)]
+
+    assert asyncio.run(main()) == [(1, False), (2, False)]
+
+
+def test_waiters_send_themselves_when_the_sender_fails():
+    shared = SharedCompletions()
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("boom")
+
+    async def succeed():
+        return "answer"
+
+    async def main():
+        return await asyncio.gather(
+            shared.get("key", fail), shared.get("key", succeed), return_exceptions=True
+        )
+
+    failed, waited = asyncio.run(main())
+
+    assert isinstance(failed, RuntimeError)
+    assert waited == ("answer", False)
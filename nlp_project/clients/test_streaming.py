@@ -0,0 +1,89 @@
+import asyncio
+
+import pytest
+
+from nlp_project.clients.fake_server import FakeServerConfig, serve_fake_llm
+from nlp_project.clients.openai_client import LLMConfig, ProviderConfig
+from nlp_project.clients.providers import OpenAIProvider, ProviderPool
+from nlp_project.clients.scheduler import RequestScheduler
+from nlp_project.clients.streaming import answer_complete, partial_answer
+from nlp_project.dataset.regex_models import RegexResponse
+
+MESSAGES = [{"role": "user", "content": "lines containing the word 'art'"}]
+
+
+@pytest.fixture
+def server():
+    server = serve_fake_llm(
+        config=FakeServerConfig(seed=0, seconds_per_output_token=0.002)
+    )
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def complete(server, stream: bool, answer_fields=None):
+    async def run():
+        llm_config = LLMConfig(
+            model="fake",
+            embeddings_model="fake",
+            base_url=server.base_url,
+            api_key="fake",
+        )
+        provider = OpenAIProvider(
+            ProviderConfig(name="fake", model="fake", base_url=server.base_url),
+            llm_config,
+        )
+        pool = ProviderPool([provider])
+        result = await pool.complete(
+            MESSAGES,
+            RegexResponse,
+            {},
+            RequestScheduler(),
+            stream=stream,
+            answer_fields=answer_fields,
+        )
+        return pool, result
+
+    return asyncio.run(run())
+
+
+def test_answer_complete():
+    assert not answer_complete(None, ["regex"])
+    assert not answer_complete({}, ["regex"])
+    assert answer_complete({"regex": "a+"}, ["regex"])
+    # A trailing list may still grow
+    assert not answer_complete({"items": ["a"]}, ["items"])
+    assert answer_complete({"items": ["a"], "reasoning": ""}, ["items"])
+
+
+def test_partial_answer_leaves_missing_fields_empty():
+    answer = partial_answer(RegexResponse, {"regex": "a+"})
+
+    assert answer == RegexResponse(regex="a+", reasoning="")
+
+
+def test_stream_stops_after_answer(server):
+    pool, (response, _, _, _, timing) = complete(
+        server, stream=True, answer_fields=["regex"]
+    )
+
+    answer = response.choices[0].message.parsed
+    assert answer.regex
+    assert answer.reasoning == ""
+    assert timing.stopped_early
+    assert 0 < timing.time_to_first_token <= timing.time_to_answer
+    assert pool.stopped_early == 1
+    assert not pool.providers[0].latencies
+
+
+def test_stream_without_answer_fields_runs_to_the_end(server):
+    _, (streamed, _, _, _, timing) = complete(server, stream=True)
+    _, (_, _, _, _, no_timing) = complete(server, stream=False)
+
+    answer = streamed.choices[0].message.parsed
+    assert answer.regex and answer.reasoning
+    assert streamed.usage.completion_tokens > 0
+    assert not timing.stopped_early
+    assert timing.time_to_first_token is not None
+    assert no_timing is None
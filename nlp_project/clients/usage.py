@@ -0,0 +1,96 @@
+from typing import Optional
+
+from pydantic import BaseModel
+
+
+class LLMCall(BaseModel):
+    phase: str
+    model: str
+    input_tokens: int
+    output_tokens: int
+    latency: float
+    cached: bool = False
+    shared: bool = False
+    stragglers: int = 0
+    time_to_first_token: Optional[float] = None
+    time_to_answer: Optional[float] = None
+    stopped_early: bool = False
+
+
+class UsageLedger(BaseModel):
+    """
+    Record of the LLM calls made on behalf of a single solve.
+
+    A new ledger is created for every solve, so solvers shared by concurrent
+    tasks never mix up their token counts.
+
+    The token totals are what the solve spent: calls that reused another
+    solver's response (`shared`) keep its token counts, but are not counted,
+    since the solver that sent the request already counts them.
+    """
+
+    calls: list[LLMCall] = []
+
+    def record(
+        self,
+        phase: str,
+        model: str,
+        input_tokens: int,
+        output_tokens: int,
+        latency: float,
+        cached: bool = False,
+        shared: bool = False,
+        stragglers: int = 0,
+        time_to_first_token: Optional[float] = None,
+        time_to_answer: Optional[float] = None,
+        stopped_early: bool = False,
+    ) -> LLMCall:
+        call = LLMCall(
+            phase=phase,
+            model=model,
+            input_tokens=input_tokens,
+            output_tokens=output_tokens,
+            latency=latency,
+            cached=cached,
+            shared=shared,
+            stragglers=stragglers,
+            time_to_first_token=time_to_first_token,
+            time_to_answer=time_to_answer,
+            stopped_early=stopped_early,
+        )
+        self.calls.append(call)
+        return call
+
+    @property
+    def input_tokens(self) -> int:
+        return sum(call.input_tokens for call in self.calls if not call.shared)
+
+    @property
+    def output_tokens(self) -> int:
+        return sum(call.output_tokens for call in self.calls if not call.shared)
+
+    def split(self, n: int) -> list["UsageLedger"]:
+        """
+        Divide the ledger into `n` ledgers with an equal share of each call's
+        tokens, e.g. to attribute one request that sampled `n` choices to each
+        of its choices. Remainders go to the first ledger.
+        """
+        ledgers = [UsageLedger() for _ in range(n)]
+        for call in self.calls:
+            for i, ledger in enumerate(ledgers):
+                ledger.record(
+                    phase=call.phase,
+                    model=call.model,
+                    input_tokens=call.input_tokens // n
+                    + (call.input_tokens % n if i == 0 else 0),
+                    output_tokens=call.output_tokens // n
+                    + (call.output_tokens % n if i == 0 else 0),
+                    latency=call.latency,
+                    cached=call.cached,
+                    shared=call.shared,
+                    stragglers=call.stragglers if i == 0 else 0,
+                    time_to_first_token=call.time_to_first_token,
+                    time_to_answer=call.time_to_answer,
+                    stopped_early=call.stopped_early,
+                )
+        return ledgers
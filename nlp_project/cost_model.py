@@ -0,0 +1,172 @@
+from collections import defaultdict
+from pathlib import Path
+from typing import Iterable, Optional, Union
+
+import yaml
+
+from nlp_project.result_sink import read_records
+
+# Roughly what past gpt-4.1-mini runs spent per completion token
+DEFAULT_SECONDS_PER_OUTPUT_TOKEN = 0.015
+
+REPORT_GLOB = "experiment_report_*.yaml"
+RUN_RESULTS_GLOB = "run_*/results*.jsonl"
+
+# The libyaml parser, several times faster, when PyYAML was built with it
+SafeLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+
+class CostModel:
+    """
+    Expected generation time of one iteration of each (solver, problem) pair,
+    learned from earlier runs.
+
+    Pairs with recorded iterations are estimated by their own average. Other
+    pairs fall back to their solver's average, and solvers without any history
+    to the average of all known solvers.
+    """
+
+    def __init__(
+        self,
+        solver_seconds: Optional[dict[str, float]] = None,
+        pair_seconds: Optional[dict[tuple[str, str], float]] = None,
+    ):
+        self.solver_seconds = solver_seconds or {}
+        self.pair_seconds = pair_seconds or {}
+
+    def expected_seconds(
+        self, solver_name: str, problem_name: Optional[str] = None
+    ) -> float:
+        if (solver_name, problem_name) in self.pair_seconds:
+            return self.pair_seconds[(solver_name, problem_name)]
+        if solver_name in self.solver_seconds:
+            return self.solver_seconds[solver_name]
+        if self.solver_seconds:
+            return sum(self.solver_seconds.values()) / len(self.solver_seconds)
+        return 0.0
+
+    def longest_first(self, pairs: Iterable[tuple[str, str]]) -> list[tuple[str, str]]:
+        """
+        Order (solver, problem) pairs by descending expected cost, keeping the
+        given order among equal costs.
+        """
+        return sorted(pairs, key=lambda pair: -self.expected_seconds(*pair))
+
+
+def load_report_summary(report_file: Union[str, Path]) -> dict:
+    """
+    Load the summary of an experiment report without parsing its details.
+
+    Returns:
+        The summary, or an empty dict if the report has none
+    """
+    with open(report_file, "r") as f:
+        text = f.read()
+    if text.startswith("summary:"):
+        start = 0
+    else:
+        start = text.find("\nsummary:")
+        if start < 0:
+            return {}
+    # Reports list the summary before the details; older ones sorted their
+    # sections, putting the summary last so that it runs to the end
+    end = text.find("\ndetails:", start + 1)
+    summary_yaml = text[start:] if end < 0 else text[start:end]
+    return (yaml.load(summary_yaml, Loader=SafeLoader) or {}).get("summary") or {}
+
+
+def summary_cells(summary: dict, solver_name: str) -> int:
+    """
+    The number of iterations a solver ran in the run of a report summary.
+    Summaries that predate per-solver counts are assumed to have run every
+    iteration of every problem.
+    """
+    samples = summary.get("samples_per_model") or {}
+    if solver_name in samples:
+        return samples[solver_name]
+    return summary.get("total_problems", 0) * summary.get("num_iterations", 0)
+
+
+def solver_seconds_from_summaries(summaries: list[dict]) -> dict[str, float]:
+    """
+    Read the average generation time of each solver from report summaries,
+    most recent last. Reports that predate generation timing contribute their
+    completion tokens per iteration, converted to seconds at the rate measured
+    by the timed reports.
+    """
+    timed = {}
+    tokens_per_iteration = {}
+    measured_seconds = measured_tokens = 0.0
+    for summary in summaries:
+        times = summary.get("avg_generation_time_per_model") or {}
+        for solver_name, usage in (summary.get("total_tokens_per_model") or {}).items():
+            cells = summary_cells(summary, solver_name)
+            if not cells or not usage.get("output_tokens"):
+                continue
+            tokens = usage["output_tokens"] / cells
+            tokens_per_iteration[solver_name] = tokens
+            if times.get(solver_name):
+                measured_seconds += times[solver_name]
+                measured_tokens += tokens
+        for solver_name, seconds in times.items():
+            if seconds:
+                timed[solver_name] = seconds
+
+    seconds_per_token = (
+        measured_seconds / measured_tokens
+        if measured_tokens
+        else DEFAULT_SECONDS_PER_OUTPUT_TOKEN
+    )
+    solver_seconds = {
+        solver_name: tokens * seconds_per_token
+        for solver_name, tokens in tokens_per_iteration.items()
+    }
+    solver_seconds.update(timed)
+    return solver_seconds
+
+
+def load_cost_model(
+    reports_dir: Union[str, Path], results_files: Iterable[Path] = ()
+) -> CostModel:
+    """
+    Build a cost model from the experiment reports and run directories in
+    `reports_dir`, and from any other result files.
+
+    Args:
+        reports_dir: Directory holding earlier reports and run directories
+        results_files: Further JSONL result files, e.g. of the run being resumed
+
+    Returns:
+        The cost model
+    """
+    reports_dir = Path(reports_dir)
+    summaries = [
+        load_report_summary(report_file)
+        for report_file in sorted(reports_dir.glob(REPORT_GLOB))
+    ]
+    solver_seconds = solver_seconds_from_summaries(summaries)
+
+    pair_times = defaultdict(list)
+    solver_times = defaultdict(list)
+    for record in read_records(
+        sorted(set(reports_dir.glob(RUN_RESULTS_GLOB)) | set(results_files))
+    ):
+        pair_times[(record.solver_name, record.problem_name)].append(
+            record.generation_time
+        )
+        solver_times[record.solver_name].append(record.generation_time)
+
+    # Per-iteration records also cover runs that never got a report, e.g.
+    # interrupted ones, so they take precedence
+    solver_seconds.update(
+        {
+            solver_name: sum(times) / len(times)
+            for solver_name, times in solver_times.items()
+        }
+    )
+    return CostModel(
+        solver_seconds=solver_seconds,
+        pair_seconds={
+            pair: sum(times) / len(times) for pair, times in pair_times.items()
+        },
+    )
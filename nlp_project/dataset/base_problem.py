@@ -1,7 +1,9 @@
-from typing import Callable, Generic, Optional, TypeVar
+from typing import Any, Callable, Generic, Optional, TypeVar
 
 from pydantic import BaseModel
 
+from nlp_project.dataset.regex_matching import ExampleResults
+
 T = TypeVar("T", bound=BaseModel)
 
 
@@ -10,4 +12,15 @@ class Problem(BaseModel, Generic[T]):
     statement: str
     scorer_fn: Callable[[str], float]
     response_format: Optional[type[T]] = str
-    solution_evaluator: Optional[Callable[[T], Callable]] = None
+    # Checks a solution against strings that should and should not match it,
+    # all in one call
+    solution_evaluator: Optional[
+        Callable[[T], Callable[[list[str], list[str]], ExampleResults]]
+    ] = None
+    # The fields of `response_format` the answer is made of; streamed solutions
+    # stop once they are complete
+    answer_fields: Optional[list[str]] = None
+    # Scores a solution on runtime safety, next to `scorer_fn`
+    safety_fn: Optional[Callable[[T], Any]] = None
+    # Compares a solution with the reference solution, next to `scorer_fn`
+    equivalence_fn: Optional[Callable[[T], Any]] = None
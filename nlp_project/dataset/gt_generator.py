@@ -1,12 +1,28 @@
 import json
-import re
 from pathlib import Path
 
 from pydantic import BaseModel, Field
-from tenacity import RetryError, retry, stop_after_attempt, wait_random_exponential
+from tenacity import (
+    RetryError,
+    retry,
+    retry_if_exception_type,
+    stop_after_attempt,
+    wait_random_exponential,
+)
 from tqdm import tqdm
 
-from nlp_project.clients.openai_client import LLMConfig, get_openai_client
+from nlp_project.clients.openai_client import (
+    LLMConfig,
+    estimate_tokens,
+    get_circuit_breaker,
+    get_openai_client,
+    get_rate_limiter,
+    rate_limit_handler,
+    structured_completions,
+)
+from nlp_project.clients.resilience import retry_call
+from nlp_project.clients.response_cache import get_response_cache, load_response
+from nlp_project.dataset.regex_matching import match_examples
 
 WORKING_DIR = Path(__file__).parent.parent
 
@@ -30,6 +46,9 @@ class GTGenerator:
     def __init__(self):
         self.llm_config = LLMConfig.from_config_toml()
         self.openai_client = get_openai_client(self.llm_config)
+        self.rate_limiter = get_rate_limiter(self.llm_config)
+        self.circuit_breaker = get_circuit_breaker(self.llm_config)
+        self.response_cache = get_response_cache(self.llm_config.cache)
 
     def validate_samples(self, samples: StringSampleResponse, regex: str):
         """
@@ -42,24 +61,34 @@ class GTGenerator:
         Returns:
             None
         """
-        passed_samples = []
-        for sample in samples.string_matches:
-            if re.match(regex, sample):
-                passed_samples.append(sample)
-        samples.string_matches = passed_samples.copy()
-
-        passed_samples = []
-        for sample in samples.string_mismatches:
-            if not re.match(regex, sample):
-                passed_samples.append(sample)
-        samples.string_mismatches = passed_samples.copy()
+        results = match_examples(
+            regex, samples.string_matches, samples.string_mismatches
+        )
+        samples.string_matches = [
+            sample
+            for sample, matched in zip(samples.string_matches, results.string_matches)
+            if matched
+        ]
+        samples.string_mismatches = [
+            sample
+            for sample, matched in zip(
+                samples.string_mismatches, results.string_mismatches
+            )
+            if not matched
+        ]
 
         if len(samples.string_matches) < 2 or len(samples.string_mismatches) < 2:
             raise ValueError("No valid samples found")
 
         return samples
 
-    @retry(wait=wait_random_exponential(min=1, max=10), stop=stop_after_attempt(5))
+    # Request errors are retried by the client's retry policy; this resamples
+    # responses whose samples do not validate
+    @retry(
+        retry=retry_if_exception_type(ValueError),
+        wait=wait_random_exponential(min=1, max=10),
+        stop=stop_after_attempt(5),
+    )
     def generate_regex_string_samples(
         self, regex_instructions: str, regex: str
     ) -> StringSampleResponse:
@@ -73,20 +102,46 @@ class GTGenerator:
             A StringSampleResponse object containing the generated string samples.
         """
 
-        response = self.openai_client.beta.chat.completions.parse(
-            model=self.llm_config.model,
-            messages=[
-                {
-                    "role": "system",
-                    "content": "Generate string samples that match a given instruction.",
-                },
-                {
-                    "role": "user",
-                    "content": f"Generate at least 3 string samples that match the following instructions and at least 3 that do not: {regex_instructions}",
-                },
-            ],
-            response_format=StringSampleResponse,
+        messages = [
+            {
+                "role": "system",
+                "content": "Generate string samples that match a given instruction.",
+            },
+            {
+                "role": "user",
+                "content": f"Generate at least 3 string samples that match the following instructions and at least 3 that do not: {regex_instructions}",
+            },
+        ]
+        cache_key = (
+            self.response_cache.key(
+                self.llm_config.model, messages, StringSampleResponse
+            )
+            if self.response_cache
+            else None
         )
+        cached = self.response_cache.get(cache_key) if cache_key else None
+        if cached is not None:
+            response = load_response(cached, StringSampleResponse)
+        else:
+            estimated_tokens = estimate_tokens(messages)
+
+            def send():
+                self.rate_limiter.acquire(estimated_tokens)
+                return structured_completions(self.openai_client).parse(
+                    model=self.llm_config.model,
+                    messages=messages,
+                    response_format=StringSampleResponse,
+                )
+
+            response = retry_call(
+                send,
+                self.llm_config.retries,
+                self.circuit_breaker,
+                rate_limit_handler(self.rate_limiter),
+            )
+            self.rate_limiter.settle(estimated_tokens, response.usage.total_tokens)
+            if cache_key:
+                self.response_cache.put(cache_key, response)
 
         samples = response.choices[0].message.parsed
         try:
@@ -95,6 +150,9 @@ class GTGenerator:
             print(
                 f"Error: {e} on regex pattern: {regex_instructions} and samples: {samples}"
             )
+            # Let the retry sample a new response instead of the cached one
+            if cache_key:
+                self.response_cache.delete(cache_key)
             raise e
 
         return samples
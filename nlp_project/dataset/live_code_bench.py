@@ -3,8 +3,6 @@ import re
 from base64 import b64encode
 from typing import Any
 
-from testcontainers.core.container import DockerContainer
-
 from nlp_project.dataset.base_problem import Problem
 
 
@@ -50,6 +48,9 @@ class LiveCodeBenchLite:
             if not solution:
                 print(f"No solution found in output: {output}")
                 return 0
+            # Only this scorer needs Docker; importing testcontainers is slow
+            from testcontainers.core.container import DockerContainer
+
             with DockerContainer("python:3.9") as container:
                 container.with_command("tail -f /dev/null").start()
                 total_score = 0
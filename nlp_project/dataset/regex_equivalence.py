@@ -0,0 +1,737 @@
+import bisect
+import functools
+import itertools
+import re
+from collections import deque
+from typing import Literal, Optional
+
+from pydantic import BaseModel
+
+from nlp_project.dataset.regex_sandbox import (
+    RegexSandbox,
+    SandboxError,
+    get_regex_sandbox,
+)
+
+try:
+    from re import _constants as sre_constants
+    from re import _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_constants
+    import sre_parse
+
+MatchMode = Literal["fullmatch", "match", "search"]
+
+# Automata larger than this are not built; the comparison falls back to
+# enumerating strings instead
+MAX_NFA_STATES = 20_000
+MAX_DFA_STATES = 5_000
+# Regexes are written by the LLM, so the work spent on one comparison is
+# capped: NFA states visited while building each DFA (about half a second),
+# and state pairs visited by the product search. Past either, the comparison
+# is inconclusive.
+MAX_DFA_STEPS = 1_000_000
+MAX_PRODUCT_STATES = 1_000_000
+DFA_CACHE_SIZE = 1024
+# Strings compared by the fallback, shortest first, in the regex sandbox
+MAX_ENUMERATED_STRINGS = 50_000
+MAX_ENUMERATED_LENGTH = 8
+
+MAX_CODE_POINT = 0x10FFFF
+NEWLINE = ord("\n")
+
+# A set of code points, as sorted, disjoint, non-adjacent inclusive ranges
+Charset = tuple[tuple[int, int], ...]
+
+# Strings are compared as single lines, so the alphabet is every code point
+# but the newline. That makes `$` and `\Z`, `.` with and without DOTALL, and
+# anchors with and without MULTILINE all exact.
+ALPHABET: Charset = ((0, NEWLINE - 1), (NEWLINE + 1, MAX_CODE_POINT))
+
+_REPEATS = {sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT}
+_CATEGORIES = {
+    sre_constants.CATEGORY_DIGIT: (r"\d", False),
+    sre_constants.CATEGORY_NOT_DIGIT: (r"\d", True),
+    sre_constants.CATEGORY_SPACE: (r"\s", False),
+    sre_constants.CATEGORY_NOT_SPACE: (r"\s", True),
+    sre_constants.CATEGORY_WORD: (r"\w", False),
+    sre_constants.CATEGORY_NOT_WORD: (r"\w", True),
+}
+_AT_START = {sre_constants.AT_BEGINNING, sre_constants.AT_BEGINNING_STRING}
+_AT_END = {sre_constants.AT_END, sre_constants.AT_END_STRING}
+_AT_BOUNDARY = {sre_constants.AT_BOUNDARY, sre_constants.AT_NON_BOUNDARY}
+
+# The position before the first character and after the last one
+_START = "start"
+_END = "end"
+
+
+class UnsupportedRegex(Exception):
+    """
+    A regex uses a construct that is not regular, such as a backreference, or
+    that this module does not translate to an automaton, such as a lookaround.
+    """
+
+
+class WorkLimitExceeded(Exception):
+    """
+    Comparing two regexes took more than its share of work.
+    """
+
+
+class Equivalence(BaseModel):
+    """
+    Whether two regexes match the same strings.
+
+    Attributes:
+        equivalent: Whether no string matches one regex but not the other, or
+            None if the comparison was given up: it ran past its work limit,
+            or the fallback's matching timed out in the sandbox
+        counterexample: The shortest string matched by exactly one of the
+            regexes, if they are not equivalent
+        first_matches: Whether the counterexample is matched by the first regex
+            (rather than the second)
+        exact: False if a regex was not translatable to an automaton and the
+            regexes were only compared on the strings up to a bounded length
+    """
+
+    equivalent: Optional[bool]
+    counterexample: Optional[str] = None
+    first_matches: Optional[bool] = None
+    exact: bool = True
+
+
+class DFA:
+    """
+    A complete, minimal DFA over a partition of the alphabet.
+
+    Attributes:
+        classes: The partition of the alphabet: characters in the same class
+            are never told apart by the regex
+        transitions: The next state for each state and class
+        accepting: Whether each state accepts
+        start: The initial state
+    """
+
+    def __init__(
+        self,
+        classes: list[Charset],
+        transitions: list[list[int]],
+        accepting: list[bool],
+        start: int,
+    ):
+        self.classes = classes
+        self.transitions = transitions
+        self.accepting = accepting
+        self.start = start
+        self.__starts = [lo for charset in classes for lo, _ in charset]
+        self.__class_of = [i for i, charset in enumerate(classes) for _ in charset]
+        order = sorted(range(len(self.__starts)), key=self.__starts.__getitem__)
+        self.__starts = [self.__starts[i] for i in order]
+        self.__class_of = [self.__class_of[i] for i in order]
+
+    def __len__(self) -> int:
+        return len(self.transitions)
+
+    def accepts(self, text: str) -> bool:
+        state = self.start
+        for char in text:
+            if ord(char) == NEWLINE:
+                raise ValueError("Strings are compared as single lines")
+            index = bisect.bisect_right(self.__starts, ord(char)) - 1
+            state = self.transitions[state][self.__class_of[index]]
+        return self.accepting[state]
+
+
+def check_equivalence(
+    pattern1: str,
+    pattern2: str,
+    mode: MatchMode = "match",
+    flags: int = 0,
+    sandbox: Optional[RegexSandbox] = None,
+) -> Equivalence:
+    """
+    Decide whether two regexes match the same single-line strings, by
+    comparing their minimal DFAs, and find the shortest string they disagree
+    on. If either regex cannot be translated to a DFA, compare them on every
+    string up to a bounded length over the characters they mention instead,
+    running `re` in the regex sandbox.
+
+    Args:
+        mode: Which `re` function's matching to compare: `match` (at the
+            start of the string, as the scorers do), `fullmatch` or `search`
+        sandbox: The sandbox of the fallback; defaults to the process-wide one
+
+    Raises:
+        re.error: If a pattern is invalid
+    """
+    try:
+        dfa1 = compile_dfa(pattern1, flags, mode)
+        dfa2 = compile_dfa(pattern2, flags, mode)
+        counterexample = _find_counterexample(dfa1, dfa2)
+    except UnsupportedRegex:
+        try:
+            return _compare_enumerated(
+                pattern1, pattern2, mode, flags, sandbox or get_regex_sandbox()
+            )
+        except SandboxError:
+            return Equivalence(equivalent=None, exact=False)
+    except WorkLimitExceeded:
+        return Equivalence(equivalent=None, exact=False)
+    if counterexample is None:
+        return Equivalence(equivalent=True)
+    return Equivalence(
+        equivalent=False,
+        counterexample=counterexample,
+        first_matches=dfa1.accepts(counterexample),
+    )
+
+
+@functools.lru_cache(maxsize=DFA_CACHE_SIZE)
+def compile_dfa(pattern: str, flags: int = 0, mode: MatchMode = "match") -> DFA:
+    """
+    Build the minimal DFA of the single-line strings a regex matches in the
+    given mode.
+
+    Raises:
+        re.error: If the pattern is invalid
+        UnsupportedRegex: If the regex cannot be translated to a DFA
+        WorkLimitExceeded: If building the DFA took more than `MAX_DFA_STEPS`
+    """
+    parsed = sre_parse.parse(pattern, flags)
+    nfa = _NFA()
+    start = nfa.state()
+    begin = start
+    if mode == "search":
+        begin = nfa.loop(start)
+    end = nfa.build(list(parsed), parsed.state.flags, begin)
+    if mode != "fullmatch":
+        end = nfa.loop(end)
+    return _minimize(_determinize(nfa, start, end))
+
+
+class _NFA:
+    """
+    A Thompson NFA whose edges read a character set, read nothing, or check
+    an anchor or word boundary around the current position.
+    """
+
+    def __init__(self):
+        self.epsilon: list[list[int]] = []
+        self.chars: list[list[tuple[Charset, int]]] = []
+        # (op, whether \w is ASCII-only, target)
+        self.assertions: list[list[tuple[object, bool, int]]] = []
+
+    def state(self) -> int:
+        if len(self.epsilon) >= MAX_NFA_STATES:
+            raise UnsupportedRegex(f"More than {MAX_NFA_STATES} NFA states")
+        self.epsilon.append([])
+        self.chars.append([])
+        self.assertions.append([])
+        return len(self.epsilon) - 1
+
+    def read(self, source: int, charset: Charset) -> int:
+        target = self.state()
+        self.chars[source].append((charset, target))
+        return target
+
+    def loop(self, source: int) -> int:
+        """
+        Read any number of characters.
+        """
+        self.chars[source].append((ALPHABET, source))
+        return source
+
+    def build(self, items: list, flags: int, source: int) -> int:
+        """
+        Add the states of a parsed sequence after `source`.
+
+        Returns:
+            The state reached at the end of the sequence
+        """
+        ignore_case = bool(flags & re.IGNORECASE)
+        ascii_only = bool(flags & re.ASCII)
+        if flags & re.LOCALE:
+            raise UnsupportedRegex("The LOCALE flag depends on the platform")
+        for op, av in items:
+            if op == sre_constants.LITERAL:
+                source = self.read(source, _fold(((av, av),), ignore_case, ascii_only))
+            elif op == sre_constants.NOT_LITERAL:
+                charset = _fold(((av, av),), ignore_case, ascii_only)
+                source = self.read(source, _difference(ALPHABET, charset))
+            elif op == sre_constants.ANY:
+                source = self.read(source, ALPHABET)
+            elif op == sre_constants.IN:
+                source = self.read(source, _class(av, ignore_case, ascii_only))
+            elif op == sre_constants.BRANCH:
+                target = self.state()
+                for alternative in av[1]:
+                    self.epsilon[self.build(list(alternative), flags, source)].append(
+                        target
+                    )
+                source = target
+            elif op == sre_constants.SUBPATTERN:
+                _, add_flags, del_flags, body = av
+                source = self.build(
+                    list(body), (flags | add_flags) & ~del_flags, source
+                )
+            elif op in _REPEATS:
+                source = self.__repeat(av, flags, source)
+            elif op == sre_constants.AT and (
+                av in _AT_START or av in _AT_END or av in _AT_BOUNDARY
+            ):
+                target = self.state()
+                self.assertions[source].append((av, ascii_only, target))
+                source = target
+            else:
+                raise UnsupportedRegex(f"{op} is not supported")
+        return source
+
+    def __repeat(self, av: tuple, flags: int, source: int) -> int:
+        low, high, body = av
+        body = list(body)
+        for _ in range(low):
+            source = self.build(body, flags, source)
+        if high == sre_constants.MAXREPEAT:
+            loop = self.state()
+            self.epsilon[source].append(loop)
+            self.epsilon[self.build(body, flags, loop)].append(loop)
+            return loop
+        for _ in range(high - low):
+            target = self.state()
+            self.epsilon[source].append(target)
+            self.epsilon[self.build(body, flags, source)].append(target)
+            source = target
+        return source
+
+
+def _determinize(nfa: _NFA, start: int, final: int) -> DFA:
+    """
+    Subset construction. Word boundaries depend on the previous character, so
+    each DFA state also records whether that character was a word character
+    (in the Unicode and ASCII senses the regex uses), or that there was none.
+    """
+    boundary_modes = sorted(
+        {
+            ascii_only
+            for edges in nfa.assertions
+            for op, ascii_only, _ in edges
+            if op in _AT_BOUNDARY
+        }
+    )
+    word_sets = [_category(r"\w", ascii_only) for ascii_only in boundary_modes]
+    charsets = {charset for edges in nfa.chars for charset, _ in edges}
+    classes = _partition([*charsets, *word_sets])
+    # The word kind of each class: whether it is in each word set
+    kinds = [
+        tuple(_contains(word_set, charset[0][0]) for word_set in word_sets)
+        for charset in classes
+    ]
+    reads = [
+        [(_covered(charset, classes), target) for charset, target in edges]
+        for edges in nfa.chars
+    ]
+
+    def is_word(kind, ascii_only: bool) -> bool:
+        if kind in (_START, _END):
+            return False
+        return kind[boundary_modes.index(ascii_only)]
+
+    def holds(op, ascii_only: bool, previous, following) -> bool:
+        if op in _AT_START:
+            return previous == _START
+        if op in _AT_END:
+            return following == _END
+        if previous == _START and following == _END:
+            # Neither \b nor \B matches the empty string
+            return False
+        boundary = is_word(previous, ascii_only) != is_word(following, ascii_only)
+        return boundary == (op == sre_constants.AT_BOUNDARY)
+
+    steps = 0
+
+    def closure(states: frozenset[int], previous, following) -> set[int]:
+        nonlocal steps
+        reached = set(states)
+        pending = list(states)
+        while pending:
+            state = pending.pop()
+            steps += 1
+            targets = list(nfa.epsilon[state])
+            targets += [
+                target
+                for op, ascii_only, target in nfa.assertions[state]
+                if holds(op, ascii_only, previous, following)
+            ]
+            for target in targets:
+                if target not in reached:
+                    reached.add(target)
+                    pending.append(target)
+        return reached
+
+    initial = (frozenset([start]), _START)
+    dead = (frozenset(), _START)
+    index = {initial: 0, dead: 1}
+    keys = [initial, dead]
+    transitions: list[list[int]] = []
+    accepting: list[bool] = []
+    while len(transitions) < len(keys):
+        states, previous = keys[len(transitions)]
+        accepting.append(final in closure(states, previous, _END))
+        row = []
+        for symbol, kind in enumerate(kinds):
+            current = closure(states, previous, kind)
+            steps += len(current)
+            if steps > MAX_DFA_STEPS:
+                raise WorkLimitExceeded(f"More than {MAX_DFA_STEPS} steps")
+            targets = frozenset(
+                target
+                for state in current
+                for covered, target in reads[state]
+                if symbol in covered
+            )
+            key = (targets, kind) if targets else dead
+            if key not in index:
+                if len(keys) >= MAX_DFA_STATES:
+                    raise UnsupportedRegex(f"More than {MAX_DFA_STATES} DFA states")
+                index[key] = len(keys)
+                keys.append(key)
+            row.append(index[key])
+        transitions.append(row)
+    return DFA(classes, transitions, accepting, 0)
+
+
+def _minimize(dfa: DFA) -> DFA:
+    """
+    Merge equivalent states by partition refinement (Moore's algorithm), then
+    merge the alphabet classes that every state treats alike.
+    """
+    reachable = _reachable(dfa)
+    block = {state: int(dfa.accepting[state]) for state in reachable}
+    while True:
+        signatures = {
+            state: (block[state], tuple(block[t] for t in dfa.transitions[state]))
+            for state in reachable
+        }
+        numbering = {
+            signature: i
+            for i, signature in enumerate(dict.fromkeys(signatures.values()))
+        }
+        refined = {state: numbering[signatures[state]] for state in reachable}
+        done = len(numbering) == len(set(block.values()))
+        block = refined
+        if done:
+            break
+    count = len(set(block.values()))
+    transitions = [[] for _ in range(count)]
+    accepting = [False] * count
+    for state in reachable:
+        transitions[block[state]] = [block[t] for t in dfa.transitions[state]]
+        accepting[block[state]] = dfa.accepting[state]
+    # Classes that lead to the same state everywhere can be merged
+    columns: dict[tuple[int, ...], list[int]] = {}
+    for symbol in range(len(dfa.classes)):
+        columns.setdefault(tuple(row[symbol] for row in transitions), []).append(symbol)
+    classes = [
+        _union(*(dfa.classes[symbol] for symbol in symbols))
+        for symbols in columns.values()
+    ]
+    transitions = [
+        [row[symbols[0]] for symbols in columns.values()] for row in transitions
+    ]
+    return DFA(classes, transitions, accepting, block[dfa.start])
+
+
+def _reachable(dfa: DFA) -> list[int]:
+    seen = {dfa.start}
+    pending = [dfa.start]
+    while pending:
+        for target in dfa.transitions[pending.pop()]:
+            if target not in seen:
+                seen.add(target)
+                pending.append(target)
+    return sorted(seen)
+
+
+def _find_counterexample(dfa1: DFA, dfa2: DFA) -> Optional[str]:
+    """
+    Breadth-first search of the product automaton for the shortest string
+    accepted by exactly one of the DFAs.
+
+    Raises:
+        WorkLimitExceeded: If the search visited more than
+            `MAX_PRODUCT_STATES` pairs of states
+    """
+    symbols = [
+        (i, j, _sample(common))
+        for i, class1 in enumerate(dfa1.classes)
+        for j, class2 in enumerate(dfa2.classes)
+        if (common := _intersection(class1, class2))
+    ]
+    start = (dfa1.start, dfa2.start)
+    parents: dict[tuple[int, int], Optional[tuple[tuple[int, int], str]]] = {
+        start: None
+    }
+    pending = deque([start])
+    while pending:
+        pair = pending.popleft()
+        state1, state2 = pair
+        if dfa1.accepting[state1] != dfa2.accepting[state2]:
+            text = []
+            while parents[pair] is not None:
+                pair, char = parents[pair]
+                text.append(char)
+            return "".join(reversed(text))
+        for i, j, char in symbols:
+            target = (dfa1.transitions[state1][i], dfa2.transitions[state2][j])
+            if target not in parents:
+                if len(parents) >= MAX_PRODUCT_STATES:
+                    raise WorkLimitExceeded(
+                        f"More than {MAX_PRODUCT_STATES} product states"
+                    )
+                parents[target] = (pair, char)
+                pending.append(target)
+    return None
+
+
+def _compare_enumerated(
+    pattern1: str,
+    pattern2: str,
+    mode: MatchMode,
+    flags: int,
+    sandbox: RegexSandbox,
+) -> Equivalence:
+    """
+    Compare two regexes on every string, shortest first, over one character
+    of each class of characters the regexes tell apart. Either regex may
+    backtrack catastrophically, so each is matched in one sandbox evaluation.
+
+    Raises:
+        SandboxError: If the matching of either regex timed out or failed
+    """
+    charsets: set[Charset] = set()
+    for pattern in (pattern1, pattern2):
+        _collect_charsets(list(sre_parse.parse(pattern, flags)), flags, charsets)
+    alphabet = [_sample(charset) for charset in _partition(list(charsets))]
+    texts = []
+    for length in range(MAX_ENUMERATED_LENGTH + 1):
+        if len(texts) + len(alphabet) ** length > MAX_ENUMERATED_STRINGS:
+            break
+        texts += [
+            "".join(chars) for chars in itertools.product(alphabet, repeat=length)
+        ]
+    matches1 = sandbox.matches(pattern1, texts, mode, flags)
+    matches2 = sandbox.matches(pattern2, texts, mode, flags)
+    for text, first_matches, second_matches in zip(texts, matches1, matches2):
+        if first_matches != second_matches:
+            return Equivalence(
+                equivalent=False,
+                counterexample=text,
+                first_matches=first_matches,
+                exact=False,
+            )
+    return Equivalence(equivalent=True, exact=False)
+
+
+def _collect_charsets(items: list, flags: int, charsets: set[Charset]) -> None:
+    """
+    Gather the character sets of a parsed sequence, including those inside
+    constructs the DFA construction does not support.
+    """
+    ignore_case = bool(flags & re.IGNORECASE)
+    ascii_only = bool(flags & re.ASCII)
+    for op, av in items:
+        if op in (sre_constants.LITERAL, sre_constants.NOT_LITERAL):
+            charsets.add(_fold(((av, av),), ignore_case, ascii_only))
+        elif op == sre_constants.IN:
+            try:
+                charsets.add(_class(av, ignore_case, ascii_only))
+            except UnsupportedRegex:
+                pass
+        elif op == sre_constants.AT and av in _AT_BOUNDARY:
+            charsets.add(_category(r"\w", ascii_only))
+        elif op == sre_constants.SUBPATTERN:
+            _, add_flags, del_flags, body = av
+            _collect_charsets(list(body), (flags | add_flags) & ~del_flags, charsets)
+        elif op == sre_constants.BRANCH:
+            for alternative in av[1]:
+                _collect_charsets(list(alternative), flags, charsets)
+        elif isinstance(av, tuple):
+            # Repeats, lookarounds and conditionals keep their bodies last
+            for body in av:
+                if isinstance(body, sre_parse.SubPattern):
+                    _collect_charsets(list(body), flags, charsets)
+
+
+def _class(items: list, ignore_case: bool, ascii_only: bool) -> Charset:
+    """
+    The characters a `[...]` class matches.
+    """
+    ranges: list[tuple[int, int]] = []
+    categories: list[Charset] = []
+    negate = False
+    for op, av in items:
+        if op == sre_constants.NEGATE:
+            negate = True
+        elif op == sre_constants.LITERAL:
+            ranges.append((av, av))
+        elif op == sre_constants.RANGE:
+            ranges.append(av)
+        elif op == sre_constants.CATEGORY and av in _CATEGORIES:
+            name, inverted = _CATEGORIES[av]
+            charset = _category(name, ascii_only)
+            categories.append(_difference(ALPHABET, charset) if inverted else charset)
+        else:
+            raise UnsupportedRegex(f"{op} {av} is not supported in a class")
+    charset = _union(_fold(_normalize(ranges), ignore_case, ascii_only), *categories)
+    return _difference(ALPHABET, charset) if negate else charset
+
+
+@functools.cache
+def _category(name: str, ascii_only: bool) -> Charset:
+    """
+    The characters `\\d`, `\\s` or `\\w` match, found by running `re` over
+    every code point so that they agree with it exactly.
+    """
+    every_char = "".join(map(chr, range(MAX_CODE_POINT + 1)))
+    pattern = re.compile(name + "+", re.ASCII if ascii_only else 0)
+    return _intersection(
+        _normalize([(m.start(), m.end() - 1) for m in pattern.finditer(every_char)]),
+        ALPHABET,
+    )
+
+
+@functools.cache
+def _case_groups(ascii_only: bool) -> dict[int, tuple[int, ...]]:
+    """
+    For each character that has other cases, every character that matches it
+    with IGNORECASE, following the lowercasing and the extra equivalences
+    (such as "s" and "ſ") that `re` uses.
+    """
+    import _sre
+
+    if ascii_only:
+        lower = _sre.ascii_tolower
+        extra_cases = {}
+    else:
+        lower = _sre.unicode_tolower
+        try:
+            from re._casefix import _EXTRA_CASES as extra_cases
+        except ImportError:  # Python < 3.11
+            from sre_compile import _ignorecase_fixes as extra_cases
+    groups: dict[int, set[int]] = {}
+    for code_point in range(MAX_CODE_POINT + 1):
+        lowered = lower(code_point)
+        if lowered != code_point:
+            groups.setdefault(lowered, {lowered}).add(code_point)
+    for lowered, others in extra_cases.items():
+        group = groups.setdefault(lowered, {lowered})
+        for other in others:
+            group |= groups.get(other, {other})
+    return {
+        member: tuple(sorted(group))
+        for group in groups.values()
+        for member in group
+        if member != NEWLINE
+    }
+
+
+def _fold(charset: Charset, ignore_case: bool, ascii_only: bool) -> Charset:
+    """
+    Extend a character set with the other cases of its characters, if
+    matching ignores case.
+    """
+    if not ignore_case:
+        return charset
+    groups = _case_groups(ascii_only)
+    extra = [
+        (member, member)
+        for char, group in groups.items()
+        if _contains(charset, char)
+        for member in group
+    ]
+    return _union(charset, _normalize(extra))
+
+
+def _partition(charsets: list[Charset]) -> list[Charset]:
+    """
+    Split the alphabet into the coarsest classes of characters that each of
+    the character sets either fully contains or excludes.
+    """
+    bounds = {0, MAX_CODE_POINT + 1}
+    for charset in [*charsets, ALPHABET]:
+        for lo, hi in charset:
+            bounds.update((lo, hi + 1))
+    bounds = sorted(bounds)
+    classes: dict[tuple[bool, ...], list[tuple[int, int]]] = {}
+    for lo, next_lo in zip(bounds, bounds[1:]):
+        if not _contains(ALPHABET, lo):
+            continue
+        signature = tuple(_contains(charset, lo) for charset in charsets)
+        classes.setdefault(signature, []).append((lo, next_lo - 1))
+    return [_normalize(ranges) for ranges in classes.values()]
+
+
+def _covered(charset: Charset, classes: list[Charset]) -> set[int]:
+    """
+    The classes of a partition that make up `charset`.
+    """
+    return {i for i, part in enumerate(classes) if _contains(charset, part[0][0])}
+
+
+def _sample(charset: Charset) -> str:
+    """
+    A readable character of the set: printable ASCII if there is one.
+    """
+    for char in "abcxyzABCXYZ0123456789 _-.!":
+        if _contains(charset, ord(char)):
+            return char
+    for lo, hi in charset:
+        if hi >= 0x21 and lo <= 0x7E:
+            return chr(max(lo, 0x21))
+    return chr(charset[0][0])
+
+
+def _contains(charset: Charset, code_point: int) -> bool:
+    i = bisect.bisect_right(charset, (code_point, MAX_CODE_POINT + 1)) - 1
+    return i >= 0 and charset[i][0] <= code_point <= charset[i][1]
+
+
+def _normalize(ranges: list[tuple[int, int]]) -> Charset:
+    merged: list[tuple[int, int]] = []
+    for lo, hi in sorted(ranges):
+        if merged and lo <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], hi))
+        else:
+            merged.append((lo, hi))
+    return tuple(merged)
+
+
+def _union(*charsets: Charset) -> Charset:
+    return _normalize([r for charset in charsets for r in charset])
+
+
+def _difference(charset: Charset, removed: Charset) -> Charset:
+    complement: list[tuple[int, int]] = []
+    lo = 0
+    for removed_lo, removed_hi in removed:
+        if removed_lo > lo:
+            complement.append((lo, removed_lo - 1))
+        lo = removed_hi + 1
+    if lo <= MAX_CODE_POINT:
+        complement.append((lo, MAX_CODE_POINT))
+    return _intersection(charset, tuple(complement))
+
+
+def _intersection(a: Charset, b: Charset) -> Charset:
+    result: list[tuple[int, int]] = []
+    i = j = 0
+    while i < len(a) and j < len(b):
+        lo, hi = max(a[i][0], b[j][0]), min(a[i][1], b[j][1])
+        if lo <= hi:
+            result.append((lo, hi))
+        if a[i][1] < b[j][1]:
+            i += 1
+        else:
+            j += 1
+    return tuple(result)
@@ -0,0 +1,57 @@
+import functools
+import re
+
+from pydantic import BaseModel
+
+PATTERN_CACHE_SIZE = 4096
+
+
+@functools.lru_cache(maxsize=PATTERN_CACHE_SIZE)
+def compile_pattern(pattern: str, flags: int = 0) -> re.Pattern:
+    """
+    Compile a pattern, keeping the most recently used ones. `re` has a cache
+    of its own, but it is small and cleared when full, so scoring many
+    candidates from several threads keeps recompiling the same patterns.
+
+    Raises:
+        re.error: If the pattern is invalid
+    """
+    return re.compile(pattern, flags)
+
+
+class ExampleResults(BaseModel):
+    """
+    Whether each positive and negative string of a problem matched a
+    candidate regex.
+
+    Attributes:
+        string_matches: One result per string that should match
+        string_mismatches: One result per string that should not match
+    """
+
+    string_matches: list[bool]
+    string_mismatches: list[bool]
+
+    @property
+    def passed(self) -> bool:
+        return all(self.string_matches) and not any(self.string_mismatches)
+
+
+def match_examples(
+    pattern: str,
+    string_matches: list[str],
+    string_mismatches: list[str],
+    flags: int = 0,
+) -> ExampleResults:
+    """
+    Match one candidate regex against every positive and negative string of a
+    problem, at the start of the string as `re.match` does.
+
+    Raises:
+        re.error: If the pattern is invalid
+    """
+    match = compile_pattern(pattern, flags).match
+    return ExampleResults(
+        string_matches=[match(string) is not None for string in string_matches],
+        string_mismatches=[match(string) is not None for string in string_mismatches],
+    )
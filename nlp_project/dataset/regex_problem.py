@@ -1,20 +1,34 @@
+import functools
 import json
 import logging
-import re
 
 from nlp_project.clients.openai_client import WORKING_DIR
 from nlp_project.dataset.base_problem import Problem
 from nlp_project.dataset.gt_generator import RegexExamples
+from nlp_project.dataset.regex_matching import ExampleResults
 from nlp_project.dataset.regex_models import RegexGeneratedExamples, RegexResponse
+from nlp_project.dataset.regex_sandbox import get_regex_sandbox
 from nlp_project.dataset.score_utils import ScoreUtils
 
 
+@functools.cache
+def read_regex_examples() -> dict[str, RegexExamples]:
+    """
+    Load the KB13 samples. The file is read once per process and shared by
+    the problem sets, so callers must not modify the result.
+    """
+    data_dir = WORKING_DIR.parent / "data" / "KB13"
+    with open(data_dir / "samples.json", "r") as f:
+        regex_examples = json.load(f)
+        regex_examples = {k: RegexExamples(**v) for k, v in regex_examples.items()}
+    return regex_examples
+
+
 class RegexProblems:
     def __init__(self, score_utils: ScoreUtils):
         self.regex_descriptions: list[str] = []
         self.regex_examlpes: list[RegexExamples] = []
-
-        for regex_description, regex_example in self.__read_regex_examples().items():
+        for regex_description, regex_example in read_regex_examples().items():
             self.regex_descriptions.append(regex_description)
             self.regex_examlpes.append(regex_example)
         self.__problems = [
@@ -25,8 +39,13 @@ class RegexProblems:
                     output, example
                 ),
                 response_format=RegexResponse,
-                solution_evaluator=lambda solution: lambda txt: self.safe_regex_match(
-                    solution.regex, txt
+                solution_evaluator=lambda solution: functools.partial(
+                    self.safe_match_examples, solution.regex
+                ),
+                answer_fields=["regex"],
+                safety_fn=score_utils.profile_regex_safety,
+                equivalence_fn=lambda output, example=sample_string: score_utils.check_regex_equivalence(
+                    output, example
                 ),
             )
             for regex_description, sample_string in zip(
@@ -34,20 +53,25 @@ class RegexProblems:
             )
         ]
 
-    def safe_regex_match(self, regex_str, text):
+    def safe_match_examples(
+        self, regex_str, string_matches, string_mismatches
+    ) -> ExampleResults:
+        """
+        Match a regex against strings that should and should not match it, in
+        one sandbox evaluation. A regex that fails to evaluate matches none of
+        them.
+        """
+        # The sandbox workers are started on the first evaluation, so loading
+        # the problems (e.g. to plan a run) does not spawn them
+        sandbox = get_regex_sandbox()
         try:
-            return re.match(regex_str, text) is not None
+            return sandbox.match_examples(regex_str, string_matches, string_mismatches)
         except Exception as e:
-            logging.error(f"Error evaluating regex `{regex_str}` on text `{text}`: {e}")
-            return False
-
-    @staticmethod
-    def __read_regex_examples() -> dict[str, RegexExamples]:
-        data_dir = WORKING_DIR.parent / "data" / "KB13"
-        with open(data_dir / "samples.json", "r") as f:
-            regex_examples = json.load(f)
-            regex_examples = {k: RegexExamples(**v) for k, v in regex_examples.items()}
-        return regex_examples
+            logging.error(f"Error evaluating regex `{regex_str}`: {e}")
+            return ExampleResults(
+                string_matches=[False] * len(string_matches),
+                string_mismatches=[False] * len(string_mismatches),
+            )
 
     @property
     def problems(self):
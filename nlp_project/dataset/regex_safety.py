@@ -0,0 +1,323 @@
+import string
+from typing import Optional
+
+from pydantic import BaseModel
+
+from nlp_project.dataset.regex_sandbox import RegexSandbox, SandboxError
+
+try:
+    from re import _constants as sre_constants
+    from re import _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_constants
+    import sre_parse
+
+# Characters the analysis tries when it needs an instance of a character set
+UNIVERSE = string.ascii_letters + string.digits + string.punctuation + " \t\n\x00é"
+# Preferred characters to end an adversarial input with, so that it fails
+SUFFIXES = "!#\n\x00~;"
+
+DEFAULT_INPUT_LENGTHS = (16, 64, 256, 1024)
+PROFILE_TIMEOUT_SECONDS = 0.5
+MAX_ATTACKS = 8
+
+_REPEATS = {sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT}
+_CATEGORIES = {
+    "DIGIT": str.isdigit,
+    "SPACE": str.isspace,
+    "WORD": lambda c: c.isalnum() or c == "_",
+    "LINEBREAK": lambda c: c == "\n",
+}
+
+
+class RegexSafety(BaseModel):
+    """
+    Runtime safety of a regex used as a line filter.
+
+    Attributes:
+        findings: Constructs found by the static check that can make matching
+            take exponential time
+        match_seconds: Worst time to search the adversarial inputs of each
+            length
+        failed_at: The first input length whose searches ran past the time or
+            memory limit of the sandbox, if any
+    """
+
+    findings: list[str] = []
+    match_seconds: dict[int, float] = {}
+    failed_at: Optional[int] = None
+
+    @property
+    def safe(self) -> bool:
+        return not self.findings and self.failed_at is None
+
+
+class Attack(BaseModel):
+    """
+    An input shape that makes a regex backtrack: `prefix` leads to a
+    repetition, `pump` is repeated, and `suffix` makes the match fail.
+    """
+
+    prefix: str
+    pump: str
+    suffix: str
+
+    def input(self, length: int) -> str:
+        repeats = max(
+            1, (length - len(self.prefix) - len(self.suffix)) // len(self.pump)
+        )
+        return self.prefix + self.pump * repeats + self.suffix
+
+
+def analyze_regex(pattern: str, flags: int = 0) -> tuple[list[str], list[Attack]]:
+    """
+    Statically check a regex for ambiguity inside unbounded repetitions: a
+    nested quantifier that can give back what the repetition around it takes
+    (`(a+)+`), or alternatives that can start with the same character
+    (`(a|aa)*`). Either makes a failing match try exponentially many ways.
+
+    Returns:
+        The findings, and inputs shapes to time the regex on: one per finding
+        and one per other repetition
+
+    Raises:
+        re.error: If the pattern is invalid
+    """
+    findings: list[str] = []
+    attacks: list[Attack] = []
+    _walk(list(sre_parse.parse(pattern, flags)), set(), "", False, findings, attacks)
+    unique = {(a.prefix, a.pump, a.suffix): a for a in attacks}
+    return list(dict.fromkeys(findings)), list(unique.values())[:MAX_ATTACKS]
+
+
+def profile_regex(
+    pattern: str,
+    sandbox: RegexSandbox,
+    lengths: tuple[int, ...] = DEFAULT_INPUT_LENGTHS,
+    timeout_seconds: float = PROFILE_TIMEOUT_SECONDS,
+    flags: int = 0,
+) -> RegexSafety:
+    """
+    Check a regex statically, then time `re.search` in the sandbox on
+    adversarial inputs of increasing length derived from its repetitions.
+    Longer inputs are skipped once a length fails.
+
+    Raises:
+        re.error: If the pattern is invalid
+    """
+    findings, attacks = analyze_regex(pattern, flags)
+    safety = RegexSafety(findings=findings)
+    if not attacks:
+        return safety
+    for length in lengths:
+        try:
+            safety.match_seconds[length] = sandbox.search_seconds(
+                pattern,
+                [attack.input(length) for attack in attacks],
+                flags,
+                timeout_seconds,
+            )
+        except SandboxError:
+            safety.failed_at = length
+            break
+    return safety
+
+
+def _walk(
+    items: list,
+    follow: set[str],
+    prefix: str,
+    in_unbounded: bool,
+    findings: list[str],
+    attacks: list[Attack],
+) -> None:
+    """
+    Look for ambiguous constructs in a sequence.
+
+    Args:
+        items: The parsed sequence
+        follow: The characters that can come right after the sequence
+        prefix: An input that leads to the start of the sequence
+        in_unbounded: Whether the sequence is inside an unbounded repetition
+    """
+    for i, (op, av) in enumerate(items):
+        item_follow = _first(items[i + 1 :], follow)
+        item_prefix = prefix + _sample(items[:i])
+        if op in _REPEATS:
+            low, high, body = av
+            body = list(body)
+            body_first = _first(body, set())
+            if high == sre_constants.MAXREPEAT:
+                # The body is followed by itself, or by what follows the repeat
+                body_follow = body_first | item_follow
+                pump = _sample(body) or _any(body_first)
+                if pump:
+                    attacks.append(
+                        Attack(
+                            prefix=item_prefix, pump=pump, suffix=_suffix(body_first)
+                        )
+                    )
+                _walk(body, body_follow, item_prefix, True, findings, attacks)
+            else:
+                _walk(body, item_follow, item_prefix, in_unbounded, findings, attacks)
+            if in_unbounded and high > low:
+                overlap = _first(body, set()) & item_follow
+                if overlap:
+                    pump = min(overlap)
+                    findings.append(
+                        f"nested quantifier: a repetition of {pump!r} inside an "
+                        "unbounded repetition can match the same text in many ways"
+                    )
+                    attacks.append(
+                        Attack(prefix=item_prefix, pump=pump, suffix=_suffix(overlap))
+                    )
+        elif op == sre_constants.BRANCH:
+            alternatives = [list(alternative) for alternative in av[1]]
+            firsts = [_first(alternative, item_follow) for alternative in alternatives]
+            if in_unbounded:
+                for a in range(len(firsts)):
+                    for b in range(a + 1, len(firsts)):
+                        overlap = firsts[a] & firsts[b]
+                        if overlap:
+                            pump = min(overlap)
+                            findings.append(
+                                f"ambiguous alternation: alternatives {a + 1} and "
+                                f"{b + 1} can both start with {pump!r}"
+                            )
+                            attacks.append(
+                                Attack(
+                                    prefix=item_prefix,
+                                    pump=pump,
+                                    suffix=_suffix(overlap),
+                                )
+                            )
+            for alternative in alternatives:
+                _walk(
+                    alternative,
+                    item_follow,
+                    item_prefix,
+                    in_unbounded,
+                    findings,
+                    attacks,
+                )
+        elif op == sre_constants.SUBPATTERN:
+            _walk(
+                list(av[-1]), item_follow, item_prefix, in_unbounded, findings, attacks
+            )
+        # Possessive repeats and atomic groups never backtrack into their body
+
+
+def _first(items: list, follow: set[str]) -> set[str]:
+    """
+    The characters a match of the sequence can start with, including those of
+    `follow` if the sequence can match the empty string.
+    """
+    chars: set[str] = set()
+    for op, av in items:
+        if op == sre_constants.LITERAL:
+            return chars | {chr(av)}
+        if op == sre_constants.NOT_LITERAL:
+            return chars | (set(UNIVERSE) - {chr(av)})
+        if op == sre_constants.ANY:
+            return chars | (set(UNIVERSE) - {"\n"})
+        if op == sre_constants.IN:
+            return chars | {c for c in UNIVERSE if _in_class(av, c)}
+        if op in _REPEATS or op == getattr(sre_constants, "POSSESSIVE_REPEAT", None):
+            low, _, body = av
+            chars |= _first(list(body), set())
+            if low > 0 and not _nullable(list(body)):
+                return chars
+        elif op == sre_constants.BRANCH:
+            for alternative in av[1]:
+                chars |= _first(list(alternative), set())
+            if not any(_nullable(list(alternative)) for alternative in av[1]):
+                return chars
+        elif op == sre_constants.SUBPATTERN:
+            chars |= _first(list(av[-1]), set())
+            if not _nullable(list(av[-1])):
+                return chars
+        elif op == getattr(sre_constants, "ATOMIC_GROUP", None):
+            chars |= _first(list(av), set())
+            if not _nullable(list(av)):
+                return chars
+        elif op == sre_constants.GROUPREF:
+            return chars | set(UNIVERSE)
+        # Anchors and lookarounds match the empty string
+    return chars | follow
+
+
+def _nullable(items: list) -> bool:
+    for op, av in items:
+        if op in (sre_constants.LITERAL, sre_constants.NOT_LITERAL):
+            return False
+        if op in (sre_constants.ANY, sre_constants.IN):
+            return False
+        if op in _REPEATS or op == getattr(sre_constants, "POSSESSIVE_REPEAT", None):
+            if av[0] > 0 and not _nullable(list(av[2])):
+                return False
+        elif op == sre_constants.BRANCH:
+            if not any(_nullable(list(alternative)) for alternative in av[1]):
+                return False
+        elif op == sre_constants.SUBPATTERN:
+            if not _nullable(list(av[-1])):
+                return False
+        elif op == getattr(sre_constants, "ATOMIC_GROUP", None):
+            if not _nullable(list(av)):
+                return False
+    return True
+
+
+def _in_class(items: list, char: str) -> bool:
+    negate = False
+    found = False
+    for op, av in items:
+        if op == sre_constants.NEGATE:
+            negate = True
+        elif op == sre_constants.LITERAL:
+            found = found or char == chr(av)
+        elif op == sre_constants.RANGE:
+            found = found or av[0] <= ord(char) <= av[1]
+        elif op == sre_constants.CATEGORY:
+            name = getattr(av, "name", str(av))
+            name = name.removeprefix("CATEGORY_").removeprefix("UNI_")
+            name = name.removeprefix("LOC_")
+            inverted = name.startswith("NOT_")
+            test = _CATEGORIES.get(name.removeprefix("NOT_"))
+            if test is not None:
+                found = found or test(char) != inverted
+    return found != negate
+
+
+def _sample(items: list) -> str:
+    """
+    A short input matched by the sequence, ignoring anchors and lookarounds.
+    """
+    sample = ""
+    for op, av in items:
+        if op == sre_constants.LITERAL:
+            sample += chr(av)
+        elif op in (sre_constants.NOT_LITERAL, sre_constants.ANY, sre_constants.IN):
+            sample += _any(_first([(op, av)], set()))
+        elif op in _REPEATS or op == getattr(sre_constants, "POSSESSIVE_REPEAT", None):
+            sample += _sample(list(av[2])) * av[0]
+        elif op == sre_constants.BRANCH:
+            sample += _sample(list(av[1][0]))
+        elif op == sre_constants.SUBPATTERN:
+            sample += _sample(list(av[-1]))
+        elif op == getattr(sre_constants, "ATOMIC_GROUP", None):
+            sample += _sample(list(av))
+    return sample
+
+
+def _any(chars: set[str]) -> str:
+    return min(chars) if chars else ""
+
+
+def _suffix(repeated: set[str]) -> str:
+    """
+    A character that cannot continue the repetition, so that it fails.
+    """
+    for char in SUFFIXES + UNIVERSE:
+        if char not in repeated:
+            return char
+    return ""
@@ -0,0 +1,348 @@
+import atexit
+import json
+import math
+import os
+import queue
+import re
+import select
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+from nlp_project.dataset.regex_matching import (
+    ExampleResults,
+    compile_pattern,
+    match_examples,
+)
+
+DEFAULT_TIMEOUT_SECONDS = 2.0
+DEFAULT_MEMORY_MB = 256
+# Time for a worker to start its interpreter and set its limits
+STARTUP_TIMEOUT_SECONDS = 30.0
+
+# The line a worker writes once it can take requests
+READY = "ready"
+
+# The directory `nlp_project` is imported from, for the workers' import path
+PACKAGE_ROOT = Path(__file__).parent.parent.parent
+
+
+class SandboxError(Exception):
+    """
+    A regex evaluation did not complete, e.g. because its worker ran out of
+    memory. Scorers count it as a failed candidate.
+    """
+
+
+class RegexTimeout(SandboxError):
+    """
+    A regex evaluation ran past its time limit, most likely because of
+    catastrophic backtracking.
+    """
+
+
+class _Worker:
+    """
+    One sandbox process, answering a JSON request per line of its stdin.
+    The worker is returned once the process has announced it is ready, so
+    that its startup does not count against the first evaluation's timeout.
+
+    Raises:
+        SandboxError: If the process did not become ready in time
+    """
+
+    def __init__(self, memory_mb: int):
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", __name__, str(memory_mb)],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+            env={
+                **os.environ,
+                "PYTHONPATH": os.pathsep.join(
+                    filter(None, [str(PACKAGE_ROOT), os.environ.get("PYTHONPATH")])
+                ),
+            },
+        )
+        readable, _, _ = select.select(
+            [self.process.stdout], [], [], STARTUP_TIMEOUT_SECONDS
+        )
+        line = self.process.stdout.readline() if readable else ""
+        if line.strip() != READY:
+            self.kill()
+            raise SandboxError(
+                f"Sandbox worker did not start within {STARTUP_TIMEOUT_SECONDS:g} "
+                "seconds"
+            )
+
+    def evaluate(self, request: dict, timeout_seconds: float) -> dict:
+        self.process.stdin.write(json.dumps(request) + "\n")
+        self.process.stdin.flush()
+        readable, _, _ = select.select([self.process.stdout], [], [], timeout_seconds)
+        if not readable:
+            raise RegexTimeout(
+                f"Regex `{request['pattern']}` did not finish within "
+                f"{timeout_seconds:g} seconds"
+            )
+        line = self.process.stdout.readline()
+        if not line:
+            raise SandboxError(
+                f"Sandbox worker exited with {self.process.wait()} while "
+                f"evaluating regex `{request['pattern']}`"
+            )
+        return json.loads(line)
+
+    def kill(self) -> None:
+        self.process.kill()
+        self.process.wait()
+        self.process.stdin.close()
+        self.process.stdout.close()
+
+
+class RegexSandbox:
+    """
+    A pool of worker processes evaluating untrusted regexes, so that a
+    pattern that backtracks catastrophically or exhausts memory cannot stall
+    the experiment.
+
+    Each evaluation gets `timeout_seconds` of wall time, and its worker
+    kills itself once the evaluation has used that much CPU time. Workers
+    that time out or die are replaced. The workers are started with the pool
+    and kept for its lifetime.
+    """
+
+    def __init__(
+        self,
+        workers: Optional[int] = None,
+        timeout_seconds: float = DEFAULT_TIMEOUT_SECONDS,
+        memory_mb: int = DEFAULT_MEMORY_MB,
+    ):
+        self.timeout_seconds = timeout_seconds
+        self.memory_mb = memory_mb
+        self.recycled = 0
+        self.__idle: queue.Queue[_Worker] = queue.Queue()
+        self.__lock = threading.Lock()
+        self.__closed = False
+        # Start the workers in parallel, as each waits for its interpreter
+        with ThreadPoolExecutor() as executor:
+            started = executor.map(
+                lambda _: self.__start_worker(),
+                range(workers or max(2, os.cpu_count() or 1)),
+            )
+            for worker in started:
+                self.__idle.put(worker)
+
+    def __start_worker(self) -> _Worker:
+        return _Worker(self.memory_mb)
+
+    def match_examples(
+        self,
+        pattern: str,
+        string_matches: list[str],
+        string_mismatches: list[str],
+        flags: int = 0,
+    ) -> ExampleResults:
+        """
+        `regex_matching.match_examples`, in a sandbox worker.
+
+        Raises:
+            re.error: If the pattern is invalid
+            RegexTimeout: If the evaluation ran past the time limit
+            SandboxError: If the worker died during the evaluation
+        """
+        response = self.__evaluate(
+            {
+                "op": "match_examples",
+                "pattern": pattern,
+                "flags": flags,
+                "string_matches": string_matches,
+                "string_mismatches": string_mismatches,
+            },
+            self.timeout_seconds,
+        )
+        return ExampleResults(**response)
+
+    def search_seconds(
+        self,
+        pattern: str,
+        inputs: list[str],
+        flags: int = 0,
+        timeout_seconds: Optional[float] = None,
+    ) -> float:
+        """
+        The longest time `re.search` with the pattern takes on one of the
+        inputs, in a sandbox worker.
+
+        Raises:
+            re.error: If the pattern is invalid
+            RegexTimeout: If the searches ran past `timeout_seconds` (by
+                default, the pool's time limit)
+            SandboxError: If the worker died during the searches
+        """
+        response = self.__evaluate(
+            {
+                "op": "search_seconds",
+                "pattern": pattern,
+                "flags": flags,
+                "inputs": inputs,
+            },
+            timeout_seconds or self.timeout_seconds,
+        )
+        return response["seconds"]
+
+    def matches(
+        self,
+        pattern: str,
+        texts: list[str],
+        mode: str = "match",
+        flags: int = 0,
+        timeout_seconds: Optional[float] = None,
+    ) -> list[bool]:
+        """
+        Whether the pattern matches each text with `re.match`, `re.fullmatch`
+        or `re.search`, in a sandbox worker.
+
+        Raises:
+            re.error: If the pattern is invalid
+            RegexTimeout: If the matches ran past `timeout_seconds` (by
+                default, the pool's time limit)
+            SandboxError: If the worker died during the matches
+        """
+        response = self.__evaluate(
+            {
+                "op": "matches",
+                "pattern": pattern,
+                "flags": flags,
+                "mode": mode,
+                "texts": texts,
+            },
+            timeout_seconds or self.timeout_seconds,
+        )
+        return response["matches"]
+
+    def __evaluate(self, request: dict, timeout_seconds: float) -> dict:
+        request["timeout_seconds"] = timeout_seconds
+        worker = self.__idle.get()
+        try:
+            response = worker.evaluate(request, timeout_seconds)
+        except (SandboxError, OSError, ValueError):
+            worker.kill()
+            with self.__lock:
+                self.recycled += 1
+            try:
+                worker = self.__start_worker()
+            except SandboxError:
+                # Keep the dead worker in the pool; its next evaluation fails
+                # and replaces it again
+                pass
+            raise
+        finally:
+            self.__idle.put(worker)
+        if "error" in response:
+            if response.get("type") == "re.error":
+                raise re.error(response["error"])
+            raise SandboxError(response["error"])
+        return response
+
+    def match(self, pattern: str, text: str, flags: int = 0) -> bool:
+        """
+        Whether `pattern` matches at the start of `text`, in a sandbox worker.
+        """
+        return self.match_examples(pattern, [text], [], flags).string_matches[0]
+
+    def close(self) -> None:
+        with self.__lock:
+            if self.__closed:
+                return
+            self.__closed = True
+        while not self.__idle.empty():
+            self.__idle.get().kill()
+
+
+_sandbox: Optional[RegexSandbox] = None
+_sandbox_lock = threading.Lock()
+
+
+def get_regex_sandbox() -> RegexSandbox:
+    """
+    Return the process-wide sandbox pool, starting its workers on first use.
+    """
+    global _sandbox
+    with _sandbox_lock:
+        if _sandbox is None:
+            _sandbox = RegexSandbox()
+            atexit.register(_sandbox.close)
+        return _sandbox
+
+
+def _limit_cpu_seconds(seconds: float) -> None:
+    """
+    Let the current process use `seconds` more CPU time before the kernel
+    kills it with SIGXCPU.
+    """
+    import resource
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    soft = math.ceil(usage.ru_utime + usage.ru_stime + seconds)
+    if hard != resource.RLIM_INFINITY:
+        soft = min(soft, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+
+
+def _search_seconds(pattern: str, inputs: list[str], flags: int) -> float:
+    search = compile_pattern(pattern, flags).search
+    seconds = 0.0
+    for text in inputs:
+        start = time.perf_counter()
+        search(text)
+        seconds = max(seconds, time.perf_counter() - start)
+    return seconds
+
+
+def _serve(memory_mb: int) -> None:
+    import resource
+
+    memory = memory_mb * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_AS, (memory, memory))
+    sys.stdout.write(READY + "\n")
+    sys.stdout.flush()
+    for line in sys.stdin:
+        request = json.loads(line)
+        _limit_cpu_seconds(request["timeout_seconds"])
+        try:
+            if request["op"] == "matches":
+                match = getattr(
+                    compile_pattern(request["pattern"], request["flags"]),
+                    request["mode"],
+                )
+                response = {
+                    "matches": [match(text) is not None for text in request["texts"]]
+                }
+            elif request["op"] == "search_seconds":
+                response = {
+                    "seconds": _search_seconds(
+                        request["pattern"], request["inputs"], request["flags"]
+                    )
+                }
+            else:
+                response = match_examples(
+                    request["pattern"],
+                    request["string_matches"],
+                    request["string_mismatches"],
+                    request["flags"],
+                ).model_dump()
+        except re.error as e:
+            response = {"error": str(e), "type": "re.error"}
+        except (MemoryError, RecursionError, OverflowError) as e:
+            response = {"error": repr(e), "type": type(e).__name__}
+        sys.stdout.write(json.dumps(response) + "\n")
+        sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    _serve(int(sys.argv[1]))
@@ -1,11 +1,24 @@
 import re
+import threading
 
-import sympy as sp
 from pydantic import BaseModel
 
-from nlp_project.clients.openai_client import LLMConfig, get_openai_client
+from nlp_project.clients.openai_client import (
+    LLMConfig,
+    estimate_tokens,
+    get_circuit_breaker,
+    get_openai_client,
+    get_rate_limiter,
+    rate_limit_handler,
+    structured_completions,
+)
+from nlp_project.clients.resilience import retry_call
+from nlp_project.clients.response_cache import get_response_cache, load_response
 from nlp_project.dataset.gt_generator import RegexExamples
+from nlp_project.dataset.regex_equivalence import check_equivalence
 from nlp_project.dataset.regex_models import RegexResponse
+from nlp_project.dataset.regex_safety import profile_regex
+from nlp_project.dataset.regex_sandbox import get_regex_sandbox
 
 
 class SemanticContainment(BaseModel):
@@ -17,15 +30,48 @@ class ScoreUtils:
     def __init__(self):
         self.llm_config = LLMConfig.from_config_toml()
         self.openai_client = get_openai_client(self.llm_config)
+        self.rate_limiter = get_rate_limiter(self.llm_config)
+        self.circuit_breaker = get_circuit_breaker(self.llm_config)
+        self.response_cache = get_response_cache(self.llm_config.cache)
+        self.__embeddings = None
+        self.__embeddings_lock = threading.Lock()
+
+    @property
+    def embeddings(self):
+        """
+        Batches the embeddings of concurrent scorers and caches each vector.
+        """
+        # NumPy takes a tenth of a second to import and only semantic scoring
+        # uses it
+        from nlp_project.clients.embedding_service import (
+            EmbeddingService,
+            get_vector_cache,
+        )
+
+        with self.__embeddings_lock:
+            if self.__embeddings is None:
+                self.__embeddings = EmbeddingService(
+                    self.__embed,
+                    self.llm_config.embeddings_model,
+                    get_vector_cache(self.llm_config.cache),
+                )
+            return self.__embeddings
 
     def simplify_math(self, expression):
+        # sympy takes half a second to import and only the math problems use it
+        import sympy as sp
+
         simplified_expression = sp.simplify(expression)
         return str(simplified_expression)
 
     def evaluate_math(self, expression):
+        import sympy as sp
+
         return sp.sympify(expression).evalf()
 
     def extract_literals(self, expression):
+        import sympy as sp
+
         split_expression = sp.srepr(expression).split(" ")
         split_expression = [
             "".join([c for c in s if c.isnumeric()]) for s in split_expression
@@ -33,16 +79,27 @@ class ScoreUtils:
         return [s for s in split_expression if s]
 
     def contains_semantically(self, target, text):
-        response = self.openai_client.beta.chat.completions.parse(
-            model=self.llm_config.model,
-            messages=[
-                {"role": "system", "content": "You find matches in texts."},
-                {
-                    "role": "user",
-                    "content": f"If the following text contains the term '{target}' or another term highly similar to it, return it. Here is the text:\n\n```\n{text}\n```",
-                },
-            ],
-            response_format=SemanticContainment,
+        """
+        Score how closely a term in `text` matches `target`, from 0 (no such
+        term) to 1.
+
+        The target is embedded once and kept in memory for every later
+        output. Each output still costs a parse call to extract its matching
+        term, since that depends on the output, and the embedding of that
+        term, batched with the ones of concurrent scorers. Both are cached.
+        """
+        messages = [
+            {"role": "system", "content": "You find matches in texts."},
+            {
+                "role": "user",
+                "content": f"If the following text contains the term '{target}' or another term highly similar to it, return it. Here is the text:\n\n```\n{text}\n```",
+            },
+        ]
+        response = self.__cached(
+            messages,
+            SemanticContainment,
+            lambda: self.__parse(messages, SemanticContainment),
+            load_response,
         )
 
         match = response.choices[0].message.parsed
@@ -52,42 +109,128 @@ class ScoreUtils:
         elif match.extracted_match not in text:
             raise ValueError("Extracted text does not appear in the original")
 
-        embedding_response = self.openai_client.embeddings.create(
-            model=self.llm_config.embeddings_model,
-            input=[match.extracted_match, target],
-        )
+        similarity = self.embeddings.similarities([match.extracted_match], [target])
+        normalized_similarity = (float(similarity[0, 0]) + 1) / 2
+        return normalized_similarity
 
-        match_embedding = embedding_response.data[0].embedding
-        target_embedding = embedding_response.data[1].embedding
+    def __cached(
+        self, payload, response_format, send, load, model=None, deterministic=None
+    ):
+        """
+        Return the cached response of a request, or send it and cache the
+        response.
+
+        Args:
+            payload: The messages (or embedding inputs) of the request
+            response_format: The response format, as part of the cache key
+            send: Sends the request and returns the response
+            load: Restores a cached response from its stored form
+            model: The model of the request, the chat model if None
+            deterministic: Whether the response only depends on the request
+
+        Returns:
+            The response
+        """
+        if self.response_cache is None:
+            return send()
+        key = self.response_cache.key(
+            model or self.llm_config.model,
+            payload,
+            response_format,
+            deterministic=deterministic,
+        )
+        cached = self.response_cache.get(key)
+        if cached is not None:
+            return load(cached, response_format)
+        response = send()
+        self.response_cache.put(key, response)
+        return response
+
+    def __parse(self, messages, response_format):
+        estimated_tokens = estimate_tokens(messages)
+
+        def send():
+            self.rate_limiter.acquire(estimated_tokens)
+            return structured_completions(self.openai_client).parse(
+                model=self.llm_config.model,
+                messages=messages,
+                response_format=response_format,
+            )
 
-        similarity = self.__cosine_similarity(match_embedding, target_embedding)
-        normalized_similarity = (similarity + 1) / 2
-        return normalized_similarity
+        response = retry_call(
+            send,
+            self.llm_config.retries,
+            self.circuit_breaker,
+            rate_limit_handler(self.rate_limiter),
+        )
+        self.rate_limiter.settle(estimated_tokens, response.usage.total_tokens)
+        return response
+
+    def __embed(self, inputs):
+        def send():
+            self.rate_limiter.acquire(estimate_tokens(inputs, output_tokens=0))
+            return self.openai_client.embeddings.create(
+                model=self.llm_config.embeddings_model,
+                input=inputs,
+            )
 
-    @staticmethod
-    def __cosine_similarity(vec1, vec2):
-        dot_product = sum(a * b for a, b in zip(vec1, vec2))
-        norm_vec1 = sum(a * a for a in vec1) ** 0.5
-        norm_vec2 = sum(b * b for b in vec2) ** 0.5
-        return dot_product / (norm_vec1 * norm_vec2)
+        response = retry_call(
+            send,
+            self.llm_config.retries,
+            self.circuit_breaker,
+            rate_limit_handler(self.rate_limiter),
+        )
+        return [item.embedding for item in response.data]
 
     def compare_regexes(self, regex_response: RegexResponse, regex2: str):
         regex1 = regex_response.regex
         return regex1 == regex2
 
+    def check_regex_equivalence(
+        self, regex_response: RegexResponse, example: RegexExamples
+    ):
+        """
+        Compare a regex with the problem's ground-truth regex, with the same
+        `re.match` semantics as `validate_against_test_cases`.
+
+        Returns:
+            The regexes' `Equivalence`, undecided if the comparison ran past
+            its work or time limit, or None if either regex is invalid
+        """
+        try:
+            return check_equivalence(regex_response.regex, example.regex)
+        except re.error:
+            return None
+
     def validate_against_test_cases(
         self, regex_response: RegexResponse, example: RegexExamples
     ):
         try:
-            return all(
-                re.match(regex_response.regex, test_string) is not None
-                for test_string in example.string_matches
-            ) and all(
-                re.match(regex_response.regex, test_string) is None
-                for test_string in example.string_mismatches
+            # Candidates run in the sandbox; a timeout scores as a failure
+            return (
+                get_regex_sandbox()
+                .match_examples(
+                    regex_response.regex,
+                    example.string_matches,
+                    example.string_mismatches,
+                )
+                .passed
             )
         except Exception as e:
             print(
                 f"Error scoring regex `{regex_response.regex}`: {e}. Returning a score of 0."
             )
             return False
+
+    def profile_regex_safety(self, regex_response: RegexResponse):
+        """
+        Check how a regex behaves as a line filter on adversarial inputs (see
+        `regex_safety.profile_regex`).
+
+        Returns:
+            The regex's `RegexSafety`, or None if the regex is invalid
+        """
+        try:
+            return profile_regex(regex_response.regex, get_regex_sandbox())
+        except re.error:
+            return None
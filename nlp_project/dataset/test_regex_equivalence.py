@@ -0,0 +1,92 @@
+import re
+
+import pytest
+
+from nlp_project.dataset.regex_equivalence import check_equivalence, compile_dfa
+from nlp_project.dataset.regex_sandbox import RegexTimeout
+
+
+@pytest.mark.parametrize(
+    "pattern1, pattern2",
+    [
+        (r"^[agde]+$", r"[adeg][adeg]*\Z"),
+        (r".*ABC.*", r".*ABC"),
+        (r"a{2,3}", r"aaa?"),
+        (r"(?i)hello", r"[hH][eE][lL][lL][oO]"),
+        (r".*\b(cat|dog)\b.*", r".*?\b(?:dog|cat)\b"),
+        (r"\d+", r"\d|\d\d+"),
+        (r".*", r"(?s)"),
+    ],
+)
+def test_equivalent_regexes(pattern1, pattern2):
+    result = check_equivalence(pattern1, pattern2)
+
+    assert result.equivalent and result.exact
+    assert result.counterexample is None
+
+
+@pytest.mark.parametrize(
+    "pattern1, pattern2, mode, counterexample",
+    [
+        (r".*ABC.*", r".*AB", "match", "AB"),
+        (r"cat", r"cat$", "match", "cata"),
+        (r"\bcat\b", r"cat\b", "search", "acat"),
+        (r"x\B", r"x", "fullmatch", "x"),
+        (r"[a-z]+", r"\w+", "fullmatch", "0"),
+        (r"[0-9]", r"\d", "match", "\u0663"),
+    ],
+)
+def test_shortest_counterexample(pattern1, pattern2, mode, counterexample):
+    result = check_equivalence(pattern1, pattern2, mode)
+
+    assert not result.equivalent
+    assert len(result.counterexample) == len(counterexample)
+    matches = [
+        getattr(re, mode)(pattern, result.counterexample) is not None
+        for pattern in (pattern1, pattern2)
+    ]
+    assert matches == [result.first_matches, not result.first_matches]
+
+
+def test_dfa_agrees_with_re():
+    patterns = [r"(?i).*\bg[A-Za-z]*\b.*", r".*(ead|pro).*", r"^\W*\w{2,4}$"]
+    texts = ["", "go", "a Go!", "ag", "gé", "lead", "PRO", "ab_c", " abcde", "_\t"]
+    for pattern in patterns:
+        dfa = compile_dfa(pattern)
+        for text in texts:
+            assert dfa.accepts(text) == (re.match(pattern, text) is not None)
+
+
+def test_dfas_are_minimal_and_cached():
+    # Four states and the dead state of the characters other than a and b
+    assert len(compile_dfa(r"(a|b)*abb", mode="fullmatch")) == 5
+    assert compile_dfa(r".*x.*") is compile_dfa(r".*x.*")
+
+
+def test_backreferences_fall_back_to_enumeration():
+    same = check_equivalence(r"(a)\1", r"aa")
+    different = check_equivalence(r"(a)\1", r"ab")
+
+    assert same.equivalent and not same.exact
+    assert not different.equivalent and different.counterexample == "aa"
+
+
+def test_comparison_past_its_work_limit_is_undecided():
+    result = check_equivalence(r"^.{0,300}x.{0,300}$", r"^.*x.*$")
+
+    assert result.equivalent is None and not result.exact
+
+
+def test_fallback_timing_out_in_the_sandbox_is_undecided():
+    class TimingOutSandbox:
+        def matches(self, pattern, texts, mode, flags):
+            raise RegexTimeout(f"Regex `{pattern}` did not finish")
+
+    result = check_equivalence(r"(a+)+\1$", r"a+$", sandbox=TimingOutSandbox())
+
+    assert result.equivalent is None and not result.exact
+
+
+def test_invalid_regex_raises():
+    with pytest.raises(re.error):
+        check_equivalence(r"(a", r"a")
@@ -0,0 +1,27 @@
+import re
+
+import pytest
+
+from nlp_project.dataset.regex_matching import compile_pattern, match_examples
+
+
+def test_match_examples_reports_every_string():
+    results = match_examples(r"\d+", ["12", "3a"], ["ab", "9"])
+
+    assert results.string_matches == [True, True]
+    assert results.string_mismatches == [False, True]
+    assert not results.passed
+
+
+def test_match_examples_passes_when_all_strings_agree():
+    assert match_examples(r"[a-z]+$", ["abc"], ["ABC", "ab1"]).passed
+
+
+def test_patterns_are_cached_by_pattern_and_flags():
+    assert compile_pattern("a.c") is compile_pattern("a.c")
+    assert compile_pattern("a.c", re.IGNORECASE) is not compile_pattern("a.c")
+
+
+def test_invalid_pattern_raises():
+    with pytest.raises(re.error):
+        match_examples("(", ["a"], [])
@@ -0,0 +1,51 @@
+from nlp_project.dataset import regex_problem
+from nlp_project.dataset.regex_matching import match_examples
+from nlp_project.dataset.regex_models import RegexResponse
+from nlp_project.dataset.regex_problem import RegexProblems
+
+
+class FakeScoreUtils:
+    def profile_regex_safety(self, output):
+        return None
+
+
+class FakeSandbox:
+    def __init__(self):
+        self.requests = []
+
+    def match_examples(self, pattern, string_matches, string_mismatches):
+        self.requests.append((pattern, string_matches, string_mismatches))
+        return match_examples(pattern, string_matches, string_mismatches)
+
+
+def test_solution_evaluator_matches_every_string_in_one_sandbox_call(monkeypatch):
+    sandbox = FakeSandbox()
+    started = []
+
+    def get_regex_sandbox():
+        started.append(1)
+        return sandbox
+
+    monkeypatch.setattr(regex_problem, "get_regex_sandbox", get_regex_sandbox)
+
+    problem = RegexProblems(FakeScoreUtils()).problems[0]
+    assert not started
+
+    evaluate = problem.solution_evaluator(RegexResponse(regex=r"\d", reasoning=""))
+    results = evaluate(["1", "a"], ["b", "2"])
+
+    assert results.string_matches == [True, False]
+    assert results.string_mismatches == [False, True]
+    assert sandbox.requests == [(r"\d", ["1", "a"], ["b", "2"])]
+
+
+def test_regex_failing_to_evaluate_matches_nothing(monkeypatch):
+    monkeypatch.setattr(regex_problem, "get_regex_sandbox", FakeSandbox)
+
+    problem = RegexProblems(FakeScoreUtils()).problems[0]
+    results = problem.solution_evaluator(RegexResponse(regex="(", reasoning=""))(
+        ["a"], ["b"]
+    )
+
+    assert results.string_matches == [False]
+    assert results.string_mismatches == [False]
@@ -0,0 +1,77 @@
+import select
+
+import pytest
+
+from nlp_project.dataset import regex_sandbox
+from nlp_project.dataset.regex_safety import analyze_regex, profile_regex
+from nlp_project.dataset.regex_sandbox import RegexSandbox
+
+
+@pytest.mark.parametrize(
+    "pattern, finding",
+    [
+        (r"(a+)+$", "nested quantifier"),
+        (r"(\w+\s?)+$", "nested quantifier"),
+        (r"(a|aa)*$", "ambiguous alternation"),
+        (r"(?:a|b|ab)*c", "ambiguous alternation"),
+    ],
+)
+def test_static_check_flags_ambiguous_repetitions(pattern, finding):
+    findings, attacks = analyze_regex(pattern)
+
+    assert findings and findings[0].startswith(finding)
+    assert attacks
+
+
+@pytest.mark.parametrize(
+    "pattern", [r"(a|ab)*c", r"(a+b)+", r"(a++)+", r"^[a-z]+@[a-z]+\.com$"]
+)
+def test_static_check_accepts_unambiguous_repetitions(pattern):
+    findings, _ = analyze_regex(pattern)
+
+    assert findings == []
+
+
+def test_profile_times_out_on_exponential_regex():
+    sandbox = RegexSandbox(workers=1)
+    try:
+        unsafe = profile_regex(r"(a+)+$", sandbox, timeout_seconds=0.2)
+        safe = profile_regex(r"^[a-z]+@[a-z]+\.com$", sandbox)
+    finally:
+        sandbox.close()
+
+    assert not unsafe.safe
+    assert unsafe.failed_at is not None
+    assert safe.safe
+    assert set(safe.match_seconds) == {16, 64, 256, 1024}
+
+
+def test_workers_are_ready_before_the_first_evaluation(monkeypatch):
+    # The first evaluation of a new pool used to absorb its interpreter
+    # startup, and time out
+    events = []
+    start = regex_sandbox._Worker.__init__
+    evaluate = regex_sandbox._Worker.evaluate
+
+    def start_recorded(worker, memory_mb):
+        start(worker, memory_mb)
+        events.append("ready")
+
+    def evaluate_recorded(worker, request, timeout_seconds):
+        # The ready line has been read, so only the response is awaited
+        unread, _, _ = select.select([worker.process.stdout], [], [], 0)
+        events.append("evaluate with unread output" if unread else "evaluate")
+        return evaluate(worker, request, timeout_seconds)
+
+    monkeypatch.setattr(regex_sandbox._Worker, "__init__", start_recorded)
+    monkeypatch.setattr(regex_sandbox._Worker, "evaluate", evaluate_recorded)
+
+    sandbox = RegexSandbox(workers=1)
+    try:
+        assert events == ["ready"]
+        safety = profile_regex(r"^[agde]+$", sandbox)
+    finally:
+        sandbox.close()
+
+    assert safety.safe
+    assert set(events[1:]) == {"evaluate"}
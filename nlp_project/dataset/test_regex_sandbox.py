@@ -0,0 +1,51 @@
+import re
+
+import pytest
+
+from nlp_project.dataset.regex_sandbox import RegexSandbox, RegexTimeout
+
+
+@pytest.fixture
+def sandbox():
+    sandbox = RegexSandbox(workers=1, timeout_seconds=0.5)
+    yield sandbox
+    sandbox.close()
+
+
+def test_sandbox_matches_like_re(sandbox):
+    results = sandbox.match_examples(r"\d+", ["12", "3a"], ["ab", "9"])
+
+    assert results.string_matches == [True, True]
+    assert results.string_mismatches == [False, True]
+    assert sandbox.match("a+", "aaa")
+    assert not sandbox.match("a+", "b")
+    texts = ["ab", "xab", "a"]
+    for mode in ("match", "fullmatch", "search"):
+        assert sandbox.matches("ab?", texts, mode) == [
+            getattr(re, mode)("ab?", text) is not None for text in texts
+        ]
+
+
+def test_invalid_pattern_raises_re_error(sandbox):
+    with pytest.raises(re.error):
+        sandbox.match("(", "a")
+
+
+def test_backtracking_pattern_times_out_and_worker_is_recycled(sandbox):
+    with pytest.raises(RegexTimeout):
+        sandbox.match(r"(a+)+$", "a" * 40 + "b")
+
+    assert sandbox.recycled == 1
+    assert sandbox.match("a+", "aaa")
+
+
+def test_workers_are_ready_before_their_first_evaluation():
+    # Well below the time an interpreter takes to start
+    sandbox = RegexSandbox(workers=1, timeout_seconds=0.1)
+    try:
+        assert sandbox.match("a+", "aaa")
+        with pytest.raises(RegexTimeout):
+            sandbox.match(r"(a+)+$", "a" * 40 + "b")
+        assert sandbox.match("a+", "aaa")
+    finally:
+        sandbox.close()
@@ -35,7 +35,7 @@ def test_contains_semantically(
     response_mock.choices[0].message.parsed = SemanticContainment(
         found=found, extracted_match=extracted_match
     )
-    score_utils.openai_client.beta.chat.completions.parse.return_value = response_mock
+    score_utils.openai_client.chat.completions.parse.return_value = response_mock
     if embeddings:
         embedding_response_mock = MagicMock()
         embedding_response_mock.data = []
@@ -1,23 +1,55 @@
+import asyncio
+import json
 import os
 import random
+import socket
 import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections import Counter, defaultdict
 from datetime import datetime
-from typing import Any, Dict, List, Optional
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
 
 import yaml
 from pydantic import BaseModel, RootModel
 from tqdm import tqdm
 
-from nlp_project.dataset.regex_problem import (
-    RegexExampleGenerationProblems,
-    RegexProblems,
+from nlp_project.adaptive_sampling import AdaptiveSampling, SampleBudget
+from nlp_project.clients.budget import BudgetExceeded, TokenBudget
+from nlp_project.clients.deadlines import with_deadline
+from nlp_project.clients.openai_client import (
+    WARM_UP_CONNECTIONS,
+    LLMConfig,
+    size_connection_pools,
 )
+from nlp_project.clients.providers import get_provider_pool
+from nlp_project.clients.resilience import classify_error
+from nlp_project.clients.response_cache import cache_sample
+from nlp_project.clients.scheduler import (
+    DEFAULT_MAX_IN_FLIGHT,
+    RequestScheduler,
+    with_priority,
+)
+from nlp_project.clients.shared_completions import SharedCompletions
+from nlp_project.clients.usage import LLMCall
+from nlp_project.cost_model import CostModel, load_cost_model
+from nlp_project.dataset.base_problem import Problem
+from nlp_project.dataset.regex_equivalence import Equivalence
+from nlp_project.dataset.regex_problem import RegexProblems
+from nlp_project.dataset.regex_safety import RegexSafety
 from nlp_project.dataset.score_utils import ScoreUtils
+from nlp_project.result_sink import (
+    ErrorRecord,
+    ResultRecord,
+    ResultSink,
+    read_errors,
+    read_records,
+)
+from nlp_project.run_planner import RunPlan, load_solver_history, plan_run
 from nlp_project.solvers.base_solver import Solver
 from nlp_project.solvers.chain_of_thought import ChainOfThoughtSolver
 from nlp_project.solvers.dyfs import DynamicFewShotSolver
 from nlp_project.solvers.self_refine import SelfRefineSolver
+from nlp_project.work_queue import FAILED, WorkQueue
 
 
 class EvaluationResult(BaseModel):
@@ -43,6 +75,9 @@ class IndividualResult(BaseModel):
     output: Any
     score: float
     generation_time: float = 0.0
+    llm_calls: list[LLMCall] = []
+    safety: Optional[RegexSafety] = None
+    equivalence: Optional[Equivalence] = None
 
 
 class TokenUsageStats(BaseModel):
@@ -84,80 +119,363 @@ class ExperimentSummary(BaseModel):
     avg_score_per_model: dict[str, float]
     avg_generation_time_per_model: dict[str, float]
     total_tokens_per_model: dict[str, TokenUsageStats]
+    # The most iterations of a pair; with adaptive sampling, pairs may have
+    # fewer (see `samples_per_model`)
     num_iterations: int
     llms: dict[str, str]
+    stragglers_per_model: dict[str, int] = {}
+    failed_cells_per_model: dict[str, int] = {}
+    avg_time_to_first_token_per_model: dict[str, float] = {}
+    avg_time_to_answer_per_model: dict[str, float] = {}
+    # Share of the profiled solutions flagged by the static check or too slow
+    # on adversarial inputs
+    unsafe_rate_per_model: dict[str, float] = {}
+    # Share of the solutions that match exactly the lines the ground-truth
+    # regex matches
+    equivalence_rate_per_model: dict[str, float] = {}
+    # Number of recorded iterations of each solver, over all of its problems
+    samples_per_model: dict[str, int] = {}
 
 
 NUM_ITERATIONS = 3
 REPORT_FILE = "experiment_report.yaml"
 CONVERSATIONS_FILE = "conversations_report.yaml"
+RESULTS_FILE = "results.jsonl"
+RESULTS_GLOB = "results*.jsonl"
+ERRORS_FILE = "errors.jsonl"
+ERRORS_GLOB = "errors*.jsonl"
+PROBLEMS_FILE = "problems.json"
+QUEUE_FILE = "queue.sqlite3"
+QUEUE_POLL_SECONDS = 5.0
+LEASE_SECONDS = 300.0
+WORKER_ID = f"{socket.gethostname()}-{os.getpid()}"
 
 
-def evaluate_problem(solver, problem, solver_name):
-    result = EvaluationResult(
-        scores=[], outputs=[], conversations=[], generation_times=[]
+def cell_error(
+    solver_name: str, problem_name: str, iteration: int, error: Exception
+) -> ErrorRecord:
+    return ErrorRecord(
+        solver_name=solver_name,
+        problem_name=problem_name,
+        iteration=iteration,
+        error=str(error),
+        error_type=type(error).__name__,
+        kind=classify_error(error),
     )
-    total_input_tokens = 0
-    total_output_tokens = 0
-
-    for i in tqdm(
-        range(NUM_ITERATIONS), desc=f"{solver_name} - {problem.name}", leave=False
-    ):
-        start_time = time.time()
-        output, conversation = solver.solve(problem)
-        generation_time = time.time() - start_time
-        score = problem.scorer_fn(output)
-        result.scores.append(score)
-        result.outputs.append(output)
-        result.conversations.append(conversation)
-        result.generation_times.append(generation_time)
-
-        total_input_tokens += solver.token_usage["input_tokens"]
-        total_output_tokens += solver.token_usage["output_tokens"]
-
-    avg_score = result.avg_score
-    avg_generation_time = result.avg_generation_time
-    tqdm.write(
-        f"Average score for problem '{problem.name}' with {solver_name}: {avg_score:.1f}, avg time: {avg_generation_time:.2f}s"
+
+
+def task_seconds() -> Optional[float]:
+    """
+    The configured deadline of one solve, if any.
+    """
+    return LLMConfig.from_config_toml().deadlines.task_seconds
+
+
+async def evaluate_iteration(
+    solver, problem, solver_name: str, iteration: int
+) -> ResultRecord:
+    """
+    Solve and score one (solver, problem, iteration) cell.
+    """
+    cache_sample.set(iteration)
+    start_time = time.time()
+    solution = await with_deadline(task_seconds(), solver.solve(problem))
+    generation_time = time.time() - start_time
+    return await score_solution(
+        solver.scheduler, problem, solver_name, iteration, solution, generation_time
     )
 
-    conversation_reports = [
-        ConversationReport(
-            solver_name=solver_name,
-            problem_name=problem.name,
-            iteration=i + 1,
-            conversation=conversation,
+
+async def score_solution(
+    scheduler: RequestScheduler,
+    problem,
+    solver_name: str,
+    iteration: int,
+    solution,
+    generation_time: float,
+) -> ResultRecord:
+    """
+    Score a (solution, conversation, ledger) tuple returned by a solver.
+    """
+    output, conversation, ledger = solution
+    cache_sample.set(iteration)
+    # Scorers may block (e.g. semantic scoring calls the LLM synchronously)
+    score = await scheduler.run_blocking(problem.scorer_fn, output)
+    safety = None
+    if problem.safety_fn:
+        safety = await scheduler.run_blocking(problem.safety_fn, output)
+    equivalence = None
+    if problem.equivalence_fn:
+        equivalence = await scheduler.run_blocking(problem.equivalence_fn, output)
+    return ResultRecord(
+        solver_name=solver_name,
+        problem_name=problem.name,
+        iteration=iteration,
+        output=output,
+        score=score,
+        generation_time=generation_time,
+        input_tokens=ledger.input_tokens,
+        output_tokens=ledger.output_tokens,
+        llm_calls=ledger.calls,
+        conversation=conversation,
+        safety=safety,
+        equivalence=equivalence,
+    )
+
+
+async def evaluate_problem(
+    solver,
+    problem,
+    solver_name,
+    sink: ResultSink,
+    completed_scores: Optional[dict[int, float]] = None,
+    batch_iterations: bool = False,
+    sampling: Optional[AdaptiveSampling] = None,
+    budget: Optional[SampleBudget] = None,
+) -> int:
+    """
+    Run the iterations of one (solver, problem) pair that are not yet recorded
+    in the sink, concurrently.
+
+    A failing iteration is reported and recorded as an error, but not as a
+    result, so that resuming the run retries it. Iterations stopped by the
+    token budget are left for a resumed run without an error.
+
+    Args:
+        completed_scores: Scores of the iterations already recorded, by
+            iteration
+        batch_iterations: Produce the missing iterations of a round with one
+            `solver.solve_batch` call, which single-turn solvers answer with a
+            single multi-choice completion
+        sampling: Sample adaptively instead of `NUM_ITERATIONS` times: start
+            with `sampling.min_samples` iterations, then add one iteration at a
+            time, taken from `budget`, until the score has settled
+        budget: The pool of extra samples shared by all pairs
+
+    Returns:
+        The number of failed iterations
+    """
+    completed_scores = completed_scores or {}
+    records = []
+    attempted = 0
+    stopped = 0
+
+    def report_failure(iteration, e):
+        tqdm.write(
+            f"Iteration {iteration} of problem '{problem.name}' with {solver_name} failed: {e!r}"
         )
-        for i, conversation in enumerate(result.conversations)
-    ]
+        sink.append_error(cell_error(solver_name, problem.name, iteration, e))
 
-    return (
-        solver_name,
-        problem.name,
-        ProblemReport(
-            results=[
-                IndividualResult(
-                    output=output,
-                    score=score,
-                    generation_time=generation_time,
+    async def run_iteration(iteration, solution=None, generation_time=None):
+        nonlocal stopped
+        try:
+            if solution is None:
+                record = await evaluate_iteration(
+                    solver, problem, solver_name, iteration
                 )
-                for output, score, generation_time in zip(
-                    result.outputs, result.scores, result.generation_times
+            else:
+                record = await score_solution(
+                    solver.scheduler,
+                    problem,
+                    solver_name,
+                    iteration,
+                    solution,
+                    generation_time,
                 )
-            ],
-            avg_score=avg_score,
-            token_usage=TokenUsageStats(
-                input_tokens=total_input_tokens,
-                output_tokens=total_output_tokens,
-                avg_generation_time=avg_generation_time,
-            ),
-            avg_generation_time=avg_generation_time,
-        ),
-        conversation_reports,
+        except BudgetExceeded:
+            stopped += 1
+            return
+        except Exception as e:
+            report_failure(iteration, e)
+            return
+        sink.append(record)
+        records.append(record)
+
+    async def run_iterations(iterations):
+        nonlocal attempted, stopped
+        attempted += len(iterations)
+        if not batch_iterations or len(iterations) < 2:
+            await asyncio.gather(
+                *(run_iteration(iteration) for iteration in iterations)
+            )
+            return
+        try:
+            cache_sample.set(iterations[0])
+            start_time = time.time()
+            solutions = await with_deadline(
+                task_seconds(), solver.solve_batch(problem, len(iterations))
+            )
+            generation_time = time.time() - start_time
+        except BudgetExceeded:
+            stopped += len(iterations)
+            return
+        except Exception as e:
+            for iteration in iterations:
+                report_failure(iteration, e)
+            return
+        await asyncio.gather(
+            *(
+                run_iteration(iteration, solution, generation_time)
+                for iteration, solution in zip(iterations, solutions)
+            )
+        )
+
+    first_round = sampling.min_samples if sampling else NUM_ITERATIONS
+    await run_iterations(
+        [
+            iteration
+            for iteration in range(1, first_round + 1)
+            if iteration not in completed_scores
+        ]
     )
 
+    if sampling:
+        token_budget = solver.provider_pool.token_budget
+        iteration = first_round
+        while iteration < sampling.max_samples and not sampling.is_settled(
+            list(completed_scores.values()) + [record.score for record in records]
+        ):
+            iteration += 1
+            if iteration in completed_scores:
+                continue
+            if token_budget and token_budget.exhausted:
+                break
+            if not budget.take():
+                break
+            await run_iterations([iteration])
+
+    if records:
+        avg_score = sum(record.score for record in records) / len(records)
+        avg_generation_time = sum(record.generation_time for record in records) / len(
+            records
+        )
+        tqdm.write(
+            f"Average score for problem '{problem.name}' with {solver_name}: {avg_score:.1f}, avg time: {avg_generation_time:.2f}s"
+        )
+    return attempted - len(records) - stopped
+
+
+def load_completed_cells(run_dir: Path) -> dict[tuple[str, str], dict[int, float]]:
+    """
+    Collect the scores already recorded in a run directory, keyed by
+    (solver, problem) and then by iteration.
+    """
+    completed = defaultdict(dict)
+    for record in read_records(sorted(run_dir.glob(RESULTS_GLOB))):
+        completed[(record.solver_name, record.problem_name)][
+            record.iteration
+        ] = record.score
+    return dict(completed)
+
+
+def load_problem_sample(
+    run_dir: Path, problem_names: list[str], sample_size: Optional[int]
+) -> list[str]:
+    """
+    Return the problems sampled for a run directory, drawing and saving a new
+    sample the first time the directory is used.
+    """
+    problems_file = run_dir / PROBLEMS_FILE
+    if problems_file.exists():
+        with open(problems_file, "r") as f:
+            return json.load(f)
+
+    if sample_size is None:
+        sample_size = len(problem_names)
+    sample = random.sample(problem_names, sample_size)
+    with open(problems_file, "w") as f:
+        json.dump(sample, f, indent=4)
+    return sample
+
+
+def build_experiment_report(
+    results_files: list[Path],
+) -> dict[str, dict[str, ProblemReport]]:
+    """
+    Aggregate the per-iteration records of the given result files into
+    per-solver, per-problem reports. Conversations are not loaded.
+    """
+    records = defaultdict(lambda: defaultdict(dict))
+    for record in read_records(results_files):
+        record.conversation = []
+        records[record.solver_name][record.problem_name][record.iteration] = record
+
+    report = {}
+    for solver_name, problems in records.items():
+        report[solver_name] = {}
+        for problem_name, iteration_records in problems.items():
+            problem_records = [
+                iteration_records[iteration] for iteration in sorted(iteration_records)
+            ]
+            result = EvaluationResult(
+                scores=[record.score for record in problem_records],
+                outputs=[record.output for record in problem_records],
+                conversations=[],
+                generation_times=[record.generation_time for record in problem_records],
+            )
+            report[solver_name][problem_name] = ProblemReport(
+                results=[
+                    IndividualResult(
+                        output=record.output,
+                        score=record.score,
+                        generation_time=record.generation_time,
+                        llm_calls=record.llm_calls,
+                        safety=record.safety,
+                        equivalence=record.equivalence,
+                    )
+                    for record in problem_records
+                ],
+                avg_score=result.avg_score,
+                token_usage=TokenUsageStats(
+                    input_tokens=sum(record.input_tokens for record in problem_records),
+                    output_tokens=sum(
+                        record.output_tokens for record in problem_records
+                    ),
+                    avg_generation_time=result.avg_generation_time,
+                ),
+                avg_generation_time=result.avg_generation_time,
+            )
+    return report
+
+
+def unresolved_errors(
+    results_files: list[Path], errors_files: Iterable[Path]
+) -> list[ErrorRecord]:
+    """
+    The last error of each failed cell that has no result.
+    """
+    errors = {
+        (error.solver_name, error.problem_name, error.iteration): error
+        for error in read_errors(errors_files)
+    }
+    for record in read_records(results_files):
+        errors.pop((record.solver_name, record.problem_name, record.iteration), None)
+    return list(errors.values())
+
 
-def generate_summary(report: dict, solvers: list[Solver]):
+def write_conversations_report(results_files: list[Path], conversations_file: str):
+    """
+    Stream the conversations of the given result files into a YAML list, one
+    record at a time.
+    """
+    written = False
+    with open(conversations_file, "w") as f:
+        for record in read_records(results_files):
+            conversation_report = ConversationReport(
+                solver_name=record.solver_name,
+                problem_name=record.problem_name,
+                iteration=record.iteration,
+                conversation=record.conversation,
+            )
+            yaml.dump([conversation_report.model_dump()], f, default_flow_style=False)
+            written = True
+        if not written:
+            yaml.dump([], f)
+
+
+def generate_summary(
+    report: dict, llms: dict[str, str], failed_cells: Iterable[ErrorRecord] = ()
+):
     unique_problems = set(
         problem_name
         for solver_report in report.values()
@@ -165,11 +483,17 @@ def generate_summary(report: dict, solvers: list[Solver]):
     )
     total_problems = len(unique_problems)
     total_solvers = len(report)
-    avg_score = sum(
-        problem_report.avg_score
-        for solver_report in report.values()
-        for problem_report in solver_report.values()
-    ) / (total_problems * total_solvers)
+    # No cell may have succeeded, e.g. when every request failed
+    avg_score = (
+        sum(
+            problem_report.avg_score
+            for solver_report in report.values()
+            for problem_report in solver_report.values()
+        )
+        / (total_problems * total_solvers)
+        if total_problems
+        else 0.0
+    )
     avg_score_per_model = {
         solver_name: sum(
             problem_report.avg_score for problem_report in solver_report.values()
@@ -207,40 +531,146 @@ def generate_summary(report: dict, solvers: list[Solver]):
         avg_generation_time_per_model=avg_generation_time_per_model,
         total_tokens_per_model=total_tokens_per_model,
         num_iterations=NUM_ITERATIONS,
-        llms={str(solver): solver.llm_config.model for solver in solvers},
+        llms=llms,
+        stragglers_per_model={
+            solver_name: sum(
+                call.stragglers
+                for problem_report in solver_report.values()
+                for result in problem_report.results
+                for call in result.llm_calls
+            )
+            for solver_name, solver_report in report.items()
+        },
+        failed_cells_per_model=dict(
+            Counter(error.solver_name for error in failed_cells)
+        ),
+        avg_time_to_first_token_per_model=average_call_times(
+            report, "time_to_first_token"
+        ),
+        avg_time_to_answer_per_model=average_call_times(report, "time_to_answer"),
+        unsafe_rate_per_model=unsafe_rates(report),
+        equivalence_rate_per_model=equivalence_rates(report),
+        samples_per_model={
+            solver_name: sum(
+                len(problem_report.results) for problem_report in solver_report.values()
+            )
+            for solver_name, solver_report in report.items()
+        },
     )
 
 
-def run_experiment(sample_size: Optional[int] = None) -> None:
+def average_call_times(report: dict, field: str) -> dict[str, float]:
+    """
+    Average a timing of the streamed LLM calls of each solver, leaving out
+    solvers with no streamed calls.
+    """
+    averages = {}
+    for solver_name, solver_report in report.items():
+        times = [
+            getattr(call, field)
+            for problem_report in solver_report.values()
+            for result in problem_report.results
+            for call in result.llm_calls
+            if getattr(call, field) is not None
+        ]
+        if times:
+            averages[solver_name] = sum(times) / len(times)
+    return averages
+
+
+def unsafe_rates(report: dict) -> dict[str, float]:
+    """
+    The share of each solver's profiled solutions that are not safe as line
+    filters, leaving out solvers with no profiled solutions.
+    """
+    rates = {}
+    for solver_name, solver_report in report.items():
+        profiles = [
+            result.safety
+            for problem_report in solver_report.values()
+            for result in problem_report.results
+            if result.safety is not None
+        ]
+        if profiles:
+            rates[solver_name] = sum(not safety.safe for safety in profiles) / len(
+                profiles
+            )
+    return rates
+
+
+def equivalence_rates(report: dict) -> dict[str, float]:
+    """
+    The share of each solver's compared solutions that are equivalent to the
+    ground truth, leaving out inconclusive comparisons and solvers with no
+    conclusive ones.
+    """
+    rates = {}
+    for solver_name, solver_report in report.items():
+        comparisons = [
+            result.equivalence
+            for problem_report in solver_report.values()
+            for result in problem_report.results
+            if result.equivalence is not None
+            and result.equivalence.equivalent is not None
+        ]
+        if comparisons:
+            rates[solver_name] = sum(
+                comparison.equivalent for comparison in comparisons
+            ) / len(comparisons)
+    return rates
+
+
+def build_solvers(
+    scheduler: RequestScheduler, share_first_turn: bool = False, stream: bool = False
+) -> dict[str, Solver]:
+    """
+    Create the solvers of the experiment.
+
+    Args:
+        scheduler: The request scheduler shared by all solvers
+        share_first_turn: Let the solvers that begin with the same
+            step-by-step request share its response for each iteration of a
+            problem
+        stream: Stream the solvers' completions, stopping solutions as soon
+            as their answer is complete
+    """
+    shared_completions = SharedCompletions() if share_first_turn else None
     regex_system_message = (
         "You are a regex generation assistant. Your task is to create a Python-compatible regex according to the user provided instructions. "
         "Your regex should match a full line that meets the criteria. "
         "Inline modifiers (e.g. `(?i)`) are only allowed at the very beginning of the regex."
     )
-    solvers = {
+    return {
         "DynamicFewShotSolver": DynamicFewShotSolver(
             regex_system_message,
+            scheduler=scheduler,
+            shared_completions=shared_completions,
+            stream=stream,
         ),
         "ChainOfThoughtSolver": ChainOfThoughtSolver(
             regex_system_message,
+            scheduler=scheduler,
+            shared_completions=shared_completions,
+            stream=stream,
         ),
         "SelfRefineSolver": SelfRefineSolver(
             regex_system_message,
+            scheduler=scheduler,
+            shared_completions=shared_completions,
+            stream=stream,
         ),
         # "ChainOfThoughtSolver-FindExamples": ChainOfThoughtSolver(
         #     "Your task is to find examples that match/don't match the regex described in the user provided instructions."
         # ),
     }
-    score_utils = ScoreUtils()
-    regex_problem_set = RegexProblems(score_utils)
-    regex_examples_problem_set = RegexExampleGenerationProblems(score_utils)
 
-    if sample_size is None:
-        sample_size = len(regex_problem_set.problems)
 
-    problem_sample_index = random.sample(
-        range(len(regex_problem_set.problems)), sample_size
-    )
+def build_solver_problem_mapping() -> dict[str, dict[str, Problem]]:
+    """
+    Return the problems of each solver, keyed by problem name.
+    """
+    score_utils = ScoreUtils()
+    regex_problem_set = RegexProblems(score_utils)
 
     solver_problem_mapping = {
         "DynamicFewShotSolver": regex_problem_set.problems,
@@ -252,63 +682,569 @@ def run_experiment(sample_size: Optional[int] = None) -> None:
         len(set(len(p) for p in solver_problem_mapping.values())) == 1
     ), "Problem sets must be of equal size"
 
-    report = {}
-    all_conversations = []
+    return {
+        solver_name: {problem.name: problem for problem in problems}
+        for solver_name, problems in solver_problem_mapping.items()
+    }
+
+
+async def warm_up_clients(max_in_flight: int) -> None:
+    """
+    Open connections to the LLM providers ahead of the first requests.
+    """
+    await asyncio.gather(
+        *(
+            provider.warm_up(min(max_in_flight, WARM_UP_CONNECTIONS))
+            for provider in get_provider_pool(LLMConfig.from_config_toml()).providers
+        )
+    )
+
+
+def remaining_pairs(
+    solver_names: Iterable[str],
+    problem_names: Iterable[Optional[str]],
+    completed_cells: Optional[dict[tuple[str, str], dict[int, float]]] = None,
+) -> list[tuple[str, Optional[str]]]:
+    """
+    The (solver, problem) pair of every iteration of a run that is not yet
+    recorded.
+    """
+    completed_cells = completed_cells or {}
+    return [
+        (solver_name, problem_name)
+        for solver_name in solver_names
+        for problem_name in problem_names
+        for iteration in range(1, NUM_ITERATIONS + 1)
+        if iteration not in completed_cells.get((solver_name, problem_name), {})
+    ]
+
+
+def plan_experiment(
+    sample_size: Optional[int] = None,
+    max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+    run_dir: Optional[str] = None,
+    reports_dir: str = "reports",
+) -> RunPlan:
+    """
+    Predict the tokens, cost and duration of `run_experiment` with the same
+    arguments from the reports of earlier runs, without sending anything.
+
+    Args:
+        sample_size: Number of problems to sample, or all problems if None
+        max_in_flight: Maximum number of concurrent LLM requests
+        run_dir: A run directory to resume; only its missing cells are planned
+        reports_dir: Directory holding earlier reports and run directories
+    """
+    solver_problem_mapping = build_solver_problem_mapping()
+    all_problems = list(next(iter(solver_problem_mapping.values())))
+    completed_cells = {}
+    results_files = []
+    problems_file = Path(run_dir) / PROBLEMS_FILE if run_dir else None
+    if problems_file and problems_file.exists():
+        with open(problems_file, "r") as f:
+            problem_names = json.load(f)
+        completed_cells = load_completed_cells(Path(run_dir))
+        results_files = sorted(Path(run_dir).glob(RESULTS_GLOB))
+    else:
+        # The sample is drawn when the run starts, so the problems are
+        # predicted from their solver's average
+        problem_names = [None] * (sample_size or len(all_problems))
 
-    with ThreadPoolExecutor(max_workers=5) as executor:
-        futures = []
-        total_tasks = len(solvers) * len(problem_sample_index)
+    return plan_run(
+        remaining_pairs(solver_problem_mapping, problem_names, completed_cells),
+        load_solver_history(reports_dir, results_files),
+        load_cost_model(reports_dir, results_files),
+        max_in_flight,
+        LLMConfig.from_config_toml(),
+    )
+
+
+def run_experiment(
+    sample_size: Optional[int] = None,
+    max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+    run_dir: Optional[str] = None,
+    work_queue: bool = False,
+    batch_iterations: bool = False,
+    adaptive_sampling: Optional[AdaptiveSampling] = None,
+    share_first_turn: bool = False,
+    stream: bool = False,
+) -> None:
+    """
+    Run every solver on a sample of the regex problems and save the reports.
+
+    Args:
+        sample_size: Number of problems to sample, or all problems if None.
+            Ignored when resuming a run directory.
+        max_in_flight: Maximum number of concurrent LLM requests across all
+            solvers, problems and iterations
+        run_dir: Directory holding the run's results. Passing the directory of
+            an earlier run resumes it, skipping every recorded
+            (solver, problem, iteration) cell. A new directory under `reports/`
+            is created if None.
+        work_queue: Put every cell into a queue in the run directory and work
+            on it together with any workers started with `run_worker`
+        batch_iterations: Sample all iterations of a problem in one request
+            (with the `n` parameter) for single-turn solvers such as
+            `ChainOfThoughtSolver`. Not used in work-queue mode, where every
+            iteration is a separate task.
+        adaptive_sampling: Sample each (solver, problem) pair until its score
+            has settled rather than `NUM_ITERATIONS` times. The samples saved
+            on settled pairs are spent on uncertain ones. Not used in
+            work-queue mode.
+        share_first_turn: Compute the initial step-by-step solution of each
+            (problem, iteration) once and let every solver that begins with it
+            branch from the same answer. Batched iterations are not shared.
+        stream: Stream completions, recording each call's time to first token
+            and to answer, and stop generating solutions once their answer
+            fields are complete. Batched iterations are not streamed.
+    """
+    # One scheduler, and so one pool of threads, for the whole run
+    scheduler = RequestScheduler(max_in_flight)
+    try:
+        asyncio.run(
+            _run_experiment(
+                scheduler,
+                sample_size,
+                max_in_flight,
+                run_dir,
+                work_queue,
+                batch_iterations,
+                adaptive_sampling,
+                share_first_turn,
+                stream,
+            )
+        )
+    finally:
+        scheduler.shutdown()
+
+
+async def _run_experiment(
+    scheduler: RequestScheduler,
+    sample_size: Optional[int],
+    max_in_flight: int,
+    run_dir: Optional[str],
+    work_queue: bool,
+    batch_iterations: bool,
+    adaptive_sampling: Optional[AdaptiveSampling],
+    share_first_turn: bool,
+    stream: bool,
+) -> None:
+    size_connection_pools(max_in_flight)
+    solvers = build_solvers(scheduler, share_first_turn, stream)
+    solver_problem_mapping = build_solver_problem_mapping()
+    await warm_up_clients(max_in_flight)
+
+    reports_dir = "reports"
+    os.makedirs(reports_dir, exist_ok=True)
+
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    run_dir = Path(run_dir or os.path.join(reports_dir, f"run_{timestamp}"))
+    run_dir.mkdir(parents=True, exist_ok=True)
+
+    problem_names = load_problem_sample(
+        run_dir, list(next(iter(solver_problem_mapping.values()))), sample_size
+    )
+    completed_cells = load_completed_cells(run_dir)
+    cost_model = load_cost_model(reports_dir, run_dir.glob(RESULTS_GLOB))
+
+    total_tasks = len(solvers) * len(problem_names)
+    print(
+        f"Running experiment with {len(solvers)} solvers on {total_tasks} problems "
+        f"({max_in_flight} requests in flight)"
+    )
+    if completed_cells:
+        print(
+            f"Resuming {run_dir}: {sum(map(len, completed_cells.values()))} cells already recorded"
+        )
+    if cost_model.solver_seconds:
+        print(
+            "Expected seconds per iteration: "
+            + ", ".join(
+                f"{solver_name} {cost_model.expected_seconds(solver_name):.1f}"
+                for solver_name in solvers
+            )
+        )
+    history = load_solver_history(reports_dir, run_dir.glob(RESULTS_GLOB))
+    token_budget = next(iter(solvers.values())).provider_pool.token_budget
+    if history:
+        plan = plan_run(
+            remaining_pairs(solvers, problem_names, completed_cells),
+            history,
+            cost_model,
+            max_in_flight,
+            LLMConfig.from_config_toml(),
+        )
+        print(
+            f"Predicted: {plan.input_tokens + plan.output_tokens} tokens "
+            f"({plan.cost:.2f}), {plan.wall_seconds / 60:.1f} min"
+        )
+        if token_budget and not covers_plan(token_budget, plan):
+            print(
+                "The token budget does not cover the prediction; the run may "
+                "stop early"
+            )
+
+    if work_queue:
+        queue = WorkQueue(run_dir / QUEUE_FILE)
+        requeued = queue.requeue_failed()
+        # Workers claim cells in queue order, so the longest go in first
+        queued = queue.enqueue(
+            (solver_name, problem_name, iteration)
+            for solver_name, problem_name in cost_model.longest_first(
+                (solver_name, problem_name)
+                for solver_name in solvers
+                for problem_name in problem_names
+            )
+            for iteration in range(1, NUM_ITERATIONS + 1)
+            if iteration not in completed_cells.get((solver_name, problem_name), {})
+        )
+        print(
+            f"Queued {queued} cells ({requeued} failed cells requeued); start more "
+            f"workers with run_worker('{run_dir}')"
+        )
+        await _run_worker(
+            queue,
+            run_dir,
+            solvers,
+            solver_problem_mapping,
+            WORKER_ID,
+            max_in_flight,
+            cost_model,
+        )
+        failures = queue.counts().get(FAILED, 0)
+        queue.close()
+    else:
+        failures = await _run_cells(
+            run_dir,
+            solvers,
+            solver_problem_mapping,
+            problem_names,
+            completed_cells,
+            batch_iterations,
+            adaptive_sampling,
+            cost_model,
+        )
 
+    if failures:
         print(
-            f"Running experiment with {len(solvers)} solvers on {total_tasks} problems"
+            f"{failures} cells failed; run again with run_dir='{run_dir}' to retry them"
         )
+    shared_completions = next(iter(solvers.values())).shared_completions
+    if shared_completions:
+        print(
+            f"Shared first turns: {shared_completions.sent} sent, "
+            f"{shared_completions.reused} reused"
+        )
+    provider_pool = next(iter(solvers.values())).provider_pool
+    if provider_pool.stragglers:
+        print(f"Straggling calls cancelled and sent again: {provider_pool.stragglers}")
+    if provider_pool.stopped_early:
+        print(f"Streams stopped after the answer: {provider_pool.stopped_early}")
+    if provider_pool.hedged:
+        print(
+            f"Hedged requests: {provider_pool.hedged} sent, "
+            f"{provider_pool.hedges_won} answered first"
+        )
+    if token_budget:
+        print(
+            f"Spent {token_budget.input_tokens + token_budget.output_tokens} tokens "
+            f"({token_budget.cost:.2f}) of the budget"
+        )
+        if token_budget.exhausted:
+            print(
+                f"Budget reached; run again with run_dir='{run_dir}' to run the "
+                "remaining cells"
+            )
+    print(f"Results saved to {run_dir}")
+    write_reports(
+        sorted(run_dir.glob(RESULTS_GLOB)),
+        reports_dir,
+        timestamp,
+        sorted(run_dir.glob(ERRORS_GLOB)),
+    )
+
+
+def covers_plan(token_budget: TokenBudget, plan: RunPlan) -> bool:
+    config = token_budget.config
+    return (
+        config.max_tokens is None
+        or plan.input_tokens + plan.output_tokens <= config.max_tokens
+    ) and (config.max_cost is None or plan.cost <= config.max_cost)
 
-        for solver_name, solver in solvers.items():
-            report[solver_name] = {}
-            problems = solver_problem_mapping[solver_name]
-            sampled_problems = (problems[i] for i in problem_sample_index)
-            for problem in sampled_problems:
-                futures.append(
-                    executor.submit(evaluate_problem, solver, problem, solver_name)
+
+async def _run_cells(
+    run_dir: Path,
+    solvers: dict[str, Solver],
+    solver_problem_mapping: dict[str, dict[str, Problem]],
+    problem_names: list[str],
+    completed_cells: dict[tuple[str, str], dict[int, float]],
+    batch_iterations: bool,
+    adaptive_sampling: Optional[AdaptiveSampling],
+    cost_model: CostModel,
+) -> int:
+    """
+    Run every cell of the experiment that is not yet recorded in the run
+    directory.
+
+    Pairs are started longest first, and their requests get scheduler slots
+    ahead of those of shorter pairs, so that long multi-turn solves do not
+    make up the tail of the run.
+
+    Returns:
+        The number of failed cells
+    """
+    budget = None
+    if adaptive_sampling:
+        # Spend at most as many samples as a fixed-size run would
+        min_samples = adaptive_sampling.min_samples
+        budget = SampleBudget(
+            len(solvers) * len(problem_names) * (NUM_ITERATIONS - min_samples)
+            - sum(
+                max(0, len(scores) - min_samples) for scores in completed_cells.values()
+            )
+        )
+
+    shared_completions = next(iter(solvers.values())).shared_completions
+    tasks = []
+    with ResultSink(run_dir / RESULTS_FILE, run_dir / ERRORS_FILE) as sink:
+        for solver_name, problem_name in cost_model.longest_first(
+            (solver_name, problem_name)
+            for solver_name in solvers
+            for problem_name in problem_names
+        ):
+            completed_scores = completed_cells.get((solver_name, problem_name), {})
+            if (
+                adaptive_sampling.is_settled(list(completed_scores.values()))
+                if adaptive_sampling
+                else len(completed_scores) >= NUM_ITERATIONS
+            ):
+                continue
+            evaluation = evaluate_problem(
+                solvers[solver_name],
+                solver_problem_mapping[solver_name][problem_name],
+                solver_name,
+                sink,
+                completed_scores,
+                batch_iterations,
+                adaptive_sampling,
+                budget,
+            )
+            if shared_completions:
+                # Keep the problem's shared first turns until all of its pairs
+                # are done
+                shared_completions.hold(problem_name)
+                evaluation = shared_completions.scoped(problem_name, evaluation)
+            tasks.append(
+                asyncio.create_task(
+                    with_priority(
+                        cost_model.expected_seconds(solver_name, problem_name),
+                        evaluation,
+                    )
                 )
+            )
 
-        for future in tqdm(
-            as_completed(futures), total=total_tasks, desc="Overall progress"
+        failures = 0
+        for task in tqdm(
+            asyncio.as_completed(tasks), total=len(tasks), desc="Overall progress"
         ):
-            solver_name, problem_name, problem_report, conversation_reports = (
-                future.result()
+            failures += await task
+    return failures
+
+
+def run_worker(
+    run_dir: str,
+    max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+    worker_id: Optional[str] = None,
+    share_first_turn: bool = False,
+    stream: bool = False,
+) -> None:
+    """
+    Work on the queue of a run started with `run_experiment(work_queue=True)`
+    until every cell is done. Any number of workers, on any host that can reach
+    the run directory, can share one queue.
+
+    Args:
+        run_dir: The run directory of the experiment
+        max_in_flight: Maximum number of concurrent LLM requests of this worker
+        worker_id: Name of the worker's lease owner and result file
+        share_first_turn: Share initial solutions between the solvers, as in
+            `run_experiment`. Only cells that this worker runs at the same
+            time share them.
+        stream: Stream completions and stop solutions early, as in
+            `run_experiment`
+    """
+    run_dir = Path(run_dir)
+    queue = WorkQueue(run_dir / QUEUE_FILE)
+    scheduler = RequestScheduler(max_in_flight)
+
+    async def work():
+        # Build the solvers inside the loop, so they share its client
+        size_connection_pools(max_in_flight)
+        solvers = build_solvers(scheduler, share_first_turn, stream)
+        solver_problem_mapping = build_solver_problem_mapping()
+        await warm_up_clients(max_in_flight)
+        await _run_worker(
+            queue,
+            run_dir,
+            solvers,
+            solver_problem_mapping,
+            worker_id or WORKER_ID,
+            max_in_flight,
+            load_cost_model(run_dir.parent, run_dir.glob(RESULTS_GLOB)),
+        )
+        token_budget = next(iter(solvers.values())).provider_pool.token_budget
+        if token_budget and token_budget.exhausted:
+            print(
+                f"Budget reached after {token_budget.input_tokens + token_budget.output_tokens} "
+                f"tokens ({token_budget.cost:.2f}); the remaining cells stay queued"
             )
-            report[solver_name][problem_name] = problem_report
-            all_conversations.extend(conversation_reports)
 
-    experiment_report = ExperimentReport(root=report)
-    conversations_report = ConversationsReport(root=all_conversations)
-    summary = generate_summary(report, solvers.values())
+    try:
+        asyncio.run(work())
+    finally:
+        scheduler.shutdown()
+        queue.close()
 
-    reports_dir = "reports"
-    os.makedirs(reports_dir, exist_ok=True)
 
+async def _run_worker(
+    queue: WorkQueue,
+    run_dir: Path,
+    solvers: dict[str, Solver],
+    solver_problem_mapping: dict[str, dict[str, Problem]],
+    worker_id: str,
+    concurrency: int,
+    cost_model: CostModel,
+) -> None:
+    """
+    Claim and run queued cells until the queue is drained or the token budget
+    is reached, running up to `concurrency` cells at a time. Requests of cells
+    with a longer expected cost get scheduler slots first.
+    """
+    held_tasks: set[int] = set()
+    scheduler = next(iter(solvers.values())).scheduler
+
+    async def heartbeat():
+        while True:
+            await asyncio.sleep(LEASE_SECONDS / 3)
+            await scheduler.run_blocking(
+                queue.heartbeat, worker_id, list(held_tasks), LEASE_SECONDS
+            )
+
+    token_budget = next(iter(solvers.values())).provider_pool.token_budget
+    shared_completions = next(iter(solvers.values())).shared_completions
+
+    async def work(sink: ResultSink):
+        while True:
+            if token_budget and token_budget.exhausted:
+                return
+            task = await scheduler.run_blocking(queue.claim, worker_id, LEASE_SECONDS)
+            if task is None:
+                if await scheduler.run_blocking(queue.is_drained):
+                    return
+                await asyncio.sleep(QUEUE_POLL_SECONDS)
+                continue
+
+            held_tasks.add(task.id)
+            evaluation = evaluate_iteration(
+                solvers[task.solver_name],
+                solver_problem_mapping[task.solver_name][task.problem_name],
+                task.solver_name,
+                task.iteration,
+            )
+            if shared_completions:
+                shared_completions.hold(task.problem_name)
+                evaluation = shared_completions.scoped(task.problem_name, evaluation)
+            try:
+                record = await with_priority(
+                    cost_model.expected_seconds(task.solver_name, task.problem_name),
+                    evaluation,
+                )
+                sink.append(record)
+                await scheduler.run_blocking(queue.complete, task)
+            except BudgetExceeded:
+                await scheduler.run_blocking(queue.release, task)
+            except Exception as e:
+                tqdm.write(
+                    f"Iteration {task.iteration} of problem '{task.problem_name}' with {task.solver_name} failed: {e!r}"
+                )
+                sink.append_error(
+                    cell_error(task.solver_name, task.problem_name, task.iteration, e)
+                )
+                await scheduler.run_blocking(queue.fail, task, repr(e))
+            finally:
+                held_tasks.discard(task.id)
+
+    heartbeat_task = asyncio.create_task(heartbeat())
+    try:
+        with ResultSink(
+            run_dir / f"results-{worker_id}.jsonl",
+            run_dir / f"errors-{worker_id}.jsonl",
+        ) as sink:
+            await asyncio.gather(*(work(sink) for _ in range(concurrency)))
+    finally:
+        heartbeat_task.cancel()
+
+
+def merge_run(run_dir: str, reports_dir: str = "reports") -> None:
+    """
+    Build the experiment and conversation reports from the results of every
+    worker of a run.
+    """
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    write_reports(
+        sorted(Path(run_dir).glob(RESULTS_GLOB)),
+        reports_dir,
+        timestamp,
+        sorted(Path(run_dir).glob(ERRORS_GLOB)),
+    )
+
+
+def write_reports(
+    results_files: list[Path],
+    reports_dir: str,
+    timestamp: str,
+    errors_files: Iterable[Path] = (),
+) -> None:
+    """
+    Build the YAML experiment and conversation reports from result files.
+
+    Args:
+        results_files: JSONL files written by `ResultSink`
+        reports_dir: Directory to write the reports to
+        timestamp: Suffix of the report file names
+        errors_files: JSONL files of failed cells written by `ResultSink`.
+            Cells that later succeeded are left out of the report.
+    """
     report_file = os.path.join(reports_dir, f"experiment_report_{timestamp}.yaml")
     conversations_file = os.path.join(
         reports_dir, f"conversations_report_{timestamp}.yaml"
     )
 
+    report = build_experiment_report(results_files)
+    experiment_report = ExperimentReport(root=report)
+    llms = {
+        solver_name: result.llm_calls[0].model
+        for solver_name, solver_report in report.items()
+        for problem_report in solver_report.values()
+        for result in problem_report.results
+        if result.llm_calls
+    }
+    failed_cells = unresolved_errors(results_files, errors_files)
+    summary = generate_summary(report, llms, failed_cells)
+
     with open(report_file, "w") as f:
+        # The summary goes first, so it can be read without the details
         yaml.dump(
             {
                 "summary": summary.model_dump(),
                 "details": experiment_report.model_dump(),
+                "errors": [error.model_dump() for error in failed_cells],
             },
             f,
             default_flow_style=False,
+            sort_keys=False,
         )
     print(f"Report saved to {report_file}")
 
-    with open(conversations_file, "w") as f:
-        yaml.dump(
-            conversations_report.model_dump(),
-            f,
-            default_flow_style=False,
-        )
+    write_conversations_report(results_files, conversations_file)
     print(f"Conversations saved to {conversations_file}")
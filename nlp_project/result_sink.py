@@ -0,0 +1,140 @@
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Type, TypeVar, Union
+
+from pydantic import BaseModel
+
+from nlp_project.clients.usage import LLMCall
+from nlp_project.dataset.regex_equivalence import Equivalence
+from nlp_project.dataset.regex_safety import RegexSafety
+
+R = TypeVar("R", bound=BaseModel)
+
+
+class ResultRecord(BaseModel):
+    solver_name: str
+    problem_name: str
+    iteration: int
+    output: Any
+    score: float
+    generation_time: float
+    input_tokens: int = 0
+    output_tokens: int = 0
+    llm_calls: List[LLMCall] = []
+    conversation: List[Dict[str, Any]] = []
+    safety: Optional[RegexSafety] = None
+    equivalence: Optional[Equivalence] = None
+
+
+class ErrorRecord(BaseModel):
+    """
+    A (solver, problem, iteration) cell that failed, e.g. after its LLM calls
+    used up their retries.
+
+    Attributes:
+        kind: How the error was classified (see `classify_error`)
+    """
+
+    solver_name: str
+    problem_name: str
+    iteration: int
+    error: str
+    error_type: str
+    kind: str
+
+
+class ResultSink:
+    """
+    Append-only JSONL file holding one record per finished
+    (solver, problem, iteration) cell.
+
+    Every record is flushed as soon as it is appended, so the file always holds
+    all finished cells, even if the run is interrupted. A record cut off by a
+    crash mid-write is left behind on its own line, which readers skip, so
+    the records appended after it are kept.
+
+    Failed cells go to a separate JSONL file, if `errors_path` is given.
+    """
+
+    def __init__(
+        self, path: Union[str, Path], errors_path: Optional[Union[str, Path]] = None
+    ):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.errors_path = Path(errors_path) if errors_path else None
+        self.__lock = threading.Lock()
+        self.__file = _open_for_append(self.path)
+        self.__errors_file = None
+
+    def append(self, record: ResultRecord) -> None:
+        line = json.dumps(record.model_dump(mode="json"), ensure_ascii=False)
+        with self.__lock:
+            self.__file.write(line + "\n")
+            self.__file.flush()
+
+    def append_error(self, error: ErrorRecord) -> None:
+        if self.errors_path is None:
+            return
+        line = json.dumps(error.model_dump(mode="json"), ensure_ascii=False)
+        with self.__lock:
+            if self.__errors_file is None:
+                self.__errors_file = _open_for_append(self.errors_path)
+            self.__errors_file.write(line + "\n")
+            self.__errors_file.flush()
+
+    def close(self) -> None:
+        with self.__lock:
+            self.__file.close()
+            if self.__errors_file is not None:
+                self.__errors_file.close()
+
+    def __enter__(self) -> "ResultSink":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def _open_for_append(path: Path):
+    """
+    Open a JSONL file for appending, starting a new line if the file does not
+    end with one, so that the next record is not glued to a truncated one.
+    """
+    f = open(path, "a", encoding="utf-8")
+    if f.tell() > 0:
+        with open(path, "rb") as tail:
+            tail.seek(-1, os.SEEK_END)
+            if tail.read(1) != b"\n":
+                f.write("\n")
+                f.flush()
+    return f
+
+
+def read_records(paths: Iterable[Union[str, Path]]) -> Iterator[ResultRecord]:
+    """
+    Stream the records stored in the given JSONL files.
+
+    A truncated last line (e.g. from a crash mid-write) is skipped.
+    """
+    return _read_jsonl(paths, ResultRecord)
+
+
+def read_errors(paths: Iterable[Union[str, Path]]) -> Iterator[ErrorRecord]:
+    """
+    Stream the failed cells stored in the given JSONL files.
+    """
+    return _read_jsonl(paths, ErrorRecord)
+
+
+def _read_jsonl(paths: Iterable[Union[str, Path]], model: Type[R]) -> Iterator[R]:
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    yield model.model_validate_json(line)
+                except ValueError:
+                    continue
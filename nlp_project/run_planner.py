@@ -0,0 +1,248 @@
+from collections import defaultdict
+from pathlib import Path
+from typing import Iterable, Optional, Union
+
+from pydantic import BaseModel
+
+from nlp_project.clients.openai_client import LLMConfig, ProviderConfig
+from nlp_project.cost_model import (
+    REPORT_GLOB,
+    RUN_RESULTS_GLOB,
+    CostModel,
+    load_report_summary,
+    summary_cells,
+)
+from nlp_project.result_sink import read_records
+
+
+class SolverHistory(BaseModel):
+    """
+    Average usage of one iteration of a solver in earlier runs.
+
+    Attributes:
+        requests: LLM requests per iteration, known only from runs with
+            per-iteration records
+    """
+
+    input_tokens: float
+    output_tokens: float
+    requests: Optional[float] = None
+
+
+class SolverPlan(BaseModel):
+    iterations: int
+    input_tokens: int
+    output_tokens: int
+    requests: Optional[int]
+    cost: float
+    seconds: float
+
+
+class RunPlan(BaseModel):
+    """
+    Predicted usage of a run.
+
+    Attributes:
+        wall_seconds: Predicted duration of the run
+        bottleneck: What the duration is bound by: `concurrency`,
+            `longest iteration`, or the rate limit of a provider
+        unknown_solvers: Solvers without history, predicted from the average
+            of the others
+    """
+
+    solvers: dict[str, SolverPlan]
+    input_tokens: int
+    output_tokens: int
+    cost: float
+    wall_seconds: float
+    bottleneck: str
+    unknown_solvers: list[str] = []
+
+
+def load_solver_history(
+    reports_dir: Union[str, Path], results_files: Iterable[Path] = ()
+) -> dict[str, SolverHistory]:
+    """
+    Average the token usage per iteration of each solver over the experiment
+    reports and run directories in `reports_dir`, and any other result files.
+    Solvers with per-iteration records are averaged over those alone.
+    """
+    reports_dir = Path(reports_dir)
+    history = {}
+    for report_file in sorted(reports_dir.glob(REPORT_GLOB)):
+        summary = load_report_summary(report_file)
+        for solver_name, usage in (summary.get("total_tokens_per_model") or {}).items():
+            cells = summary_cells(summary, solver_name)
+            if cells and usage.get("output_tokens"):
+                history[solver_name] = SolverHistory(
+                    input_tokens=usage.get("input_tokens", 0) / cells,
+                    output_tokens=usage["output_tokens"] / cells,
+                )
+
+    records = defaultdict(list)
+    for record in read_records(
+        sorted(set(reports_dir.glob(RUN_RESULTS_GLOB)) | set(results_files))
+    ):
+        records[record.solver_name].append(record)
+    for solver_name, solver_records in records.items():
+        history[solver_name] = SolverHistory(
+            input_tokens=sum(r.input_tokens for r in solver_records)
+            / len(solver_records),
+            output_tokens=sum(r.output_tokens for r in solver_records)
+            / len(solver_records),
+            requests=sum(len(r.llm_calls) for r in solver_records)
+            / len(solver_records),
+        )
+    return history
+
+
+def rate_limited_seconds(
+    llm_config: LLMConfig, total_tokens: float, requests: Optional[float]
+) -> tuple[float, Optional[str]]:
+    """
+    The shortest time the providers' rate limits allow for the given tokens and
+    requests, spread over the providers by weight.
+
+    Returns:
+        The seconds, and the limit they are bound by (None if unlimited)
+    """
+    providers = llm_config.providers or [
+        ProviderConfig(
+            name="default",
+            model=llm_config.model,
+            requests_per_minute=llm_config.requests_per_minute,
+            tokens_per_minute=llm_config.tokens_per_minute,
+        )
+    ]
+    weights = sum(provider.weight for provider in providers)
+    seconds, bound = 0.0, None
+    for provider in providers:
+        share = provider.weight / weights if weights else 1 / len(providers)
+        if not share:
+            continue
+        limits = [(provider.tokens_per_minute, total_tokens, "tokens_per_minute")]
+        if requests is not None:
+            limits.append(
+                (provider.requests_per_minute, requests, "requests_per_minute")
+            )
+        for limit, amount, name in limits:
+            if limit and amount * share / limit * 60 > seconds:
+                seconds = amount * share / limit * 60
+                bound = f"{provider.name} {name}"
+    return seconds, bound
+
+
+def plan_run(
+    pairs: Iterable[tuple[str, Optional[str]]],
+    history: dict[str, SolverHistory],
+    cost_model: CostModel,
+    max_in_flight: int,
+    llm_config: LLMConfig,
+) -> RunPlan:
+    """
+    Predict the tokens, cost and duration of a run.
+
+    Each iteration is assumed to hold one request slot at a time, so the
+    iterations share `max_in_flight` slots unless a rate limit is tighter.
+
+    Args:
+        pairs: The (solver, problem) pair of every iteration to run. Problems
+            may be None, e.g. when they are not sampled yet.
+        history: Usage per iteration of each solver (see `load_solver_history`)
+        cost_model: Expected generation time of each iteration
+        max_in_flight: Maximum number of concurrent LLM requests
+        llm_config: The rate limits and token prices (`[budget]`)
+    """
+    iterations = defaultdict(list)
+    for solver_name, problem_name in pairs:
+        iterations[solver_name].append(problem_name)
+
+    unknown_solvers = [name for name in iterations if name not in history]
+    average = SolverHistory(
+        input_tokens=_mean(h.input_tokens for h in history.values()),
+        output_tokens=_mean(h.output_tokens for h in history.values()),
+    )
+
+    solvers = {}
+    for solver_name, problem_names in iterations.items():
+        usage = history.get(solver_name, average)
+        count = len(problem_names)
+        input_tokens = round(usage.input_tokens * count)
+        output_tokens = round(usage.output_tokens * count)
+        solvers[solver_name] = SolverPlan(
+            iterations=count,
+            input_tokens=input_tokens,
+            output_tokens=output_tokens,
+            requests=(
+                round(usage.requests * count) if usage.requests is not None else None
+            ),
+            cost=llm_config.budget.cost(input_tokens, output_tokens),
+            seconds=sum(
+                cost_model.expected_seconds(solver_name, problem_name)
+                for problem_name in problem_names
+            ),
+        )
+
+    input_tokens = sum(plan.input_tokens for plan in solvers.values())
+    output_tokens = sum(plan.output_tokens for plan in solvers.values())
+    known_requests = [p.requests for p in solvers.values() if p.requests is not None]
+    bounds = {
+        "concurrency": sum(plan.seconds for plan in solvers.values())
+        / max(1, max_in_flight),
+        "longest iteration": max(
+            (
+                cost_model.expected_seconds(solver_name, problem_name)
+                for solver_name, problem_names in iterations.items()
+                for problem_name in problem_names
+            ),
+            default=0.0,
+        ),
+    }
+    rate_seconds, rate_bound = rate_limited_seconds(
+        llm_config,
+        input_tokens + output_tokens,
+        sum(known_requests) if known_requests else None,
+    )
+    if rate_bound:
+        bounds[rate_bound] = rate_seconds
+    bottleneck = max(bounds, key=bounds.get)
+    return RunPlan(
+        solvers=solvers,
+        input_tokens=input_tokens,
+        output_tokens=output_tokens,
+        cost=llm_config.budget.cost(input_tokens, output_tokens),
+        wall_seconds=bounds[bottleneck],
+        bottleneck=bottleneck,
+        unknown_solvers=unknown_solvers,
+    )
+
+
+def format_plan(plan: RunPlan) -> str:
+    lines = [
+        f"{'Solver':<24}{'Iterations':>12}{'Input':>12}{'Output':>12}{'Requests':>10}{'Cost':>10}"
+    ]
+    for solver_name, solver in plan.solvers.items():
+        requests = "?" if solver.requests is None else str(solver.requests)
+        lines.append(
+            f"{solver_name:<24}{solver.iterations:>12}{solver.input_tokens:>12}"
+            f"{solver.output_tokens:>12}{requests:>10}{solver.cost:>10.2f}"
+        )
+    lines.append(
+        f"{'Total':<24}{sum(s.iterations for s in plan.solvers.values()):>12}"
+        f"{plan.input_tokens:>12}{plan.output_tokens:>12}{'':>10}{plan.cost:>10.2f}"
+    )
+    lines.append(
+        f"Predicted wall time: {plan.wall_seconds / 60:.1f} min (bound by {plan.bottleneck})"
+    )
+    if plan.unknown_solvers:
+        lines.append(
+            "No history for "
+            + ", ".join(plan.unknown_solvers)
+            + "; predicted from the other solvers"
+        )
+    return "\n".join(lines)
+
+
+def _mean(values: Iterable[float]) -> float:
+    values = list(values)
+    return sum(values) / len(values) if values else 0.0
@@ -1,20 +1,192 @@
+import asyncio
 from abc import ABC, abstractmethod
-from typing import Any, Dict, List, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
 from pydantic import BaseModel
 
-from nlp_project.clients.openai_client import LLMConfig, get_openai_client
+from nlp_project.clients.openai_client import LLMConfig
+from nlp_project.clients.providers import get_provider_pool
+from nlp_project.clients.response_cache import (
+    cache_sample,
+    get_response_cache,
+    load_response,
+    request_key,
+)
+from nlp_project.clients.scheduler import RequestScheduler
+from nlp_project.clients.shared_completions import SharedCompletions
+from nlp_project.clients.usage import LLMCall, UsageLedger
 from nlp_project.dataset.base_problem import Problem
 
 
 class Solver(ABC):
-    def __init__(self):
+    def __init__(
+        self,
+        scheduler: Optional[RequestScheduler] = None,
+        shared_completions: Optional[SharedCompletions] = None,
+        stream: bool = False,
+    ):
         self.llm_config = LLMConfig.from_config_toml()
-        self.openai_client = get_openai_client(self.llm_config)
-        self.token_usage = {"input_tokens": 0, "output_tokens": 0}
+        self.provider_pool = get_provider_pool(self.llm_config)
+        self.scheduler = scheduler or RequestScheduler()
+        self.shared_completions = shared_completions
+        self.stream = stream
+        self.response_cache = get_response_cache(self.llm_config.cache)
+
+    async def _complete(
+        self,
+        messages: List[Dict[str, Any]],
+        response_format: Any,
+        ledger: UsageLedger,
+        phase: str,
+        n: int = 1,
+        shared: bool = False,
+        answer_fields: Optional[List[str]] = None,
+    ):
+        """
+        Send a chat completion to the provider pool, through the request
+        scheduler, and record its usage.
+
+        Responses found in the response cache are returned without sending
+        anything, and recorded in the ledger as cached calls.
+
+        Args:
+            messages: The conversation to send to the LLM
+            response_format: A pydantic model to parse the response into, or `str`
+            ledger: The ledger of the solve making the call
+            phase: The stage of the solver the call belongs to
+            n: The number of choices to sample from the same prompt
+            shared: Reuse the response of another solver that sends the same
+                request for the same iteration, if the solver has shared
+                completions. Reused calls are recorded as shared.
+            answer_fields: The fields of `response_format` the caller needs. If
+                the solver streams, generation stops once they are complete,
+                and the other fields of the response are left empty.
+
+        Returns:
+            The completion response
+        """
+        # Only send `n` when sampling several choices, to keep single requests
+        # unchanged
+        params = {"n": n} if n > 1 else {}
+        stream = self.stream and n == 1
+        if not stream:
+            answer_fields = None
+        if shared and self.shared_completions:
+            key = request_key(
+                self.provider_pool.model_key,
+                messages,
+                response_format,
+                self.__key_params(params, answer_fields),
+                cache_sample.get(),
+            )
+            (response, call), reused = await self.shared_completions.get(
+                key,
+                lambda: self.__request(
+                    messages, response_format, params, phase, stream, answer_fields
+                ),
+            )
+        else:
+            response, call = await self.__request(
+                messages, response_format, params, phase, stream, answer_fields
+            )
+            reused = False
+
+        ledger.record(
+            phase=phase,
+            model=call.model,
+            input_tokens=call.input_tokens,
+            output_tokens=call.output_tokens,
+            latency=call.latency,
+            cached=call.cached,
+            shared=reused,
+            stragglers=0 if reused else call.stragglers,
+            time_to_first_token=call.time_to_first_token,
+            time_to_answer=call.time_to_answer,
+            stopped_early=call.stopped_early,
+        )
+        return response
+
+    @staticmethod
+    def __key_params(
+        params: Dict[str, Any], answer_fields: Optional[List[str]]
+    ) -> Dict[str, Any]:
+        """
+        The parameters to key a request by. Responses stopped after the answer
+        fields lack the other fields, so they are kept apart from full ones.
+        """
+        if not answer_fields:
+            return params
+        return {**params, "stop_after": sorted(answer_fields)}
+
+    async def __request(
+        self,
+        messages: List[Dict[str, Any]],
+        response_format: Any,
+        params: Dict[str, Any],
+        phase: str,
+        stream: bool,
+        answer_fields: Optional[List[str]],
+    ) -> Tuple[Any, LLMCall]:
+        cache_key = None
+        if self.response_cache:
+            cache_key = self.response_cache.key(
+                self.provider_pool.model_key,
+                messages,
+                response_format,
+                self.__key_params(params, answer_fields),
+            )
+            cached = await self.scheduler.run_blocking(
+                self.response_cache.get, cache_key
+            )
+            if cached is not None:
+                response = load_response(cached, response_format)
+                return response, LLMCall(
+                    phase=phase,
+                    model=self.provider_pool.model_key,
+                    input_tokens=response.usage.prompt_tokens,
+                    output_tokens=response.usage.completion_tokens,
+                    latency=0.0,
+                    cached=True,
+                )
+
+        (
+            response,
+            provider,
+            latency,
+            stragglers,
+            timing,
+        ) = await self.provider_pool.complete(
+            messages,
+            response_format,
+            params,
+            self.scheduler,
+            stream=stream,
+            answer_fields=answer_fields,
+        )
+        if cache_key:
+            await self.scheduler.run_blocking(
+                self.response_cache.put, cache_key, response
+            )
+
+        return response, LLMCall(
+            phase=phase,
+            model=provider.model,
+            input_tokens=response.usage.prompt_tokens,
+            output_tokens=response.usage.completion_tokens,
+            latency=latency,
+            stragglers=stragglers,
+            **(timing.model_dump() if timing else {}),
+        )
+
+    @staticmethod
+    def _response_output(response, choice: int = 0) -> Any:
+        message = response.choices[choice].message
+        return message.parsed if hasattr(message, "parsed") else message.content
 
     @abstractmethod
-    def solve(self, problem: Problem) -> Tuple[BaseModel, List[Dict[str, Any]]]:
+    async def solve(
+        self, problem: Problem
+    ) -> Tuple[BaseModel, List[Dict[str, Any]], UsageLedger]:
         """
         Solve the given problem.
 
@@ -25,5 +197,25 @@ class Solver(ABC):
             A tuple containing:
             - The solution to the problem
             - The conversation history with the LLM
+            - The ledger of the LLM calls made for this solve
         """
         pass
+
+    async def solve_batch(
+        self, problem: Problem, n: int
+    ) -> List[Tuple[Any, List[Dict[str, Any]], UsageLedger]]:
+        """
+        Solve the given problem `n` times.
+
+        Solvers whose whole solve is a single completion can override this to
+        sample all solutions from one request. By default, the solves run
+        concurrently.
+
+        Args:
+            problem: The problem to solve
+            n: The number of solutions to produce
+
+        Returns:
+            One (solution, conversation, ledger) tuple per solution
+        """
+        return list(await asyncio.gather(*(self.solve(problem) for _ in range(n))))
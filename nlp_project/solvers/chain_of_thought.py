@@ -1,23 +1,27 @@
-from typing import Any, Dict, List, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
 from pydantic import BaseModel
 
+from nlp_project.clients.scheduler import RequestScheduler
+from nlp_project.clients.shared_completions import SharedCompletions
+from nlp_project.clients.usage import UsageLedger
 from nlp_project.dataset.base_problem import Problem
 from nlp_project.solvers.base_solver import Solver
 
 
 class ChainOfThoughtSolver(Solver):
-    def __init__(self, system_message: str):
-        super().__init__()
+    def __init__(
+        self,
+        system_message: str,
+        scheduler: Optional[RequestScheduler] = None,
+        shared_completions: Optional[SharedCompletions] = None,
+        stream: bool = False,
+    ):
+        super().__init__(scheduler, shared_completions, stream)
         self.system_message = system_message
 
-    def solve(self, problem: Problem) -> Tuple[BaseModel, List[Dict[str, Any]]]:
-        if issubclass(problem.response_format, BaseModel):
-            completion_model = self.openai_client.beta.chat.completions.parse
-        else:
-            completion_model = self.openai_client.chat.completions.create
-
-        messages = [
+    def __messages(self, problem: Problem) -> List[Dict[str, Any]]:
+        return [
             {"role": "system", "content": self.system_message},
             {"role": "user", "content": problem.statement},
             {
@@ -26,23 +30,53 @@ class ChainOfThoughtSolver(Solver):
             },
         ]
 
-        response = completion_model(
-            model=self.llm_config.model,
-            messages=messages,
-            response_format=problem.response_format,
-        )
+    async def solve(
+        self, problem: Problem
+    ) -> Tuple[BaseModel, List[Dict[str, Any]], UsageLedger]:
+        ledger = UsageLedger()
+        messages = self.__messages(problem)
 
-        self.token_usage = {
-            "input_tokens": response.usage.prompt_tokens,
-            "output_tokens": response.usage.completion_tokens,
-        }
+        response = await self._complete(
+            messages,
+            problem.response_format,
+            ledger,
+            phase="solution",
+            shared=True,
+            answer_fields=problem.answer_fields,
+        )
 
         conversation = messages.copy()
         conversation.append(
             {"role": "assistant", "content": response.choices[0].message.content}
         )
 
-        if hasattr(response.choices[0].message, "parsed"):
-            return response.choices[0].message.parsed, conversation
+        return self._response_output(response), conversation, ledger
+
+    async def solve_batch(
+        self, problem: Problem, n: int
+    ) -> List[Tuple[BaseModel, List[Dict[str, Any]], UsageLedger]]:
+        """
+        Sample `n` solutions from a single completion request, so the prompt is
+        sent and billed once. The request's tokens are divided evenly between
+        the solutions' ledgers.
+        """
+        batch_ledger = UsageLedger()
+        messages = self.__messages(problem)
+
+        response = await self._complete(
+            messages, problem.response_format, batch_ledger, phase="solution", n=n
+        )
 
-        return response.choices[0].message.content, conversation
+        results = []
+        for choice, ledger in enumerate(batch_ledger.split(len(response.choices))):
+            conversation = messages.copy()
+            conversation.append(
+                {
+                    "role": "assistant",
+                    "content": response.choices[choice].message.content,
+                }
+            )
+            results.append(
+                (self._response_output(response, choice), conversation, ledger)
+            )
+        return results
@@ -1,8 +1,11 @@
-import concurrent.futures
-from typing import Any, Dict, List, Tuple
+import asyncio
+from typing import Any, Dict, List, Optional, Tuple
 
 from pydantic import BaseModel, Field
 
+from nlp_project.clients.scheduler import RequestScheduler
+from nlp_project.clients.shared_completions import SharedCompletions
+from nlp_project.clients.usage import UsageLedger
 from nlp_project.dataset.base_problem import Problem
 from nlp_project.solvers.base_solver import Solver
 
@@ -33,12 +36,18 @@ class EdgeCases(BaseModel):
 
 
 class DynamicFewShotSolver(Solver):
-    def __init__(self, system_message: str):
-        super().__init__()
+    def __init__(
+        self,
+        system_message: str,
+        scheduler: Optional[RequestScheduler] = None,
+        shared_completions: Optional[SharedCompletions] = None,
+        stream: bool = False,
+    ):
+        super().__init__(scheduler, shared_completions, stream)
         self.system_message = system_message
 
-    def __generate_edge_cases(
-        self, problem: Problem
+    async def __generate_edge_cases(
+        self, problem: Problem, ledger: UsageLedger
     ) -> Tuple[list[EdgeCase], List[Dict[str, Any]]]:
         edge_case_messages = [
             {
@@ -67,10 +76,8 @@ class DynamicFewShotSolver(Solver):
             },
         ]
 
-        response = self.openai_client.beta.chat.completions.parse(
-            model=self.llm_config.model,
-            messages=edge_case_messages,
-            response_format=EdgeCases,
+        response = await self._complete(
+            edge_case_messages, EdgeCases, ledger, phase="edge_cases"
         )
 
         edge_case_messages.append(
@@ -87,25 +94,14 @@ class DynamicFewShotSolver(Solver):
             ]
         )
 
-    def __get_initial_solution(self, problem: Problem, completion_model, messages):
-        response = completion_model(
-            model=self.llm_config.model,
-            messages=messages,
-            response_format=problem.response_format,
-        )
-
-        return response
-
-    def solve(self, problem: Problem) -> Tuple[BaseModel, List[Dict[str, Any]]]:
+    async def solve(
+        self, problem: Problem
+    ) -> Tuple[BaseModel, List[Dict[str, Any]], UsageLedger]:
         if not problem.solution_evaluator:
             raise ValueError(
                 "Problem must have a solution evaluator to use this solver."
             )
-        if issubclass(problem.response_format, BaseModel):
-            completion_model = self.openai_client.beta.chat.completions.parse
-        else:
-            completion_model = self.openai_client.chat.completions.create
-
+        ledger = UsageLedger()
         messages = [
             {"role": "system", "content": self.system_message},
             {"role": "user", "content": problem.statement},
@@ -116,19 +112,17 @@ class DynamicFewShotSolver(Solver):
         ]
 
         # Run edge case generation and initial solution concurrently
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            edge_case_future = executor.submit(self.__generate_edge_cases, problem)
-            solution_future = executor.submit(
-                self.__get_initial_solution, problem, completion_model, messages
-            )
-
-            edge_cases, edge_case_conversation = edge_case_future.result()
-            response = solution_future.result()
-
-        self.token_usage = {
-            "input_tokens": response.usage.prompt_tokens,
-            "output_tokens": response.usage.completion_tokens,
-        }
+        (edge_cases, edge_case_conversation), response = await asyncio.gather(
+            self.__generate_edge_cases(problem, ledger),
+            self._complete(
+                messages,
+                problem.response_format,
+                ledger,
+                phase="solution",
+                shared=True,
+                answer_fields=problem.answer_fields,
+            ),
+        )
 
         conversation_history = edge_case_conversation
         conversation = messages.copy()
@@ -136,23 +130,31 @@ class DynamicFewShotSolver(Solver):
             {"role": "assistant", "content": response.choices[0].message.content}
         )
 
-        final_response = (
-            response.choices[0].message.parsed
-            if hasattr(response.choices[0].message, "parsed")
-            else response.choices[0].message.content
-        )
+        final_response = self._response_output(response)
 
         evaluator = problem.solution_evaluator(final_response)
+        positives = [i for i, edge_case in enumerate(edge_cases) if edge_case.is_match]
+        negatives = [
+            i for i, edge_case in enumerate(edge_cases) if not edge_case.is_match
+        ]
 
+        # Evaluators may run untrusted code and block, so keep them off the loop
+        results = await self.scheduler.run_blocking(
+            evaluator,
+            [edge_cases[i].input for i in positives],
+            [edge_cases[i].input for i in negatives],
+        )
+        matched = dict(zip(positives, results.string_matches))
+        matched.update(zip(negatives, results.string_mismatches))
         failing_edge_cases = [
             edge_case
-            for edge_case in edge_cases
-            if evaluator(edge_case.input) != edge_case.is_match
+            for i, edge_case in enumerate(edge_cases)
+            if matched[i] != edge_case.is_match
         ]
 
         if not failing_edge_cases:
             conversation_history.extend(conversation)
-            return final_response, conversation_history
+            return final_response, conversation_history, ledger
 
         edge_case_str = self.__stringify_edge_cases(failing_edge_cases)
 
@@ -163,24 +165,19 @@ class DynamicFewShotSolver(Solver):
             }
         )
 
-        response = completion_model(
-            model=self.llm_config.model,
-            messages=conversation,
-            response_format=problem.response_format,
+        response = await self._complete(
+            conversation,
+            problem.response_format,
+            ledger,
+            phase="edge_case_refinement",
+            answer_fields=problem.answer_fields,
         )
 
-        self.token_usage["input_tokens"] += response.usage.prompt_tokens
-        self.token_usage["output_tokens"] += response.usage.completion_tokens
-
         conversation.append(
             {"role": "assistant", "content": response.choices[0].message.content}
         )
         conversation_history.extend(conversation)
 
-        final_response = (
-            response.choices[0].message.parsed
-            if hasattr(response.choices[0].message, "parsed")
-            else response.choices[0].message.content
-        )
+        final_response = self._response_output(response)
 
-        return final_response, conversation_history
+        return final_response, conversation_history, ledger
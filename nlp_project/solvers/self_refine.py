@@ -1,7 +1,10 @@
-from typing import Any, Dict, List, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
 from pydantic import BaseModel, Field
 
+from nlp_project.clients.scheduler import RequestScheduler
+from nlp_project.clients.shared_completions import SharedCompletions
+from nlp_project.clients.usage import UsageLedger
 from nlp_project.dataset.base_problem import Problem
 from nlp_project.solvers.base_solver import Solver
 
@@ -17,20 +20,33 @@ class Feedback(BaseModel):
 
 
 class SelfRefineSolver(Solver):
-    def __init__(self, system_message: str, max_iterations: int = 1):
+    def __init__(
+        self,
+        system_message: str,
+        max_iterations: int = 1,
+        scheduler: Optional[RequestScheduler] = None,
+        shared_completions: Optional[SharedCompletions] = None,
+        stream: bool = False,
+    ):
         """
         Initialize the SelfRefineSolver.
 
         Args:
             system_message: The system message to use for LLM calls
             max_iterations: Maximum number of refine iterations to perform
+            scheduler: The request scheduler shared across the experiment
+            shared_completions: First-turn completions shared with other
+                solvers, if any
+            stream: Stream completions to time them. Self-Refine's feedback
+                reads the reasoning of each solution, so its streams always
+                run to the end.
         """
-        super().__init__()
+        super().__init__(scheduler, shared_completions, stream)
         self.system_message = system_message
         self.max_iterations = max_iterations
 
-    def __generate_feedback(
-        self, problem: Problem, current_solution: Any
+    async def __generate_feedback(
+        self, problem: Problem, current_solution: Any, ledger: UsageLedger
     ) -> Tuple[Feedback, List[Dict[str, Any]]]:
         """
         Generate feedback on the current solution.
@@ -38,6 +54,7 @@ class SelfRefineSolver(Solver):
         Args:
             problem: The problem being solved
             current_solution: The current solution to evaluate
+            ledger: The ledger of the current solve
 
         Returns:
             Tuple containing feedback and the feedback conversation
@@ -69,10 +86,8 @@ class SelfRefineSolver(Solver):
             },
         ]
 
-        response = self.openai_client.beta.chat.completions.parse(
-            model=self.llm_config.model,
-            messages=feedback_messages,
-            response_format=Feedback,
+        response = await self._complete(
+            feedback_messages, Feedback, ledger, phase="feedback"
         )
 
         feedback_messages.append(
@@ -98,7 +113,9 @@ class SelfRefineSolver(Solver):
 
         return f"Issues identified:\n{issues_str}\n\nSuggestions for improvement:\n{suggestions_str}"
 
-    def solve(self, problem: Problem) -> Tuple[Any, List[Dict[str, Any]]]:
+    async def solve(
+        self, problem: Problem
+    ) -> Tuple[Any, List[Dict[str, Any]], UsageLedger]:
         """
         Solve the given problem with iterative self-refinement.
 
@@ -109,11 +126,9 @@ class SelfRefineSolver(Solver):
             A tuple containing:
             - The final solution to the problem
             - The complete conversation history
+            - The ledger of the LLM calls made for this solve
         """
-        if issubclass(problem.response_format, BaseModel):
-            completion_model = self.openai_client.beta.chat.completions.parse
-        else:
-            completion_model = self.openai_client.chat.completions.create
+        ledger = UsageLedger()
 
         # Initial solution
         messages = [
@@ -125,41 +140,36 @@ class SelfRefineSolver(Solver):
             },
         ]
 
-        response = completion_model(
-            model=self.llm_config.model,
-            messages=messages,
-            response_format=problem.response_format,
+        # The other solvers stop streaming their first turn after the answer,
+        # so it can only be shared when streams run to the end
+        response = await self._complete(
+            messages,
+            problem.response_format,
+            ledger,
+            phase="solution",
+            shared=not self.stream,
         )
 
-        self.token_usage = {
-            "input_tokens": response.usage.prompt_tokens,
-            "output_tokens": response.usage.completion_tokens,
-        }
-
         conversation_history = []
         conversation = messages.copy()
         conversation.append(
             {"role": "assistant", "content": response.choices[0].message.content}
         )
 
-        current_solution = (
-            response.choices[0].message.parsed
-            if hasattr(response.choices[0].message, "parsed")
-            else response.choices[0].message.content
-        )
+        current_solution = self._response_output(response)
 
         # Refinement loop
         for iteration in range(self.max_iterations):
             # Get feedback for refinement
-            feedback, feedback_conversation = self.__generate_feedback(
-                problem, current_solution
+            feedback, feedback_conversation = await self.__generate_feedback(
+                problem, current_solution, ledger
             )
 
             # If no issues found, we're done
             if not feedback.issues:
                 conversation_history.extend(conversation)
                 conversation_history.extend(feedback_conversation)
-                return current_solution, conversation_history
+                return current_solution, conversation_history, ledger
 
             # Add feedback to conversation
             feedback_str = self.__stringify_feedback(feedback)
@@ -171,26 +181,17 @@ class SelfRefineSolver(Solver):
             )
 
             # Get refined solution
-            response = completion_model(
-                model=self.llm_config.model,
-                messages=conversation,
-                response_format=problem.response_format,
+            response = await self._complete(
+                conversation, problem.response_format, ledger, phase="refinement"
             )
 
-            self.token_usage["input_tokens"] += response.usage.prompt_tokens
-            self.token_usage["output_tokens"] += response.usage.completion_tokens
-
             conversation.append(
                 {"role": "assistant", "content": response.choices[0].message.content}
             )
 
-            current_solution = (
-                response.choices[0].message.parsed
-                if hasattr(response.choices[0].message, "parsed")
-                else response.choices[0].message.content
-            )
+            current_solution = self._response_output(response)
 
         # Add all conversations to history
         conversation_history.extend(conversation)
 
-        return current_solution, conversation_history
+        return current_solution, conversation_history, ledger
@@ -0,0 +1,42 @@
+import pytest
+from pydantic import ValidationError
+
+from nlp_project.adaptive_sampling import AdaptiveSampling, SampleBudget
+
+
+@pytest.fixture
+def sampling():
+    return AdaptiveSampling(min_samples=2, max_samples=6, confidence=0.9, tolerance=0.3)
+
+
+@pytest.mark.parametrize(
+    "scores, expected",
+    [
+        ([], False),
+        ([1.0], False),
+        ([1.0, 1.0], True),
+        ([0.0, 0.0], True),
+        ([1.0, 0.0], False),
+        ([1.0, 0.0, 1.0], False),
+        ([1.0, 0.0, 1.0, 0.0, 1.0, 0.0], True),
+    ],
+)
+def test_is_settled(sampling, scores, expected):
+    assert sampling.is_settled(scores) == expected
+
+
+def test_half_width_shrinks_with_more_agreeing_samples(sampling):
+    widths = [sampling.half_width([1.0] * n) for n in range(1, 6)]
+
+    assert widths == sorted(widths, reverse=True)
+
+
+def test_max_samples_must_cover_min_samples():
+    with pytest.raises(ValidationError):
+        AdaptiveSampling(min_samples=4, max_samples=3)
+
+
+def test_budget_is_shared_until_exhausted():
+    budget = SampleBudget(2)
+
+    assert [budget.take() for _ in range(3)] == [True, True, False]
@@ -0,0 +1,106 @@
+import pytest
+import yaml
+
+from nlp_project.cost_model import (
+    CostModel,
+    load_cost_model,
+    load_report_summary,
+    solver_seconds_from_summaries,
+)
+from nlp_project.result_sink import ResultRecord, ResultSink
+
+
+def summary(times, output_tokens, total_problems=10, num_iterations=2):
+    return {
+        "total_problems": total_problems,
+        "num_iterations": num_iterations,
+        "avg_generation_time_per_model": times,
+        "total_tokens_per_model": {
+            solver_name: {"input_tokens": 0, "output_tokens": tokens}
+            for solver_name, tokens in output_tokens.items()
+        },
+    }
+
+
+def test_untimed_solvers_are_estimated_from_tokens():
+    summaries = [
+        summary({}, {"Old": 4000}),
+        summary({"CoT": 2.0}, {"CoT": 2000}),
+    ]
+
+    solver_seconds = solver_seconds_from_summaries(summaries)
+
+    assert solver_seconds["CoT"] == 2.0
+    # 100 tokens per iteration take 2 seconds, so 200 tokens take 4
+    assert solver_seconds["Old"] == pytest.approx(4.0)
+
+
+def test_adaptively_sampled_solvers_are_averaged_over_their_samples():
+    adaptive = summary({}, {"Old": 4000, "New": 4000})
+    adaptive["samples_per_model"] = {"Old": 20, "New": 40}
+    timed = summary({"CoT": 2.0}, {"CoT": 2000})
+
+    solver_seconds = solver_seconds_from_summaries([adaptive, timed])
+
+    assert solver_seconds["Old"] == pytest.approx(4.0)
+    assert solver_seconds["New"] == pytest.approx(2.0)
+
+
+def test_expected_seconds_falls_back_to_solver_then_overall_average():
+    model = CostModel(
+        solver_seconds={"CoT": 3.0, "SelfRefine": 9.0},
+        pair_seconds={("CoT", "hard"): 7.0},
+    )
+
+    assert model.expected_seconds("CoT", "hard") == 7.0
+    assert model.expected_seconds("CoT", "easy") == 3.0
+    assert model.expected_seconds("New", "easy") == 6.0
+    assert model.longest_first(
+        [("CoT", "easy"), ("CoT", "hard"), ("SelfRefine", "easy")]
+    ) == [("SelfRefine", "easy"), ("CoT", "hard"), ("CoT", "easy")]
+
+
+def test_load_cost_model_prefers_recorded_iterations(tmp_path):
+    with open(tmp_path / "experiment_report_20250101_000000.yaml", "w") as f:
+        f.write(
+            "details: {}\n"
+            "summary:\n"
+            "  avg_generation_time_per_model:\n"
+            "    CoT: 3.0\n"
+            "    SelfRefine: 9.0\n"
+        )
+    with ResultSink(tmp_path / "run_20250102_000000" / "results.jsonl") as sink:
+        for iteration, generation_time in enumerate([1.0, 2.0], start=1):
+            sink.append(
+                ResultRecord(
+                    solver_name="CoT",
+                    problem_name="p",
+                    iteration=iteration,
+                    output=None,
+                    score=1.0,
+                    generation_time=generation_time,
+                )
+            )
+
+    model = load_cost_model(tmp_path)
+
+    assert model.expected_seconds("CoT", "p") == 1.5
+    assert model.expected_seconds("SelfRefine", "p") == 9.0
+
+
+@pytest.mark.parametrize("sort_keys", [False, True])
+def test_report_summary_is_read_before_or_after_the_details(tmp_path, sort_keys):
+    report_file = tmp_path / "experiment_report.yaml"
+    with open(report_file, "w") as f:
+        yaml.dump(
+            {
+                "summary": summary({"CoT": 2.0}, {"CoT": 2000}),
+                "details": {"CoT": {"summary": "not the report's"}},
+                "errors": [],
+            },
+            f,
+            default_flow_style=False,
+            sort_keys=sort_keys,
+        )
+
+    assert load_report_summary(report_file) == summary({"CoT": 2.0}, {"CoT": 2000})
@@ -0,0 +1,384 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from nlp_project import experiment
+from nlp_project.clients import openai_client
+from nlp_project.clients.openai_client import LLMConfig
+from nlp_project.clients.providers import chat_completion
+from nlp_project.clients.response_cache import cache_sample
+from nlp_project.clients.scheduler import RequestScheduler
+from nlp_project.clients.shared_completions import SharedCompletions
+from nlp_project.clients.usage import UsageLedger
+from nlp_project.cost_model import CostModel
+from nlp_project.dataset.base_problem import Problem
+from nlp_project.dataset.regex_models import RegexResponse
+from nlp_project.experiment import (
+    ERRORS_FILE,
+    NUM_ITERATIONS,
+    PROBLEMS_FILE,
+    RESULTS_FILE,
+    _run_cells,
+    build_experiment_report,
+    evaluate_iteration,
+    evaluate_problem,
+    generate_summary,
+    load_completed_cells,
+    load_problem_sample,
+    remaining_pairs,
+    unresolved_errors,
+)
+from nlp_project.result_sink import ErrorRecord, ResultRecord, ResultSink, read_records
+from nlp_project.solvers.chain_of_thought import ChainOfThoughtSolver
+
+SOLVER = "ChainOfThoughtSolver"
+
+
+class FakeSolver:
+    """
+    Answers every problem at once and records which iterations it solved.
+    """
+
+    def __init__(self, scheduler: RequestScheduler):
+        self.scheduler = scheduler
+        self.provider_pool = None
+        self.shared_completions = None
+        self.solved: list[tuple[str, int]] = []
+
+    async def solve(self, problem):
+        self.solved.append((problem.name, cache_sample.get()))
+        return "answer", [], UsageLedger()
+
+
+class FakeProviderPool:
+    """
+    Answers every request with as many choices as it asks for, and records the
+    parameters of each request.
+    """
+
+    model_key = "fake"
+    token_budget = None
+
+    def __init__(
+        self,
+        prompt_tokens: int = 101,
+        completion_tokens: int = 23,
+        delay_seconds: float = 0.0,
+    ):
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.delay_seconds = delay_seconds
+        self.requests: list[dict] = []
+
+    async def complete(
+        self,
+        messages,
+        response_format,
+        params,
+        scheduler,
+        stream=False,
+        answer_fields=None,
+    ):
+        self.requests.append(params)
+        await asyncio.sleep(self.delay_seconds)
+        texts = [
+            RegexResponse(regex=f"^{i}$", reasoning="digits").model_dump_json()
+            for i in range(params.get("n", 1))
+        ]
+        response = chat_completion(
+            "fake",
+            texts,
+            response_format,
+            # Tell apart the requests of different problems
+            self.prompt_tokens + len(messages[1]["content"]),
+            self.completion_tokens,
+        )
+        return response, SimpleNamespace(model="fake"), 0.1, 0, None
+
+
+@pytest.fixture
+def batch_solver(monkeypatch, scheduler):
+    monkeypatch.setattr(
+        openai_client,
+        "_llm_config",
+        LLMConfig(
+            model="fake",
+            embeddings_model="fake",
+            base_url="http://127.0.0.1:9",
+            api_key="fake",
+        ),
+    )
+    solver = ChainOfThoughtSolver("Write a regex.", scheduler=scheduler)
+    solver.provider_pool = FakeProviderPool()
+    return solver
+
+
+def regex_problem(name="lines with a digit"):
+    return Problem(
+        name=name,
+        statement=name,
+        scorer_fn=lambda output: 1.0,
+        response_format=RegexResponse,
+    )
+
+
+@pytest.fixture
+def scheduler():
+    scheduler = RequestScheduler(4)
+    yield scheduler
+    scheduler.shutdown()
+
+
+@pytest.fixture(autouse=True)
+def no_deadline(monkeypatch):
+    monkeypatch.setattr(experiment, "task_seconds", lambda: None)
+
+
+def make_record(problem_name, iteration, score=1.0):
+    return ResultRecord(
+        solver_name=SOLVER,
+        problem_name=problem_name,
+        iteration=iteration,
+        output="answer",
+        score=score,
+        generation_time=0.1,
+    )
+
+
+def make_problems(names):
+    return {
+        SOLVER: {
+            name: Problem(name=name, statement=name, scorer_fn=lambda output: 1.0)
+            for name in names
+        }
+    }
+
+
+def run_cells(run_dir, solver, problem_names):
+    return asyncio.run(
+        _run_cells(
+            run_dir,
+            {SOLVER: solver},
+            make_problems(problem_names),
+            problem_names,
+            load_completed_cells(run_dir),
+            batch_iterations=False,
+            adaptive_sampling=None,
+            cost_model=CostModel(),
+        )
+    )
+
+
+def cells(run_dir):
+    return sorted(
+        (record.problem_name, record.iteration)
+        for record in read_records([run_dir / RESULTS_FILE])
+    )
+
+
+def test_resume_runs_only_missing_cells_of_the_original_sample(tmp_path, scheduler):
+    (tmp_path / PROBLEMS_FILE).write_text(json.dumps(["p1", "p2"]))
+    with ResultSink(tmp_path / RESULTS_FILE) as sink:
+        for iteration in range(1, NUM_ITERATIONS + 1):
+            sink.append(make_record("p1", iteration))
+        sink.append(make_record("p2", 1))
+
+    problem_names = load_problem_sample(tmp_path, ["p1", "p2", "p3"], 1)
+    completed = load_completed_cells(tmp_path)
+    solver = FakeSolver(scheduler)
+    failures = run_cells(tmp_path, solver, problem_names)
+
+    assert problem_names == ["p1", "p2"]
+    assert len(remaining_pairs([SOLVER], problem_names, completed)) == (
+        NUM_ITERATIONS - 1
+    )
+    assert failures == 0
+    assert sorted(solver.solved) == [
+        ("p2", iteration) for iteration in range(2, NUM_ITERATIONS + 1)
+    ]
+    assert cells(tmp_path) == [
+        (name, iteration)
+        for name in ("p1", "p2")
+        for iteration in range(1, NUM_ITERATIONS + 1)
+    ]
+
+
+def test_cells_finished_after_resuming_from_a_truncated_write_are_kept(
+    tmp_path, scheduler
+):
+    (tmp_path / PROBLEMS_FILE).write_text(json.dumps(["p1"]))
+    with ResultSink(tmp_path / RESULTS_FILE) as sink:
+        for iteration in range(1, NUM_ITERATIONS):
+            sink.append(make_record("p1", iteration))
+    # The run crashed while writing its last cell
+    with open(tmp_path / RESULTS_FILE, "a") as f:
+        f.write(make_record("p1", NUM_ITERATIONS).model_dump_json()[:40])
+
+    solver = FakeSolver(scheduler)
+    run_cells(tmp_path, solver, ["p1"])
+    resumed = FakeSolver(scheduler)
+    run_cells(tmp_path, resumed, ["p1"])
+
+    assert solver.solved == [("p1", NUM_ITERATIONS)]
+    assert resumed.solved == []
+    assert cells(tmp_path) == [("p1", i) for i in range(1, NUM_ITERATIONS + 1)]
+
+
+def test_duplicate_records_of_a_cell_collapse_to_one(tmp_path):
+    with ResultSink(tmp_path / RESULTS_FILE) as sink:
+        sink.append(make_record("p1", 1, score=0.0))
+        sink.append(make_record("p1", 1, score=1.0))
+        sink.append(make_record("p1", 2))
+
+    completed = load_completed_cells(tmp_path)
+    report = build_experiment_report([tmp_path / RESULTS_FILE])
+
+    assert completed == {(SOLVER, "p1"): {1: 1.0, 2: 1.0}}
+    assert len(report[SOLVER]["p1"].results) == 2
+    assert len(remaining_pairs([SOLVER], ["p1"], completed)) == NUM_ITERATIONS - 2
+
+
+def test_cells_recorded_as_errors_are_retried(tmp_path, scheduler):
+    (tmp_path / PROBLEMS_FILE).write_text(json.dumps(["p1"]))
+    with ResultSink(tmp_path / RESULTS_FILE, tmp_path / ERRORS_FILE) as sink:
+        for iteration in range(1, NUM_ITERATIONS + 1):
+            if iteration == 2:
+                sink.append_error(
+                    ErrorRecord(
+                        solver_name=SOLVER,
+                        problem_name="p1",
+                        iteration=iteration,
+                        error="Connection error.",
+                        error_type="APIConnectionError",
+                        kind="transient",
+                    )
+                )
+            else:
+                sink.append(make_record("p1", iteration))
+    results_files = [tmp_path / RESULTS_FILE]
+    errors_files = [tmp_path / ERRORS_FILE]
+
+    assert [
+        error.iteration for error in unresolved_errors(results_files, errors_files)
+    ] == [2]
+
+    solver = FakeSolver(scheduler)
+    run_cells(tmp_path, solver, ["p1"])
+
+    assert solver.solved == [("p1", 2)]
+    assert unresolved_errors(results_files, errors_files) == []
+
+
+def test_solve_batch_samples_every_solution_in_one_request(batch_solver):
+    solutions = asyncio.run(batch_solver.solve_batch(regex_problem(), 3))
+
+    assert batch_solver.provider_pool.requests == [{"n": 3}]
+    assert [output.regex for output, _, _ in solutions] == ["^0$", "^1$", "^2$"]
+    assert sum(ledger.input_tokens for _, _, ledger in solutions) == 101 + len(
+        "lines with a digit"
+    )
+    assert sum(ledger.output_tokens for _, _, ledger in solutions) == 23
+    assert [ledger.output_tokens for _, _, ledger in solutions] == [9, 7, 7]
+
+
+def test_batched_iterations_are_recorded_separately(tmp_path, batch_solver):
+    problem = regex_problem()
+
+    async def evaluate():
+        with ResultSink(tmp_path / RESULTS_FILE) as sink:
+            return await evaluate_problem(
+                batch_solver, problem, SOLVER, sink, batch_iterations=True
+            )
+
+    failures = asyncio.run(evaluate())
+    records = list(read_records([tmp_path / RESULTS_FILE]))
+
+    assert failures == 0
+    assert batch_solver.provider_pool.requests == [{"n": NUM_ITERATIONS}]
+    assert sorted(record.iteration for record in records) == list(
+        range(1, NUM_ITERATIONS + 1)
+    )
+    assert sum(record.input_tokens for record in records) == 101 + len(problem.name)
+    assert sum(record.output_tokens for record in records) == 23
+
+
+def test_concurrent_solves_keep_separate_ledgers(batch_solver):
+    batch_solver.provider_pool.delay_seconds = 0.05
+    short, long = regex_problem("digits"), regex_problem("lines with three digits")
+
+    async def solve_both():
+        return await asyncio.gather(batch_solver.solve(short), batch_solver.solve(long))
+
+    (_, _, short_ledger), (_, _, long_ledger) = asyncio.run(solve_both())
+
+    assert len(short_ledger.calls) == len(long_ledger.calls) == 1
+    assert short_ledger.input_tokens == 101 + len(short.name)
+    assert long_ledger.input_tokens == 101 + len(long.name)
+
+
+def test_summary_of_a_run_without_results(tmp_path):
+    error = ErrorRecord(
+        solver_name=SOLVER,
+        problem_name="p1",
+        iteration=1,
+        error="Connection error.",
+        error_type="APIConnectionError",
+        kind="transient",
+    )
+    (tmp_path / RESULTS_FILE).touch()
+
+    summary = generate_summary(
+        build_experiment_report([tmp_path / RESULTS_FILE]), {}, [error]
+    )
+
+    assert (summary.total_problems, summary.total_solvers) == (0, 0)
+    assert summary.avg_score == 0.0
+    assert summary.avg_score_per_model == {}
+    assert summary.failed_cells_per_model == {SOLVER: 1}
+
+
+def test_summary_counts_the_recorded_samples(tmp_path):
+    with ResultSink(tmp_path / RESULTS_FILE) as sink:
+        sink.append(make_record("p1", 1))
+        sink.append(make_record("p1", 2))
+        sink.append(make_record("p2", 1))
+
+    summary = generate_summary(build_experiment_report([tmp_path / RESULTS_FILE]), {})
+
+    assert summary.samples_per_model == {SOLVER: 3}
+
+
+def test_shared_first_turns_are_counted_once_in_the_totals(tmp_path, batch_solver):
+    shared_completions = SharedCompletions()
+    solvers = {
+        name: ChainOfThoughtSolver(
+            "Write a regex.", batch_solver.scheduler, shared_completions
+        )
+        for name in ("First", "Second")
+    }
+    for solver in solvers.values():
+        solver.provider_pool = batch_solver.provider_pool
+    problem = regex_problem()
+
+    async def evaluate():
+        shared_completions.hold(problem.name, len(solvers))
+        return await asyncio.gather(
+            *(
+                shared_completions.scoped(
+                    problem.name, evaluate_iteration(solver, problem, name, 1)
+                )
+                for name, solver in solvers.items()
+            )
+        )
+
+    with ResultSink(tmp_path / RESULTS_FILE) as sink:
+        for record in asyncio.run(evaluate()):
+            sink.append(record)
+    summary = generate_summary(build_experiment_report([tmp_path / RESULTS_FILE]), {})
+    totals = summary.total_tokens_per_model.values()
+
+    assert len(batch_solver.provider_pool.requests) == 1
+    assert sum(usage.input_tokens for usage in totals) == 101 + len(problem.name)
+    assert sum(usage.output_tokens for usage in totals) == 23
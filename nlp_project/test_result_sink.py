@@ -0,0 +1,94 @@
+import pytest
+
+from nlp_project.dataset.regex_models import RegexResponse
+from nlp_project.result_sink import (
+    ErrorRecord,
+    ResultRecord,
+    ResultSink,
+    read_errors,
+    read_records,
+)
+
+
+@pytest.fixture
+def results_file(tmp_path):
+    return tmp_path / "results.jsonl"
+
+
+def make_record(iteration, output=None):
+    return ResultRecord(
+        solver_name="ChainOfThoughtSolver",
+        problem_name="lines with digits",
+        iteration=iteration,
+        output=output or RegexResponse(regex=r"^.*\d.*$", reasoning="digits"),
+        score=1.0,
+        generation_time=0.5,
+        input_tokens=10,
+        output_tokens=5,
+        conversation=[{"role": "user", "content": "lines with digits"}],
+    )
+
+
+def test_append_and_read_records(results_file):
+    with ResultSink(results_file) as sink:
+        sink.append(make_record(1))
+        sink.append(make_record(2, output="plain text"))
+
+    records = list(read_records([results_file]))
+
+    assert [record.iteration for record in records] == [1, 2]
+    assert records[0].output == {"regex": r"^.*\d.*$", "reasoning": "digits"}
+    assert records[1].output == "plain text"
+    assert records[0].conversation == [{"role": "user", "content": "lines with digits"}]
+
+
+def test_sink_appends_to_existing_file(results_file):
+    with ResultSink(results_file) as sink:
+        sink.append(make_record(1))
+    with ResultSink(results_file) as sink:
+        sink.append(make_record(2))
+
+    assert len(list(read_records([results_file]))) == 2
+
+
+def test_truncated_record_is_skipped(results_file):
+    with ResultSink(results_file) as sink:
+        sink.append(make_record(1))
+    with open(results_file, "a") as f:
+        f.write('{"solver_name": "ChainOfThoughtSolver", "problem_na')
+
+    records = list(read_records([results_file]))
+
+    assert [record.iteration for record in records] == [1]
+
+
+def test_records_appended_after_a_truncated_record_are_kept(results_file):
+    with ResultSink(results_file) as sink:
+        sink.append(make_record(1))
+    with open(results_file, "a") as f:
+        f.write('{"solver_name": "ChainOfThoughtSolver", "problem_na')
+    with ResultSink(results_file) as sink:
+        sink.append(make_record(2))
+        sink.append(make_record(3))
+
+    records = list(read_records([results_file]))
+
+    assert [record.iteration for record in records] == [1, 2, 3]
+
+
+def test_errors_go_to_their_own_file(results_file, tmp_path):
+    errors_file = tmp_path / "errors.jsonl"
+    error = ErrorRecord(
+        solver_name="ChainOfThoughtSolver",
+        problem_name="lines with digits",
+        iteration=2,
+        error="Connection error.",
+        error_type="APIConnectionError",
+        kind="transient",
+    )
+    with ResultSink(results_file, errors_file) as sink:
+        sink.append(make_record(1))
+        sink.append_error(error)
+
+    assert [record.iteration for record in read_records([results_file])] == [1]
+    assert list(read_errors([errors_file])) == [error]
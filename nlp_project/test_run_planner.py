@@ -0,0 +1,92 @@
+import pytest
+
+from nlp_project.clients.budget import BudgetConfig
+from nlp_project.clients.openai_client import LLMConfig, ProviderConfig
+from nlp_project.clients.usage import LLMCall
+from nlp_project.cost_model import CostModel
+from nlp_project.result_sink import ResultRecord, ResultSink
+from nlp_project.run_planner import SolverHistory, load_solver_history, plan_run
+
+
+def llm_config(**kwargs):
+    return LLMConfig(
+        model="fake",
+        embeddings_model="fake",
+        base_url="http://localhost",
+        api_key="fake",
+        budget=BudgetConfig(input_price_per_million=1.0, output_price_per_million=4.0),
+        **kwargs,
+    )
+
+
+def test_load_solver_history_prefers_recorded_iterations(tmp_path):
+    with open(tmp_path / "experiment_report_20250101_000000.yaml", "w") as f:
+        f.write(
+            "details: {}\n"
+            "summary:\n"
+            "  total_problems: 10\n"
+            "  num_iterations: 2\n"
+            "  total_tokens_per_model:\n"
+            "    CoT: {input_tokens: 2000, output_tokens: 4000}\n"
+            "    SelfRefine: {input_tokens: 8000, output_tokens: 6000}\n"
+        )
+    call = LLMCall(
+        phase="solution", model="fake", input_tokens=50, output_tokens=30, latency=1
+    )
+    with ResultSink(tmp_path / "run_20250102_000000" / "results.jsonl") as sink:
+        sink.append(
+            ResultRecord(
+                solver_name="CoT",
+                problem_name="p",
+                iteration=1,
+                output=None,
+                score=1.0,
+                generation_time=1.0,
+                input_tokens=50,
+                output_tokens=30,
+                llm_calls=[call],
+            )
+        )
+
+    history = load_solver_history(tmp_path)
+
+    assert history["CoT"] == SolverHistory(
+        input_tokens=50, output_tokens=30, requests=1
+    )
+    assert history["SelfRefine"] == SolverHistory(input_tokens=400, output_tokens=300)
+
+
+def test_plan_run_predicts_tokens_cost_and_wall_time():
+    history = {
+        "CoT": SolverHistory(input_tokens=1000, output_tokens=500, requests=1),
+        "SelfRefine": SolverHistory(input_tokens=3000, output_tokens=1500, requests=3),
+    }
+    pairs = [("CoT", "p")] * 10 + [("SelfRefine", "p")] * 10 + [("New", "p")] * 10
+    cost_model = CostModel(solver_seconds={"CoT": 2.0, "SelfRefine": 6.0})
+
+    plan = plan_run(pairs, history, cost_model, 4, llm_config())
+
+    assert plan.solvers["CoT"].input_tokens == 10_000
+    assert plan.solvers["New"].output_tokens == 10_000
+    assert plan.input_tokens == 60_000
+    assert plan.cost == pytest.approx(0.06 + 0.12)
+    assert plan.unknown_solvers == ["New"]
+    # 20 + 60 + 40 seconds of iterations over 4 slots
+    assert plan.wall_seconds == pytest.approx(30.0)
+    assert plan.bottleneck == "concurrency"
+
+
+def test_plan_run_is_bound_by_the_tightest_rate_limit():
+    history = {"CoT": SolverHistory(input_tokens=1000, output_tokens=500)}
+    config = llm_config(
+        providers=[
+            ProviderConfig(name="a", model="a", weight=3, tokens_per_minute=30_000),
+            ProviderConfig(name="b", model="b", weight=1, tokens_per_minute=20_000),
+        ]
+    )
+
+    plan = plan_run([("CoT", "p")] * 40, history, CostModel(), 64, config)
+
+    # 60,000 tokens: 45,000 to a (1.5 min), 15,000 to b (0.75 min)
+    assert plan.wall_seconds == pytest.approx(90.0)
+    assert plan.bottleneck == "a tokens_per_minute"
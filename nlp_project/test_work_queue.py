@@ -0,0 +1,94 @@
+import sqlite3
+import time
+
+import pytest
+
+from nlp_project.work_queue import DONE, FAILED, LEASED, PENDING, WorkQueue
+
+
+@pytest.fixture
+def queue(tmp_path):
+    work_queue = WorkQueue(tmp_path / "queue.sqlite3")
+    work_queue.enqueue(
+        [
+            ("ChainOfThoughtSolver", "lines with digits", 1),
+            ("ChainOfThoughtSolver", "lines with digits", 2),
+        ]
+    )
+    yield work_queue
+    work_queue.close()
+
+
+def test_queue_does_not_use_wal(tmp_path):
+    path = tmp_path / "queue.sqlite3"
+    connection = sqlite3.connect(path)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.close()
+
+    WorkQueue(path).close()
+
+    connection = sqlite3.connect(path)
+    assert connection.execute("PRAGMA journal_mode").fetchone() == ("delete",)
+    connection.close()
+
+
+def test_enqueue_ignores_known_cells(queue):
+    assert queue.enqueue([("ChainOfThoughtSolver", "lines with digits", 1)]) == 0
+    assert queue.counts() == {PENDING: 2}
+
+
+def test_claimed_tasks_are_not_handed_out_twice(queue):
+    first = queue.claim("worker-1")
+    second = queue.claim("worker-2")
+
+    assert {first.iteration, second.iteration} == {1, 2}
+    assert queue.claim("worker-3") is None
+    assert queue.counts() == {LEASED: 2}
+    assert not queue.is_drained()
+
+
+def test_expired_lease_is_reclaimed(queue):
+    queue.claim("worker-1", lease_seconds=-1)
+
+    task = queue.claim("worker-2")
+
+    assert task.iteration == 1
+    assert task.attempts == 2
+
+
+def test_heartbeat_extends_lease(queue):
+    task = queue.claim("worker-1", lease_seconds=0.5)
+    queue.claim("worker-1", lease_seconds=60)
+    queue.heartbeat("worker-1", [task.id], lease_seconds=60)
+    time.sleep(0.6)
+
+    assert queue.claim("worker-2") is None
+
+
+def test_complete_drains_queue(queue):
+    queue.complete(queue.claim("worker-1"))
+    queue.complete(queue.claim("worker-1"))
+
+    assert queue.counts() == {DONE: 2}
+    assert queue.is_drained()
+
+
+def test_failed_task_is_retried_until_attempts_run_out(queue):
+    queue.complete(queue.claim("worker-1"))
+    for _ in range(2):
+        queue.fail(queue.claim("worker-1"), "RateLimitError()", max_attempts=2)
+
+    assert queue.counts() == {DONE: 1, FAILED: 1}
+    assert queue.is_drained()
+
+    assert queue.requeue_failed() == 1
+    assert queue.claim("worker-1").attempts == 1
+
+
+def test_released_task_keeps_its_attempts(queue):
+    queue.release(queue.claim("worker-1"))
+
+    task = queue.claim("worker-2")
+
+    assert task.iteration == 1
+    assert task.attempts == 1
@@ -0,0 +1,203 @@
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Iterable, Optional, Union
+
+from pydantic import BaseModel
+
+DEFAULT_LEASE_SECONDS = 300.0
+DEFAULT_MAX_ATTEMPTS = 3
+
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+
+class WorkTask(BaseModel):
+    id: int
+    solver_name: str
+    problem_name: str
+    iteration: int
+    attempts: int
+
+
+class WorkQueue:
+    """
+    SQLite-backed queue of (solver, problem, iteration) tasks shared by any
+    number of worker processes.
+
+    Workers claim tasks under a time-limited lease and keep it alive with
+    heartbeats. A task whose lease expires (e.g. because its worker died) is
+    handed to the next worker that asks for one. Lease expiry uses wall-clock
+    time, so hosts sharing a queue file need reasonably synchronized clocks.
+    Hosts may share the file over a network filesystem, as long as it
+    supports file locks.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self.__lock = threading.Lock()
+        self.__connection = sqlite3.connect(
+            self.path, timeout=60, isolation_level=None, check_same_thread=False
+        )
+        with self.__lock:
+            # WAL keeps its index in shared memory, which processes on
+            # different hosts do not share, so the queue uses the rollback
+            # journal and its file locks. Converts queues created with WAL.
+            self.__connection.execute("PRAGMA journal_mode=DELETE")
+            self.__connection.execute("""
+                CREATE TABLE IF NOT EXISTS tasks (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    solver_name TEXT NOT NULL,
+                    problem_name TEXT NOT NULL,
+                    iteration INTEGER NOT NULL,
+                    status TEXT NOT NULL,
+                    lease_owner TEXT,
+                    lease_expires REAL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    error TEXT,
+                    UNIQUE (solver_name, problem_name, iteration)
+                )
+                """)
+
+    def enqueue(self, cells: Iterable[tuple[str, str, int]]) -> int:
+        """
+        Add (solver, problem, iteration) tasks to the queue. Tasks that are
+        already queued are left untouched.
+
+        Returns:
+            The number of newly queued tasks
+        """
+        with self.__lock:
+            cursor = self.__connection.executemany(
+                "INSERT OR IGNORE INTO tasks (solver_name, problem_name, iteration, status) "
+                "VALUES (?, ?, ?, ?)",
+                [(*cell, PENDING) for cell in cells],
+            )
+            return cursor.rowcount
+
+    def requeue_failed(self) -> int:
+        """
+        Give every failed task a new set of attempts.
+
+        Returns:
+            The number of requeued tasks
+        """
+        with self.__lock:
+            cursor = self.__connection.execute(
+                "UPDATE tasks SET status = ?, attempts = 0, error = NULL WHERE status = ?",
+                (PENDING, FAILED),
+            )
+            return cursor.rowcount
+
+    def claim(
+        self, worker_id: str, lease_seconds: float = DEFAULT_LEASE_SECONDS
+    ) -> Optional[WorkTask]:
+        """
+        Lease the next pending task, or a task whose lease has expired.
+
+        Returns:
+            The claimed task, or None if no task is available right now
+        """
+        now = time.time()
+        with self.__lock:
+            self.__connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.__connection.execute(
+                    "SELECT id, solver_name, problem_name, iteration, attempts FROM tasks "
+                    "WHERE status = ? OR (status = ? AND lease_expires < ?) "
+                    "ORDER BY id LIMIT 1",
+                    (PENDING, LEASED, now),
+                ).fetchone()
+                if row is None:
+                    self.__connection.execute("COMMIT")
+                    return None
+                self.__connection.execute(
+                    "UPDATE tasks SET status = ?, lease_owner = ?, lease_expires = ?, "
+                    "attempts = attempts + 1 WHERE id = ?",
+                    (LEASED, worker_id, now + lease_seconds, row[0]),
+                )
+                self.__connection.execute("COMMIT")
+            except BaseException:
+                self.__connection.execute("ROLLBACK")
+                raise
+        task_id, solver_name, problem_name, iteration, attempts = row
+        return WorkTask(
+            id=task_id,
+            solver_name=solver_name,
+            problem_name=problem_name,
+            iteration=iteration,
+            attempts=attempts + 1,
+        )
+
+    def heartbeat(
+        self,
+        worker_id: str,
+        task_ids: Iterable[int],
+        lease_seconds: float = DEFAULT_LEASE_SECONDS,
+    ) -> None:
+        """
+        Extend the leases the worker holds on the given tasks.
+        """
+        expires = time.time() + lease_seconds
+        with self.__lock:
+            self.__connection.executemany(
+                "UPDATE tasks SET lease_expires = ? "
+                "WHERE id = ? AND status = ? AND lease_owner = ?",
+                [(expires, task_id, LEASED, worker_id) for task_id in task_ids],
+            )
+
+    def complete(self, task: WorkTask) -> None:
+        with self.__lock:
+            self.__connection.execute(
+                "UPDATE tasks SET status = ?, lease_expires = NULL, error = NULL "
+                "WHERE id = ?",
+                (DONE, task.id),
+            )
+
+    def fail(
+        self, task: WorkTask, error: str, max_attempts: int = DEFAULT_MAX_ATTEMPTS
+    ) -> None:
+        """
+        Release a task that raised an error. It goes back to the queue until it
+        has used up its attempts, after which it is marked as failed.
+        """
+        status = FAILED if task.attempts >= max_attempts else PENDING
+        with self.__lock:
+            self.__connection.execute(
+                "UPDATE tasks SET status = ?, lease_owner = NULL, lease_expires = NULL, "
+                "error = ? WHERE id = ? AND status = ?",
+                (status, error, task.id, LEASED),
+            )
+
+    def release(self, task: WorkTask) -> None:
+        """
+        Put a claimed task back in the queue without counting the attempt, e.g.
+        when its worker stops before running it.
+        """
+        with self.__lock:
+            self.__connection.execute(
+                "UPDATE tasks SET status = ?, lease_owner = NULL, lease_expires = NULL, "
+                "attempts = attempts - 1 WHERE id = ? AND status = ?",
+                (PENDING, task.id, LEASED),
+            )
+
+    def counts(self) -> dict[str, int]:
+        with self.__lock:
+            rows = self.__connection.execute(
+                "SELECT status, COUNT(*) FROM tasks GROUP BY status"
+            ).fetchall()
+        return {status: count for status, count in rows}
+
+    def is_drained(self) -> bool:
+        """
+        Whether every task is either done or has failed for good.
+        """
+        counts = self.counts()
+        return not counts.get(PENDING) and not counts.get(LEASED)
+
+    def close(self) -> None:
+        with self.__lock:
+            self.__connection.close()
@@ -0,0 +1,36 @@
+import argparse
+
+from dotenv import load_dotenv
+
+from nlp_project.clients.scheduler import DEFAULT_MAX_IN_FLIGHT
+from nlp_project.experiment import plan_experiment
+from nlp_project.run_planner import format_plan
+
+load_dotenv()
+
+parser = argparse.ArgumentParser(
+    description="Predict the tokens, cost and wall time of an experiment from earlier reports."
+)
+parser.add_argument(
+    "--sample-size",
+    type=int,
+    default=None,
+    help="Number of problems to sample (default: all)",
+)
+parser.add_argument("--max-in-flight", type=int, default=DEFAULT_MAX_IN_FLIGHT)
+parser.add_argument(
+    "--run-dir", default=None, help="Plan only the missing cells of this run"
+)
+parser.add_argument("--reports-dir", default="reports")
+args = parser.parse_args()
+
+print(
+    format_plan(
+        plan_experiment(
+            args.sample_size,
+            max_in_flight=args.max_in_flight,
+            run_dir=args.run_dir,
+            reports_dir=args.reports_dir,
+        )
+    )
+)
@@ -0,0 +1,165 @@
+import argparse
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from nlp_project.clients.fake_server import FakeLLMServer, FakeServerConfig
+
+ROOT = Path(__file__).parent
+
+IMPORT_TARGETS = {
+    "experiment": "nlp_project.experiment",
+    "dataset": "nlp_project.dataset.regex_problem",
+    "scoring": "nlp_project.dataset.score_utils",
+}
+
+IMPORT_SCRIPT = """
+import sys, time
+start = time.perf_counter()
+__import__(sys.argv[1])
+print(time.perf_counter() - start)
+"""
+
+# Runs the experiment against the fake server at argv[1], with a configuration
+# in place of llm_config.toml so that no API key or cache is needed.
+FIRST_REQUEST_SCRIPT = """
+import sys
+from nlp_project.clients import openai_client
+openai_client._llm_config = openai_client.LLMConfig(
+    model="fake", embeddings_model="fake", base_url=sys.argv[1], api_key="fake"
+)
+from nlp_project.experiment import run_experiment
+run_experiment(1, run_dir=sys.argv[2])
+"""
+
+
+class FirstRequestServer(FakeLLMServer):
+    """
+    Fake server that records when the first completion or embedding request
+    arrives.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.first_request = threading.Event()
+        self.first_request_at = None
+
+    def admit(self, tokens, rng):
+        if not self.first_request.is_set():
+            self.first_request_at = time.monotonic()
+            self.first_request.set()
+        return super().admit(tokens, rng)
+
+    def handle_error(self, request, client_address):
+        # The experiment is killed mid-request once it has sent its first one
+        pass
+
+
+def import_seconds(module: str) -> tuple[float, float]:
+    """
+    Import `module` in a fresh interpreter.
+
+    Returns:
+        The seconds spent importing the module, and the wall time of the
+        process, interpreter startup included
+    """
+    start = time.perf_counter()
+    output = subprocess.run(
+        [sys.executable, "-c", IMPORT_SCRIPT, module],
+        cwd=ROOT,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return float(output.split()[-1]), time.perf_counter() - start
+
+
+def slowest_imports(module: str, top: int) -> list[tuple[float, str]]:
+    """
+    The `top` third-party packages imported by `module` with the longest
+    cumulative import time, in seconds, as reported by `python -X importtime`.
+    """
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stderr
+    imports = {}
+    for line in stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.removeprefix("import time:").split("|")
+        package = name.strip().split(".")[0]
+        if package != "nlp_project":
+            imports[package] = max(
+                imports.get(package, 0.0), int(cumulative) / 1_000_000
+            )
+    return sorted(((seconds, name) for name, seconds in imports.items()), reverse=True)[
+        :top
+    ]
+
+
+def first_request_seconds(timeout: float) -> float:
+    """
+    Start an experiment against a fake server and measure the time from
+    starting the process to its first request.
+    """
+    server = FirstRequestServer(("127.0.0.1", 0), FakeServerConfig())
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        with tempfile.TemporaryDirectory() as run_dir:
+            start = time.monotonic()
+            process = subprocess.Popen(
+                [sys.executable, "-c", FIRST_REQUEST_SCRIPT, server.base_url, run_dir],
+                cwd=ROOT,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+            try:
+                if not server.first_request.wait(timeout):
+                    raise TimeoutError(f"No request within {timeout} seconds")
+            finally:
+                process.kill()
+                process.wait()
+            return server.first_request_at - start
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+parser = argparse.ArgumentParser(
+    description=(
+        "Measure the import time of the experiment, the dataset and the scoring "
+        "modules, and the time from starting an experiment to its first request "
+        "(against a local fake LLM server)."
+    )
+)
+parser.add_argument("--repeat", type=int, default=5, help="Runs per measurement")
+parser.add_argument(
+    "--top", type=int, default=10, help="Slowest third-party imports to list"
+)
+parser.add_argument("--timeout", type=float, default=60.0)
+args = parser.parse_args()
+
+print(f"{'Target':<24}{'Import (s)':>12}{'Process (s)':>14}")
+for name, module in IMPORT_TARGETS.items():
+    runs = [import_seconds(module) for _ in range(args.repeat)]
+    print(
+        f"{name:<24}{statistics.median(r[0] for r in runs):>12.3f}"
+        f"{statistics.median(r[1] for r in runs):>14.3f}"
+    )
+
+seconds = [first_request_seconds(args.timeout) for _ in range(args.repeat)]
+print(f"{'first request':<24}{'':>12}{statistics.median(seconds):>14.3f}")
+
+if args.top:
+    print(f"\nSlowest imports of {IMPORT_TARGETS['experiment']}:")
+    for cumulative, name in slowest_imports(IMPORT_TARGETS["experiment"], args.top):
+        print(f"{cumulative:>8.3f}  {name}")
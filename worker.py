@@ -0,0 +1,34 @@
+import argparse
+
+from dotenv import load_dotenv
+
+from nlp_project.clients.scheduler import DEFAULT_MAX_IN_FLIGHT
+from nlp_project.experiment import run_worker
+
+load_dotenv()
+
+parser = argparse.ArgumentParser(
+    description="Work on the queue of an experiment started with work_queue=True."
+)
+parser.add_argument("run_dir", help="The run directory of the experiment")
+parser.add_argument("--max-in-flight", type=int, default=DEFAULT_MAX_IN_FLIGHT)
+parser.add_argument("--worker-id", default=None)
+parser.add_argument(
+    "--share-first-turn",
+    action="store_true",
+    help="Share each iteration's initial solution between the solvers",
+)
+parser.add_argument(
+    "--stream",
+    action="store_true",
+    help="Stream completions and stop solutions once their answer is complete",
+)
+args = parser.parse_args()
+
+run_worker(
+    args.run_dir,
+    max_in_flight=args.max_in_flight,
+    worker_id=args.worker_id,
+    share_first_turn=args.share_first_turn,
+    stream=args.stream,
+)